@@ -1,29 +1,43 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Union, Callable
+from typing import List, Dict, Any, Union, Callable, Iterator
 
 class BaseChunkStrategy(ABC):
     """
-    切块策略基类 - 使用二选一实现方式，更加灵活
+    切块策略基类 - 三个切块方法任选其一实现，更加灵活
     
-    开发者可以选择实现以下两个方法之一：
+    子类必须覆盖以下方法之一：
     1. chunk_no_meta - 只需返回文本列表（简单）
     2. chunk_with_meta - 返回带元数据的结果（高级）
+    3. iter_chunks - 逐个生成带元数据的结果（流式，适合超大文档）
     
-    不需要两个都实现，系统会自动处理。
+    其余方法的默认实现通过 _overrides 判断子类覆盖了哪个方法并转换结果；
+    一个都没有覆盖时，构造实例时 _check_implementation 抛出 NotImplementedError。
+    
+    策略实例会被系统缓存并在多个文档之间复用，可以在 __init__ 中一次性加载模型、词典等资源。
+    stateless = True 时所有工作线程共享同一个实例，只有切块过程中不修改实例属性（如缓冲区、计数器）的策略才能设置；
+    否则保持默认值，每个线程各持有一个实例。
     """
     
+    # 是否为无状态策略（无状态策略的实例会在线程间共享）
+    stateless = False
+    
     def __init__(self):
         """初始化时检测实现的方法类型"""
         # 在初始化时检查是否覆盖了其中一个方法
         self._check_implementation()
     
+    def _overrides(self, method_name: str) -> bool:
+        """检查子类是否覆盖了指定的切块方法"""
+        return getattr(self.__class__, method_name) != getattr(BaseChunkStrategy, method_name)
+    
     def _check_implementation(self):
         """检查子类是否正确实现了至少一个切块方法"""
-        has_text_impl = self.__class__.chunk_no_meta != BaseChunkStrategy.chunk_no_meta
-        has_meta_impl = self.__class__.chunk_with_meta != BaseChunkStrategy.chunk_with_meta
+        has_text_impl = self._overrides('chunk_no_meta')
+        has_meta_impl = self._overrides('chunk_with_meta')
+        has_iter_impl = self._overrides('iter_chunks')
         
-        if not (has_text_impl or has_meta_impl):
-            raise NotImplementedError(f"策略类 {self.__class__.__name__} 必须实现 chunk_no_meta 或 chunk_with_meta 方法之一")
+        if not (has_text_impl or has_meta_impl or has_iter_impl):
+            raise NotImplementedError(f"策略类 {self.__class__.__name__} 必须实现 chunk_no_meta、chunk_with_meta 或 iter_chunks 方法之一")
     
     def chunk_no_meta(self, file_path: str, chunk_size: int, overlap: int) -> List[str]:
         """
@@ -47,7 +61,8 @@ class BaseChunkStrategy(ABC):
         """
         将文档分割成多个带元数据的文本块
         
-        默认实现：如果子类实现了 chunk_no_meta，则为每个块添加空元数据
+        默认实现：如果子类实现了 iter_chunks，则收集其结果；
+        如果子类实现了 chunk_no_meta，则为每个块添加空元数据
         
         Args:
             file_path: 文档文件路径
@@ -57,16 +72,46 @@ class BaseChunkStrategy(ABC):
         Returns:
             包含内容和元数据的文本块列表
         """
+        # 如果子类实现了流式版本，收集全部结果
+        if self._overrides('iter_chunks'):
+            return list(self.iter_chunks(file_path, chunk_size, overlap))
+        
         # 如果子类实现了纯文本版本，为每个文本块添加空元数据
         text_chunks = self.chunk_no_meta(file_path, chunk_size, overlap)
         return [{"content": chunk, "meta": {}} for chunk in text_chunks]
     
+    def iter_chunks(self, file_path: str, chunk_size: int, overlap: int) -> Iterator[Dict[str, Any]]:
+        """
+        逐个生成带元数据的文本块（流式）
+        
+        超大文档建议直接实现此方法并使用 yield 返回每个块，系统会边生成边保存，
+        内存占用不再随文档大小增长。
+        
+        默认实现：子类覆盖了 chunk_with_meta 时从其结果中逐个取出，否则使用 chunk_no_meta 并添加空元数据；
+        如果 chunk_no_meta 本身是生成器函数，同样可以做到流式处理。
+        
+        Args:
+            file_path: 文档文件路径
+            chunk_size: 每个块的大小（字符数）
+            overlap: 相邻块之间的重叠字符数
+            
+        Yields:
+            包含内容和元数据的文本块 {"content": ..., "meta": {...}}
+        """
+        # 优先使用带元数据的实现
+        if self._overrides('chunk_with_meta'):
+            yield from self.chunk_with_meta(file_path, chunk_size, overlap)
+        else:
+            # 使用纯文本实现并添加空元数据
+            for chunk in self.chunk_no_meta(file_path, chunk_size, overlap):
+                yield {"content": chunk, "meta": {}}
+    
     def process_document(self, file_path: str, chunk_size: int, overlap: int) -> List[Dict[str, Any]]:
         """
         统一的文档处理方法，由系统调用
         
         这是对外暴露的主要方法，会根据子类实现的方法自动选择调用路径。
-        开发者不需要覆盖此方法。
+        开发者不需要覆盖此方法。需要流式处理时请使用 iter_chunks。
         
         Args:
             file_path: 文档文件路径
@@ -76,17 +121,7 @@ class BaseChunkStrategy(ABC):
         Returns:
             包含内容和元数据的文本块列表
         """
-        # 检测子类实现了哪个方法
-        has_text_impl = self.__class__.chunk_no_meta != BaseChunkStrategy.chunk_no_meta
-        has_meta_impl = self.__class__.chunk_with_meta != BaseChunkStrategy.chunk_with_meta
-        
-        # 优先使用带元数据的实现
-        if has_meta_impl:
-            return self.chunk_with_meta(file_path, chunk_size, overlap)
-        else:
-            # 使用纯文本实现并添加空元数据
-            text_chunks = self.chunk_no_meta(file_path, chunk_size, overlap)
-            return [{"content": chunk, "meta": {}} for chunk in text_chunks]
+        return list(self.iter_chunks(file_path, chunk_size, overlap))
     
     @abstractmethod
     def get_metadata(self) -> Dict[str, Any]:
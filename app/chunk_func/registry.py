@@ -0,0 +1,252 @@
+# 切块策略注册表
+import os
+import sys
+import hashlib
+import importlib
+import inspect
+import logging
+import threading
+import time
+from typing import List, Dict, Any, Optional, Type
+
+from .base import BaseChunkStrategy
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+STRATEGY_FILE_SUFFIX = '_strategy.py'
+# 两次完整扫描（逐个比较策略文件的 mtime）之间的最短间隔（秒），目录本身的 mtime 变化时立即重新扫描
+SCAN_INTERVAL = 2.0
+
+
+class StrategyRegistry:
+    """
+    进程级切块策略注册表
+
+    启动时扫描一次 chunk_func 目录，在内存中缓存每个 *_strategy.py 的元数据和策略类，以及按策略名称的索引。
+    之后的查询只检查目录的修改时间（新增、删除文件时变化），逐个比较策略文件 mtime 的完整扫描
+    最多每 SCAN_INTERVAL 秒执行一次，仅重新加载发生变化的文件；
+    策略文件被上传或删除时，也可以通过 invalidate 主动让对应条目失效。
+
+    策略类的识别方式与旧版 list_strategies 一致：模块命名空间中所有 BaseChunkStrategy 的子类都会注册，
+    包括从其他模块导入（重新导出）的类；同一个类只注册一次，优先归属定义它的文件。
+
+    注册表同时维护策略实例池：声明为 stateless 的策略在所有线程间共享一个实例，
+    其余策略每个线程各持有一个实例，策略文件变化后实例池随之失效。
+    """
+
+    def __init__(self, strategy_dir: str, package: str):
+        self.strategy_dir = strategy_dir
+        self.package = package
+        self._lock = threading.RLock()
+        # 文件名 -> {"mtime": float, "version": 文件内容哈希, "strategies": [{"cls": 策略类, "metadata": 元数据}]}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._scanned = False
+        self._last_scan = 0.0
+        self._dir_mtime: Optional[float] = None
+        # 扫描结果：按文件名排序的 (条目, 策略) 列表和按策略名称的索引
+        self._items: Optional[List[tuple]] = None
+        self._by_name: Dict[str, tuple] = {}
+        # 实例池：共享实例按策略类索引，线程内实例按代次（generation）整体失效
+        self._shared_instances: Dict[type, BaseChunkStrategy] = {}
+        self._local = threading.local()
+        self._generation = 0
+
+    def _module_path(self, filename: str) -> str:
+        return f"{self.package}.{filename[:-3]}"
+
+    def _load_entry(self, filename: str, mtime: float) -> Dict[str, Any]:
+        """导入（或重新导入）单个策略文件并提取其中的策略类"""
+        module_path = self._module_path(filename)
+        strategies = []
+        version = None
+        try:
+            # 策略版本取文件内容哈希，策略代码变化后切块缓存随之失效
+            with open(os.path.join(self.strategy_dir, filename), 'rb') as f:
+                version = hashlib.sha1(f.read()).hexdigest()
+
+            if module_path in sys.modules:
+                module = importlib.reload(sys.modules[module_path])
+            else:
+                module = importlib.import_module(module_path)
+
+            # 查找继承自BaseChunkStrategy的类（包括导入的类，重复的类在 _rebuild_index 中去除）
+            for name, obj in inspect.getmembers(module, inspect.isclass):
+                if issubclass(obj, BaseChunkStrategy) and obj is not BaseChunkStrategy:
+
+                    # 实例化策略并获取元数据
+                    metadata = dict(obj().get_metadata())
+
+                    # 添加显示名称
+                    if 'name' in metadata and 'display_name' not in metadata:
+                        metadata['display_name'] = metadata['name'].capitalize() + " 切块策略"
+
+                    strategies.append({"cls": obj, "metadata": metadata,
+                                       "defined_here": obj.__module__ == module.__name__})
+        except Exception as e:
+            logger.error(f"加载切块策略模块 {filename[:-3]} 时出错: {str(e)}")
+
+        return {"mtime": mtime, "version": version, "strategies": strategies}
+
+    def _dir_modified(self) -> Optional[float]:
+        try:
+            return os.stat(self.strategy_dir).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _ensure_scanned(self):
+        """需要时重新扫描（调用方持有锁）"""
+        dir_mtime = self._dir_modified()
+        if (not self._scanned or dir_mtime != self._dir_mtime
+                or time.monotonic() - self._last_scan >= SCAN_INTERVAL):
+            self._dir_mtime = dir_mtime
+            self._scan()
+
+    def _scan(self):
+        """比较目录中的策略文件与缓存条目，只重新加载新增或修改过的文件"""
+        current = {}
+        try:
+            with os.scandir(self.strategy_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith(STRATEGY_FILE_SUFFIX):
+                        current[entry.name] = entry.stat().st_mtime
+        except FileNotFoundError:
+            pass
+
+        # 移除已删除的策略文件
+        for filename in list(self._entries):
+            if filename not in current:
+                self._drop_entry(filename)
+
+        # 加载新增或修改过的策略文件
+        for filename, mtime in current.items():
+            cached = self._entries.get(filename)
+            if cached is None or cached["mtime"] != mtime:
+                self._entries[filename] = self._load_entry(filename, mtime)
+                self._reset_instances()
+
+        self._scanned = True
+        self._last_scan = time.monotonic()
+
+    def _rebuild_index(self):
+        """重建扫描结果（条目变化后调用）：同一个类只保留一次，优先保留定义它的文件中的条目"""
+        entries = [self._entries[name] for name in sorted(self._entries)]
+        seen = set()
+        items = []
+        for defined_pass in (True, False):
+            for entry in entries:
+                for item in entry["strategies"]:
+                    # 按定义位置判断是否同一个类（模块重新加载后类对象会变化）
+                    key = (item["cls"].__module__, item["cls"].__qualname__)
+                    if item["defined_here"] == defined_pass and key not in seen:
+                        seen.add(key)
+                        items.append((entry, item))
+        order = {id(entry): i for i, entry in enumerate(entries)}
+        items.sort(key=lambda pair: order[id(pair[0])])
+        self._items = items
+        self._by_name = {}
+        for entry, item in items:
+            self._by_name.setdefault(item["metadata"].get('name'), (entry, item))
+
+    def _drop_entry(self, filename: str):
+        self._entries.pop(filename, None)
+        sys.modules.pop(self._module_path(filename), None)
+        self._reset_instances()
+
+    def _reset_instances(self):
+        """清空实例池和扫描结果（策略类被重新加载后旧实例不再可用）"""
+        self._shared_instances.clear()
+        self._generation += 1
+        self._items = None
+
+    def refresh(self):
+        """立即扫描策略目录，同步缓存"""
+        with self._lock:
+            self._dir_mtime = self._dir_modified()
+            self._scan()
+
+    def invalidate(self, filename: Optional[str] = None):
+        """
+        让缓存条目失效
+
+        Args:
+            filename: 发生变化的策略文件名（如 xxx_strategy.py），为空时清空整个注册表
+        """
+        with self._lock:
+            if filename is None:
+                for name in list(self._entries):
+                    self._drop_entry(name)
+            else:
+                self._drop_entry(os.path.basename(filename))
+            # 下一次查询立即重新扫描，不等扫描间隔
+            self._scanned = False
+
+    def _snapshot(self):
+        """返回当前的扫描结果 (列表, 名称索引)"""
+        with self._lock:
+            self._ensure_scanned()
+            if self._items is None:
+                self._rebuild_index()
+            return self._items, self._by_name
+
+    def list_metadata(self) -> List[Dict[str, Any]]:
+        """获取所有策略的元数据（返回副本，调用方可以安全修改）"""
+        items, _ = self._snapshot()
+        return [dict(item["metadata"]) for _, item in items]
+
+    def get_strategy_class(self, strategy_name: str) -> Optional[Type[BaseChunkStrategy]]:
+        """根据策略名称获取策略类"""
+        _, by_name = self._snapshot()
+        found = by_name.get(strategy_name)
+        return found[1]["cls"] if found else None
+
+    def get_strategy_version(self, strategy_name: str) -> Optional[str]:
+        """获取策略的版本（所在策略文件的内容哈希），策略不存在时返回None"""
+        _, by_name = self._snapshot()
+        found = by_name.get(strategy_name)
+        return found[0]["version"] if found else None
+
+    def get_instance(self, strategy_name: str) -> Optional[BaseChunkStrategy]:
+        """
+        获取可复用的策略实例
+
+        策略在构造时加载的模型、词典、正则表等资源只会初始化一次：
+        stateless 策略全局共享同一个实例，其余策略按线程各缓存一个实例。
+
+        Args:
+            strategy_name: 策略名称
+
+        Returns:
+            策略实例，策略不存在时返回None
+        """
+        strategy_cls = self.get_strategy_class(strategy_name)
+        if strategy_cls is None:
+            return None
+
+        if getattr(strategy_cls, 'stateless', False):
+            with self._lock:
+                instance = self._shared_instances.get(strategy_cls)
+                if instance is None:
+                    instance = strategy_cls()
+                    self._shared_instances[strategy_cls] = instance
+                return instance
+
+        # 线程内实例池，注册表代次变化时整体丢弃
+        local_pool = getattr(self._local, 'pool', None)
+        if local_pool is None or self._local.generation != self._generation:
+            local_pool = {}
+            self._local.pool = local_pool
+            self._local.generation = self._generation
+
+        instance = local_pool.get(strategy_cls)
+        if instance is None:
+            instance = strategy_cls()
+            local_pool[strategy_cls] = instance
+        return instance
+
+
+# 全局策略注册表
+strategy_registry = StrategyRegistry(
+    strategy_dir=os.path.dirname(os.path.abspath(__file__)),
+    package=__package__
+)
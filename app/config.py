@@ -12,6 +12,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = BASE_DIR / 'data'
 UPLOADS_DIR = DATA_DIR / 'uploads'
 DB_DIR = DATA_DIR / 'db'
+CHUNK_CACHE_DIR = DATA_DIR / 'chunk_cache'  # 切块结果缓存目录
+BLOBS_DIR = DATA_DIR / 'blobs'  # 按内容哈希保存的上传文件
 STRATEGY_DIR = BASE_DIR / 'app' / 'chunk_func' # 切块函数目录
 DOCS_DIR = BASE_DIR / 'guide'  # 帮助文档目录
 
@@ -21,12 +23,36 @@ os.makedirs(DB_DIR, exist_ok=True)
 
 # 数据库配置
 DB_PATH = DB_DIR / 'chunklab.db'
-DATABASE_URL = f"sqlite:///{DB_PATH}"
+DATABASE_URL = os.getenv('DATABASE_URL', f"sqlite:///{DB_PATH}")
+
+# 数据库连接配置（PRAGMA仅对SQLite生效）
+DATABASE_CONFIG = {
+    'JOURNAL_MODE': os.getenv('DB_JOURNAL_MODE', 'WAL'),  # WAL模式下读操作不再被切块写入阻塞
+    'SYNCHRONOUS': os.getenv('DB_SYNCHRONOUS', 'NORMAL'),  # WAL模式下NORMAL即可保证数据库一致性
+    'MMAP_SIZE': int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024)),  # 内存映射大小（字节）
+    'CACHE_SIZE': int(os.getenv('DB_CACHE_SIZE', -64 * 1024)),  # 页缓存大小，负数表示KB
+    'BUSY_TIMEOUT': int(os.getenv('DB_BUSY_TIMEOUT', 30000)),  # 等待写锁的超时时间（毫秒）
+    'POOL_SIZE': int(os.getenv('DB_POOL_SIZE', 20)),  # 连接池常驻连接数，覆盖批量切块、Dify推送的并发工作线程
+    'MAX_OVERFLOW': int(os.getenv('DB_MAX_OVERFLOW', 20)),  # 连接池允许的额外连接数
+    'POOL_TIMEOUT': int(os.getenv('DB_POOL_TIMEOUT', 30)),  # 获取连接的超时时间（秒）
+}
 
 # Dify配置 - 从环境变量加载
 DIFY_CONFIG = {
     'API_SERVER': os.getenv('DIFY_API_SERVER', 'https://your-api-server-url'),
-    'API_KEY': os.getenv('DIFY_API_KEY', 'your-api-key')
+    'API_KEY': os.getenv('DIFY_API_KEY', 'your-api-key'),
+    'POOL_SIZE': int(os.getenv('DIFY_POOL_SIZE', 32)),  # HTTP连接池大小，应不小于推送和删除段落的并发线程数
+    'ASYNC_POOL_SIZE': int(os.getenv('DIFY_ASYNC_POOL_SIZE', 100)),  # 异步客户端（批量推送）的最大连接数
+    'BATCH_CONCURRENCY': int(os.getenv('DIFY_BATCH_CONCURRENCY', 64)),  # 批量推送时同时处理的文档数
+    'SEGMENT_BATCH_SIZE': int(os.getenv('DIFY_SEGMENT_BATCH_SIZE', 200)),  # 每次请求上传的段落数
+    'SEGMENT_UPLOAD_CONCURRENCY': int(os.getenv('DIFY_SEGMENT_UPLOAD_CONCURRENCY', 4)),  # 单个文档同时上传的批次数（大于1时Dify中的段落顺序可能与切块顺序不完全一致）
+    'SEGMENT_MAX_RETRIES': int(os.getenv('DIFY_SEGMENT_MAX_RETRIES', 3)),  # 单个批次的最大尝试次数
+    'INDEXING_POLL_WORKERS': int(os.getenv('DIFY_INDEXING_POLL_WORKERS', 8)),  # 索引状态监视器同时发出的查询数
+    'DELETE_RATE': float(os.getenv('DIFY_DELETE_RATE', 100)),  # 删除段落的全局速率上限（请求/秒）
+    'DELETE_CONCURRENCY': int(os.getenv('DIFY_DELETE_CONCURRENCY', 32)),  # 删除段落的全局并发上限
+    'PUSH_MODE': os.getenv('DIFY_PUSH_MODE', 'full'),  # 默认推送方式：full（完整推送）或 sync（只同步变化的切块）
+    'CONNECT_TIMEOUT': float(os.getenv('DIFY_CONNECT_TIMEOUT', 10)),  # 连接超时（秒）
+    'READ_TIMEOUT': float(os.getenv('DIFY_READ_TIMEOUT', 120)),  # 读取超时（秒）
 }
 
 # 应用配置
@@ -35,9 +61,28 @@ APP_CONFIG = {
     'PORT': 8410,
     'DEBUG': True,
     'ALLOWED_EXTENSIONS': {'.pdf', '.docx', '.xlsx', '.pptx', '.txt', '.dwg'},
-    'MAX_CONTENT_LENGTH': 16 * 1024 * 1024,  # 16MB
+    'MAX_CONTENT_LENGTH': int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024)),  # 单个上传文件的大小上限（字节），默认16MB，0表示不限制
+    'UPLOAD_CONCURRENCY': int(os.getenv('UPLOAD_CONCURRENCY', 8)),  # 文件夹上传时同时写入的文件数
+    'UPLOAD_COMMIT_BATCH_SIZE': int(os.getenv('UPLOAD_COMMIT_BATCH_SIZE', 100)),  # 文件夹上传时每个事务登记的文档数
     'DEFAULT_CHUNK_SIZE': 300,
     'DEFAULT_OVERLAP': 30,
+    'CHUNK_INSERT_BATCH_SIZE': 1000,  # 切块结果批量写入数据库时每批的行数
+    'CHUNK_EXECUTOR': os.getenv('CHUNK_EXECUTOR', 'thread'),  # 批量切块执行方式：thread（线程）或 process（多进程，适合CPU密集的解析）
+    'CHUNK_PROCESS_WORKERS': int(os.getenv('CHUNK_PROCESS_WORKERS', 0)),  # 多进程模式的进程数，0表示使用CPU核心数
+    'BATCH_SCHEDULE_ORDER': os.getenv('BATCH_SCHEDULE_ORDER', 'largest_first'),  # 批量切块调度顺序：largest_first、smallest_first 或 fifo
+    'CHUNK_CACHE_ENABLED': os.getenv('CHUNK_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes'),  # 是否缓存切块结果（相同文件和参数再次切块时不再解析）
+    'CHUNK_CACHE_MAX_SIZE_MB': int(os.getenv('CHUNK_CACHE_MAX_SIZE_MB', 1024)),  # 切块缓存的总大小上限（MB），超过时删除最久未使用的缓存，0表示不限制
+    'CHUNK_CACHE_MAX_AGE_DAYS': int(os.getenv('CHUNK_CACHE_MAX_AGE_DAYS', 30)),  # 切块缓存的保留天数（按最近使用时间），0表示不限制
+    'JOB_WORKER_MODE': os.getenv('JOB_WORKER_MODE', 'embedded'),  # 任务执行方式：embedded（Web进程内执行）或 external（由 worker.py 独立进程执行）
+    'JOB_WORKER_CONCURRENCY': int(os.getenv('JOB_WORKER_CONCURRENCY', 4)),  # 任务工作进程同时执行的任务数（批量任务内部另有并发）
+    'JOB_LEASE_SECONDS': int(os.getenv('JOB_LEASE_SECONDS', 60)),  # 任务租约时长（秒），工作进程退出后超过该时间任务重新排队
+    'JOB_HEARTBEAT_SECONDS': int(os.getenv('JOB_HEARTBEAT_SECONDS', 10)),  # 心跳间隔（秒），应明显小于租约时长
+    'JOB_POLL_INTERVAL': float(os.getenv('JOB_POLL_INTERVAL', 2)),  # 工作进程检查新任务和过期租约的间隔（秒）
+    'JOB_MAX_ATTEMPTS': int(os.getenv('JOB_MAX_ATTEMPTS', 3)),  # 任务最多执行次数，超过后标记为失败
+    'JOB_RETENTION_DAYS': int(os.getenv('JOB_RETENTION_DAYS', 7)),  # 已结束任务记录的保留天数，0表示不清理
+    'PROGRESS_SNAPSHOT_INTERVAL': float(os.getenv('PROGRESS_SNAPSHOT_INTERVAL', 2)),  # 进度推送：任务在其他进程执行时从数据库读取状态的间隔（秒），也是保活间隔
+    'CHUNK_PAGE_SIZE': 50,  # 切块列表每次加载的数量
+    'CHUNK_PREVIEW_LENGTH': 2000,  # 切块列表中内容的截断长度（字符数），0表示不截断
     'PASS_META_TO_DIFY': True,  # 是否将 meta 数据传递给 Dify
     'DIFY_DELETE_EXISTING_SEGMENTS': False,  # 是否删除Dify文档中现有的段落
 }
@@ -61,6 +106,28 @@ def get_config(key=None):
         return DIFY_CONFIG['API_SERVER']
     elif key == 'DIFY_API_KEY':
         return DIFY_CONFIG['API_KEY']
+    elif key == 'DIFY_POOL_SIZE':
+        return DIFY_CONFIG['POOL_SIZE']
+    elif key == 'DIFY_ASYNC_POOL_SIZE':
+        return DIFY_CONFIG['ASYNC_POOL_SIZE']
+    elif key == 'DIFY_BATCH_CONCURRENCY':
+        return DIFY_CONFIG['BATCH_CONCURRENCY']
+    elif key == 'DIFY_SEGMENT_BATCH_SIZE':
+        return DIFY_CONFIG['SEGMENT_BATCH_SIZE']
+    elif key == 'DIFY_SEGMENT_UPLOAD_CONCURRENCY':
+        return DIFY_CONFIG['SEGMENT_UPLOAD_CONCURRENCY']
+    elif key == 'DIFY_SEGMENT_MAX_RETRIES':
+        return DIFY_CONFIG['SEGMENT_MAX_RETRIES']
+    elif key == 'DIFY_INDEXING_POLL_WORKERS':
+        return DIFY_CONFIG['INDEXING_POLL_WORKERS']
+    elif key == 'DIFY_DELETE_RATE':
+        return DIFY_CONFIG['DELETE_RATE']
+    elif key == 'DIFY_DELETE_CONCURRENCY':
+        return DIFY_CONFIG['DELETE_CONCURRENCY']
+    elif key == 'DIFY_PUSH_MODE':
+        return DIFY_CONFIG['PUSH_MODE']
+    elif key == 'DIFY_TIMEOUT':
+        return (DIFY_CONFIG['CONNECT_TIMEOUT'], DIFY_CONFIG['READ_TIMEOUT'])
     elif key == 'PASS_META_TO_DIFY':
         return APP_CONFIG['PASS_META_TO_DIFY']
     elif key == 'DIFY_DELETE_EXISTING_SEGMENTS':
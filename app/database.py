@@ -1,13 +1,70 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, JSON, Text
+from sqlalchemy import create_engine, event, text, Column, Integer, String, ForeignKey, DateTime, JSON, Text, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 import json
 
-from .config import DATABASE_URL
+from .config import DATABASE_URL, DATABASE_CONFIG
+
+# PRAGMA 无法使用参数绑定，只接受以下取值（来自环境变量的配置在拼接前校验）
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+def _sqlite_pragmas() -> list:
+    """校验调优参数并生成PRAGMA语句，取值无效时抛出 ValueError"""
+    journal_mode = str(DATABASE_CONFIG['JOURNAL_MODE']).upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"无效的 DB_JOURNAL_MODE: {DATABASE_CONFIG['JOURNAL_MODE']}，可选: {', '.join(JOURNAL_MODES)}")
+    synchronous = str(DATABASE_CONFIG['SYNCHRONOUS']).upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"无效的 DB_SYNCHRONOUS: {DATABASE_CONFIG['SYNCHRONOUS']}，可选: {', '.join(SYNCHRONOUS_MODES)}")
+    return [
+        f"PRAGMA journal_mode={journal_mode}",
+        f"PRAGMA synchronous={synchronous}",
+        f"PRAGMA mmap_size={int(DATABASE_CONFIG['MMAP_SIZE'])}",
+        f"PRAGMA cache_size={int(DATABASE_CONFIG['CACHE_SIZE'])}",
+        f"PRAGMA busy_timeout={int(DATABASE_CONFIG['BUSY_TIMEOUT'])}",
+    ]
+
+def _pragma_listener(statements: list):
+    """生成连接事件的回调：为每个新的SQLite连接应用调优参数"""
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+    return set_sqlite_pragmas
+
+def _create_engine(url: str):
+    """根据数据库类型创建引擎并配置连接池"""
+    engine_kwargs = {}
+    is_sqlite = url.startswith("sqlite")
+    is_memory = is_sqlite and (url in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in url)
+    
+    if is_sqlite:
+        # 后台线程和请求线程共用连接池，需要关闭同线程检查
+        engine_kwargs["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": DATABASE_CONFIG['BUSY_TIMEOUT'] / 1000
+        }
+    
+    if not is_memory:
+        engine_kwargs.update(
+            pool_size=DATABASE_CONFIG['POOL_SIZE'],
+            max_overflow=DATABASE_CONFIG['MAX_OVERFLOW'],
+            pool_timeout=DATABASE_CONFIG['POOL_TIMEOUT'],
+            pool_pre_ping=not is_sqlite
+        )
+    
+    db_engine = create_engine(url, **engine_kwargs)
+    if is_sqlite:
+        event.listen(db_engine, "connect", _pragma_listener(_sqlite_pragmas()))
+    return db_engine
 
 # 创建数据库引擎
-engine = create_engine(DATABASE_URL)
+engine = _create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -51,6 +108,7 @@ class BatchTask(Base):
     dataset_id = Column(String(255), nullable=True)  # 只有to_dify任务需要
     
     status = Column(String(50))  # waiting/processing/completed/failed
+    error_message = Column(Text, nullable=True)  # 任务失败的原因
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     completed_at = Column(DateTime, nullable=True)
@@ -60,15 +118,60 @@ class BatchTask(Base):
     error_count = Column(Integer, default=0)
     
     document_ids = Column(JSON)  # 文档ID列表
-    task_results = Column(JSON)  # 处理结果
+    task_results = Column(JSON)  # 处理结果（旧版本的任务使用，新任务的结果逐行记录在 batch_task_items 中）
     settings = Column(JSON)  # 任务配置(chunk_size, overlap, strategy等)
     
     # 关联到文件夹
     folder = relationship("Folder", back_populates="batch_tasks")
+    # 每个文档的处理结果
+    items = relationship("BatchTaskItem", back_populates="task", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # 文件夹任务列表：按文件夹和任务类型筛选，按创建时间倒序
+        Index("ix_batch_tasks_folder_type_created", "folder_id", "task_type", "created_at"),
+    )
     
     def __repr__(self):
         return f"<BatchTask {self.name} ({self.status})>"
 
+# BatchTaskItem模型：批量任务中单个文档的处理结果，每处理完一个文档只更新对应的一行
+class BatchTaskItem(Base):
+    __tablename__ = "batch_task_items"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(String(36), ForeignKey("batch_tasks.id"), nullable=False)
+    document_id = Column(Integer, nullable=False)  # 不设外键，文档删除后仍保留任务记录
+    
+    status = Column(String(50), default="pending")  # pending/processing/completed/failed/skipped
+    error = Column(Text, nullable=True)
+    details = Column(JSON, nullable=True)  # 其他结果信息（如Dify推送成功和失败的段落区间）
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    task = relationship("BatchTask", back_populates="items")
+    
+    __table_args__ = (
+        UniqueConstraint("task_id", "document_id", name="uq_batch_task_items_task_document"),
+        # 按状态统计和筛选任务中的文档
+        Index("ix_batch_task_items_task_status", "task_id", "status"),
+    )
+    
+    def __repr__(self):
+        return f"<BatchTaskItem {self.task_id}:{self.document_id} ({self.status})>"
+
+# Blob模型：按内容（SHA-256）保存的上传文件，内容相同的文档共用一个文件
+class Blob(Base):
+    __tablename__ = "blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(String(255), nullable=False)  # 文件在 data/blobs 下的路径
+    size = Column(Integer)  # 文件大小（字节）
+    ref_count = Column(Integer, default=0)  # 引用该文件的文档数，降为0时删除文件
+    created_at = Column(DateTime, default=datetime.now)
+    
+    def __repr__(self):
+        return f"<Blob {self.sha256[:12]} ({self.ref_count})>"
+
 # Document模型
 class Document(Base):
     __tablename__ = "documents"
@@ -81,13 +184,25 @@ class Document(Base):
     upload_time = Column(DateTime, default=datetime.now)
     status = Column(String(50), default="未切块")
     last_chunk_params = Column(JSON, default=lambda: json.dumps({}))
-    hash = Column(String(64))  # 文件哈希值
+    hash = Column(String(64))  # 文件哈希值（SHA-256，旧版本的MD5由迁移7重新计算；保存在内容存储中的文档同时也是 Blob 的键）
     dify_push_status = Column(String(20), nullable=True)  # Dify推送状态：None=未推送，pushing=推送中，pushed=已推送
+    dify_push_state = Column(JSON, nullable=True)  # 未完成的推送：Dify文档ID和上传失败的段落区间，再次推送时只重新发送这些段落
     folder_id = Column(Integer, ForeignKey("folders.id"), nullable=True)  # 关联文件夹ID
     
     # 关联到Chunk表和Folder表
     chunks = relationship("Chunk", back_populates="document", cascade="all, delete-orphan")
     folder = relationship("Folder", back_populates="documents")
+    dify_segments = relationship("DifySegment", back_populates="document", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # 文件夹文档列表和最近更新时间
+        Index("ix_documents_folder_upload", "folder_id", "upload_time"),
+        # 批量切块/推送时按状态筛选文件夹中的文档
+        Index("ix_documents_folder_status", "folder_id", "status"),
+        Index("ix_documents_folder_push_status", "folder_id", "dify_push_status"),
+        # 查找内容相同的文档（共用切块结果）
+        Index("ix_documents_hash", "hash"),
+    )
     
     def __repr__(self):
         return f"<Document {self.filename}>"
@@ -108,9 +223,78 @@ class Chunk(Base):
     # 关联到Document表
     document = relationship("Document", back_populates="chunks")
     
+    __table_args__ = (
+        # 查看和推送切块时按文档筛选并按序号排序
+        Index("ix_chunks_document_sequence", "document_id", "sequence"),
+    )
+    
     def __repr__(self):
         return f"<Chunk {self.id} of Document {self.document_id}>"
 
-# 创建数据库表
+# DifySegment模型：本地切块与Dify段落的对应关系，用于增量同步
+class DifySegment(Base):
+    __tablename__ = "dify_segments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
+    dataset_id = Column(String(255), nullable=False)  # Dify知识库ID
+    dify_document_id = Column(String(64), nullable=False)  # Dify文档ID
+    segment_id = Column(String(64), nullable=False)  # Dify段落ID
+    sequence = Column(Integer, nullable=True)  # 对应的切块序号，为空表示待删除的段落
+    content_hash = Column(String(64), nullable=True)  # 推送时段落数据（内容、关键词）的哈希
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    # 关联到Document表
+    document = relationship("Document", back_populates="dify_segments")
+    
+    __table_args__ = (
+        # 同步时按文档和知识库读取全部对应关系
+        Index("ix_dify_segments_document_dataset", "document_id", "dataset_id"),
+    )
+    
+    def __repr__(self):
+        return f"<DifySegment {self.segment_id} of Document {self.document_id}>"
+
+# Job模型：持久化的后台任务队列（切块、推送等），进程重启后任务不会丢失
+class Job(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(String(36), primary_key=True)  # UUID
+    job_type = Column(String(50), nullable=False)  # chunk/dify_push/dify_add/batch_chunk/batch_to_dify
+    payload = Column(JSON)  # 任务参数
+    dedupe_key = Column(String(255), nullable=True)  # 同一键同时只允许一个未完成的任务
+    
+    status = Column(String(50), default="waiting")  # waiting/processing/completed/failed
+    attempts = Column(Integer, default=0)  # 已执行次数
+    max_attempts = Column(Integer, default=3)  # 最多执行次数（租约过期或执行异常时重试）
+    lease_owner = Column(String(255), nullable=True)  # 持有租约的工作进程
+    lease_expires_at = Column(DateTime, nullable=True)  # 租约过期时间，过期后任务重新排队
+    
+    progress = Column(JSON, nullable=True)  # 执行进度（由心跳定期保存）
+    result = Column(JSON, nullable=True)  # 执行结果
+    error_message = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        # 领取任务：按状态筛选等待中和租约过期的任务
+        Index("ix_jobs_status_lease", "status", "lease_expires_at"),
+        Index("ix_jobs_dedupe_status", "dedupe_key", "status"),
+        # 同一去重键同时只允许一个未完成的任务（并发添加时由数据库保证）
+        Index("ux_jobs_dedupe_active", "dedupe_key", unique=True,
+              sqlite_where=text("dedupe_key IS NOT NULL AND status IN ('waiting', 'processing')")),
+    )
+    
+    def __repr__(self):
+        return f"<Job {self.job_type} {self.id} ({self.status})>"
+
+# 创建数据库表并升级已有数据库
 def create_tables():
-    Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    
+    from .migrations import run_migrations
+    run_migrations(engine)
+ 
\ No newline at end of file
@@ -13,12 +13,14 @@ from fastapi.staticfiles import StaticFiles
 
 # 本地模块导入
 from . import templates
-from .database import Base, engine
+from .database import create_tables
 from .routers.base import router as base_router
 from .routers.chunklab import router as chunklab_router
 from .routers.chunkfunc import router as chunkfunc_router
 from .routers.chunkgo import router as chunkgo_router
 from .config import APP_CONFIG
+from .chunk_func.registry import strategy_registry
+from .services.job_queue import start_worker, stop_worker
 
 # 创建FastAPI应用
 app = FastAPI(title="ChunkSpace", description="文档切块工作台")
@@ -36,8 +38,25 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 app.mount("/guide", StaticFiles(directory="guide"), name="guide_files")
 
-# 创建数据库表
-Base.metadata.create_all(bind=engine)
+# 创建数据库表并执行迁移
+create_tables()
+
+# 启动时扫描一次切块策略，之后由注册表缓存
+strategy_registry.refresh()
+
+# 启动时运行任务工作进程，执行队列中的切块和推送任务（包括上次退出时未完成的任务）
+# JOB_WORKER_MODE=external 时任务由 worker.py 执行，Web进程只负责加入任务和查询状态
+@app.on_event("startup")
+def start_job_worker():
+    if APP_CONFIG['JOB_WORKER_MODE'] == 'external':
+        logging.getLogger(__name__).info("任务由独立的工作进程执行（python worker.py）")
+        return
+    start_worker()
+
+# 退出时停止领取任务，执行中的任务重新排队
+@app.on_event("shutdown")
+def stop_job_worker():
+    stop_worker()
 
 # 注册路由
 app.include_router(base_router)
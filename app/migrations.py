@@ -0,0 +1,178 @@
+# 数据库迁移
+"""
+轻量级数据库迁移
+
+create_all 只会创建不存在的表，无法为已有的 chunklab.db 添加索引或字段。
+这里按版本号记录已执行的迁移（schema_migrations 表），应用启动时依次执行未执行过的迁移。
+新增迁移时在 MIGRATIONS 末尾追加即可，版本号只增不改。
+"""
+import json
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from .database import Base
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def create_indexes(conn: Connection, *index_names: str):
+    """按名称补建模型中定义的索引（每个迁移只创建自己引入的索引，不依赖之后才添加的字段）"""
+    wanted = set(index_names)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in wanted:
+                index.create(bind=conn, checkfirst=True)
+
+
+def create_hot_query_indexes(conn: Connection):
+    create_indexes(
+        conn,
+        "ix_batch_tasks_folder_type_created",
+        "ix_documents_folder_upload",
+        "ix_documents_folder_status",
+        "ix_documents_folder_push_status",
+        "ix_chunks_document_sequence",
+    )
+
+
+def create_document_hash_index(conn: Connection):
+    create_indexes(conn, "ix_documents_hash")
+
+
+def add_column_if_missing(conn: Connection, table_name: str, column_name: str, column_ddl: str):
+    """为已有的表补充新字段（column_ddl 为字段类型及约束，如 "VARCHAR(64)"）"""
+    columns = {col["name"] for col in inspect(conn).get_columns(table_name)}
+    if column_name not in columns:
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_ddl}"))
+
+
+def _load_json(value, default):
+    """读取旧版本写入的JSON字段（旧代码先 json.dumps 再存入JSON列，可能被编码了两次）"""
+    if not value:
+        return default
+    while isinstance(value, str):
+        value = json.loads(value)
+    return value
+
+
+def backfill_batch_task_items(conn: Connection):
+    """把已有批量任务保存在 task_results 中的结果拆分为 batch_task_items 中的逐行记录"""
+    tasks = conn.execute(text("SELECT id, document_ids, task_results FROM batch_tasks")).fetchall()
+    existing = {row[0] for row in conn.execute(text("SELECT DISTINCT task_id FROM batch_task_items"))}
+    rows = []
+    for task_id, document_ids, task_results in tasks:
+        if task_id in existing:
+            continue
+        results = _load_json(task_results, {})
+        for doc_id in dict.fromkeys(_load_json(document_ids, [])):
+            result = results.get(str(doc_id)) or {}
+            details = {k: v for k, v in result.items() if k not in ("status", "error", "time")}
+            rows.append({
+                "task_id": task_id,
+                "document_id": doc_id,
+                "status": result.get("status", "pending"),
+                "error": result.get("error"),
+                "details": json.dumps(details) if details else None,
+                "finished_at": datetime.fromisoformat(result["time"]) if result.get("time") else None
+            })
+    if rows:
+        conn.execute(text(
+            "INSERT INTO batch_task_items (task_id, document_id, status, error, details, finished_at) "
+            "VALUES (:task_id, :document_id, :status, :error, :details, :finished_at)"
+        ), rows)
+        logger.info(f"已为 {len(tasks)} 个批量任务生成 {len(rows)} 条文档结果记录")
+
+
+def add_batch_task_error_message(conn: Connection):
+    """批量任务记录失败原因"""
+    add_column_if_missing(conn, "batch_tasks", "error_message", "TEXT")
+
+
+def add_document_push_state(conn: Connection):
+    """文档记录未完成的Dify推送"""
+    add_column_if_missing(conn, "documents", "dify_push_state", "JSON")
+
+
+def create_job_dedupe_unique_index(conn: Connection):
+    """同一去重键只保留最早的未完成任务，其余标记为失败，再创建唯一索引"""
+    duplicates = conn.execute(text(
+        "SELECT id FROM jobs AS j WHERE dedupe_key IS NOT NULL AND status IN ('waiting', 'processing') "
+        "AND EXISTS (SELECT 1 FROM jobs AS o WHERE o.dedupe_key = j.dedupe_key "
+        "AND o.status IN ('waiting', 'processing') "
+        "AND (o.created_at < j.created_at OR (o.created_at = j.created_at AND o.id < j.id)))"
+    )).fetchall()
+    if duplicates:
+        conn.execute(text(
+            "UPDATE jobs SET status = 'failed', error_message = :message, lease_owner = NULL, "
+            "lease_expires_at = NULL, finished_at = :now WHERE id = :id"
+        ), [{"id": row[0], "message": "重复的任务（同一去重键已有未完成的任务）", "now": datetime.now()}
+            for row in duplicates])
+        logger.info(f"已将 {len(duplicates)} 个重复的未完成任务标记为失败")
+    create_indexes(conn, "ux_jobs_dedupe_active")
+
+
+def backfill_document_sha256(conn: Connection):
+    """
+    旧版本上传的文档以MD5作为 Document.hash，按文件内容重新计算为SHA-256
+
+    上次切块参数中记录的文件哈希一起更新，参数不变时仍可复用已有切块；文件已不存在的文档清空哈希。
+    """
+    from .services.chunk_cache import compute_file_hash
+
+    rows = conn.execute(text(
+        "SELECT id, filepath, hash, last_chunk_params FROM documents WHERE hash IS NOT NULL AND length(hash) = 32"
+    )).fetchall()
+    missing = 0
+    for doc_id, filepath, old_hash, last_params in rows:
+        new_hash = compute_file_hash(filepath) if filepath and os.path.isfile(filepath) else None
+        if new_hash is None:
+            missing += 1
+        conn.execute(text("UPDATE documents SET hash = :hash WHERE id = :id"), {"hash": new_hash, "id": doc_id})
+        params = _load_json(last_params, {})
+        if isinstance(params, dict) and params.get("file_hash") == old_hash:
+            params["file_hash"] = new_hash
+            conn.execute(text("UPDATE documents SET last_chunk_params = :params WHERE id = :id"),
+                         {"params": json.dumps(params), "id": doc_id})
+    if rows:
+        logger.info(f"已将 {len(rows)} 个文档的MD5哈希重新计算为SHA-256（{missing} 个文件不存在，哈希已清空）")
+
+
+# 迁移列表：(版本号, 描述, 迁移函数)
+MIGRATIONS = [
+    (1, "为切块、文档和批处理任务的热点查询创建复合索引", create_hot_query_indexes),
+    (2, "批量任务的文档结果由 task_results 拆分到 batch_task_items 表", backfill_batch_task_items),
+    (3, "为文档内容哈希创建索引（内容相同的文档共用切块）", create_document_hash_index),
+    (4, "批量任务增加 error_message 字段", add_batch_task_error_message),
+    (5, "文档增加 dify_push_state 字段（只重新发送上传失败的段落）", add_document_push_state),
+    (6, "任务去重键增加唯一索引（只约束未完成的任务）", create_job_dedupe_unique_index),
+    (7, "旧文档的MD5哈希重新计算为SHA-256", backfill_document_sha256),
+]
+
+
+def run_migrations(engine: Engine):
+    """执行所有尚未执行的迁移"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, "
+            "description VARCHAR(255), "
+            "applied_at DATETIME)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+
+        logger.info(f"执行数据库迁移 {version}: {description}")
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {"v": version, "d": description, "t": datetime.now()}
+            )
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Form, BackgroundTasks, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Request, Form, UploadFile, File, Query
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from typing import List, Dict, Any, Optional
@@ -7,13 +7,15 @@ import logging
 from pydantic import BaseModel
 import os
 
-from ..database import get_db, Folder, Document, BatchTask
+from ..database import get_db, get_db_session, Folder, Document, BatchTask
 from ..config import get_config
 from .. import templates
 from ..services.folder_manager import FolderManager
 from ..services.batch_chunking import BatchChunkingService
 from ..services.to_dify_batch import DifyBatchService
 from ..services.to_dify_single import DifySingleService
+from ..services.progress_bus import progress_bus, task_topic
+from ..services.batch_items import batch_item_service
 
 router = APIRouter()
 
@@ -40,6 +42,7 @@ class BatchChunkRequest(BaseModel):
 class BatchDifyRequest(BaseModel):
     document_ids: List[int] = []
     dataset_id: str
+    mode: Optional[str] = None  # full=完整推送，sync=只同步变化的切块，为空时使用配置
 
 # 主页 - 文件夹列表
 @router.get("")
@@ -122,12 +125,31 @@ async def upload_documents(
             content={"success": [], "failed": [{"filename": "处理错误", "reason": str(e)}], "total": len(files)}
         )
 
+# 上传压缩包到文件夹
+@router.post("/folders/{folder_id}/upload-archive")
+async def upload_archive(
+    folder_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    """上传 zip/tar 压缩包，在服务器端展开到文件夹（保留压缩包内的相对路径）"""
+    try:
+        logger.info(f"开始展开压缩包 {file.filename} 到文件夹 {folder_id}")
+        return await batch_chunking_service.upload_archive_to_folder(folder_id, file, db)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"展开压缩包到文件夹 {folder_id} 失败: {str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"success": [], "failed": [{"filename": file.filename, "reason": str(e)}], "skipped": [], "total": 0}
+        )
+
 # 批量切块
 @router.post("/folders/{folder_id}/chunk")
 async def batch_chunk(
     folder_id: int,
     request: BatchChunkRequest,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """开始批量切块任务"""
@@ -137,7 +159,6 @@ async def batch_chunk(
         chunk_strategy=request.chunk_strategy,
         chunk_size=request.chunk_size,
         overlap=request.overlap,
-        background_tasks=background_tasks,
         db=db
     )
     return result
@@ -147,7 +168,6 @@ async def batch_chunk(
 async def batch_to_dify(
     folder_id: int,
     request: BatchDifyRequest,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
     """开始批量推送到Dify任务"""
@@ -155,26 +175,59 @@ async def batch_to_dify(
         folder_id=folder_id,
         document_ids=request.document_ids,
         dataset_id=request.dataset_id,
-        background_tasks=background_tasks,
-        db=db
+        db=db,
+        mode=request.mode
     )
     return result
 
 # 获取任务状态
 @router.get("/tasks/{task_id}")
-async def get_task_status(task_id: str, db: Session = Depends(get_db)):
-    """获取任务状态"""
+async def get_task_status(
+    task_id: str,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=500),
+    status: Optional[str] = Query(None),
+    db: Session = Depends(get_db)
+):
+    """获取任务状态（按状态汇总的文档数量和分页的文档结果，status 可筛选 pending/processing/completed/failed/skipped）"""
     task = db.query(BatchTask).filter(BatchTask.id == task_id).first()
     if not task:
         raise HTTPException(status_code=404, detail="任务不存在")
     
     if task.task_type == "chunk":
-        return batch_chunking_service.get_task_status(task_id, db)
+        return batch_chunking_service.get_task_status(task_id, db, page, page_size, status)
     elif task.task_type == "to_dify":
-        return dify_batch_service.get_task_status(task_id, db)
+        return dify_batch_service.get_task_status(task_id, db, page, page_size, status)
     else:
         raise HTTPException(status_code=400, detail=f"未知的任务类型: {task.task_type}")
 
+def _task_progress_snapshot(task_id: str) -> Dict[str, Any]:
+    """读取批量任务的当前进度（进度推送在任务不由本进程执行时使用）"""
+    db = get_db_session()
+    try:
+        task = db.query(BatchTask).filter(BatchTask.id == task_id).first()
+        if not task:
+            return {"status": "unknown", "message": "任务不存在"}
+        done_count = task.success_count + task.error_count
+        return {
+            "task_id": task.id,
+            "name": task.name,
+            "status": task.status,
+            "total_count": task.total_count,
+            "success_count": task.success_count,
+            "error_count": task.error_count,
+            "progress": int(done_count / task.total_count * 100) if task.total_count else 0,
+            "counts": batch_item_service.count_items(db, task_id)
+        }
+    finally:
+        db.close()
+
+# 订阅任务进度
+@router.get("/tasks/{task_id}/events")
+async def task_status_events(task_id: str):
+    """订阅批量任务进度（Server-Sent Events，先发送完整状态，之后只发送变化的计数和最近完成文档的结果）"""
+    return progress_bus.event_stream(task_topic(task_id), lambda: _task_progress_snapshot(task_id))
+
 # Dify知识库列表
 @router.get("/dify/knowledge-bases")
 async def get_dify_knowledge_bases():
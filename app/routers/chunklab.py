@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Form, BackgroundTasks, UploadFile, File, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, Form, UploadFile, File, Query
 from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from typing import Dict, Any, List, Optional
 from datetime import datetime
@@ -13,6 +14,7 @@ from ..services.document import DocumentService
 from ..services.chunking import ChunkService
 from ..services.to_dify_single import DifySingleService
 from ..services.add_dify_single import add_dify_service
+from ..services.progress_bus import progress_bus, chunk_topic
 
 router = APIRouter(
     prefix="/chunklab",
@@ -68,20 +70,22 @@ async def delete_document(document_id: int, db: Session = Depends(get_db)):
 # 切块管理路由
 @router.get("/documents/{document_id}/chunk")
 async def chunk_page(document_id: int, request: Request, db: Session = Depends(get_db)):
-    """切块页面"""
+    """切块页面（切块列表由前端分页加载）"""
     document = db.query(Document).filter(Document.id == document_id).first()
     if not document:
         raise HTTPException(status_code=404, detail="文档不存在")
     
-    # 获取文档的切块列表
-    chunks = db.query(Chunk).filter(Chunk.document_id == document_id).order_by(Chunk.sequence).all()
+    # 只统计切块数量，切块内容通过分页接口加载
+    chunk_count = db.query(func.count(Chunk.id)).filter(Chunk.document_id == document_id).scalar()
     
     return templates.TemplateResponse(
         "chunklab/chunk.html",
         {
             "request": request,
             "document": document,
-            "chunks": chunks,
+            "chunk_count": chunk_count,
+            "chunk_page_size": APP_CONFIG['CHUNK_PAGE_SIZE'],
+            "chunk_preview_length": APP_CONFIG['CHUNK_PREVIEW_LENGTH'],
             "chunk_strategies": get_config('CHUNK_STRATEGIES'),
             "default_chunk_size": APP_CONFIG['DEFAULT_CHUNK_SIZE'],
             "default_overlap": APP_CONFIG['DEFAULT_OVERLAP'],
@@ -93,7 +97,6 @@ async def chunk_page(document_id: int, request: Request, db: Session = Depends(g
 @router.post("/documents/{document_id}/chunk")
 async def create_chunks(
     document_id: int,
-    background_tasks: BackgroundTasks,
     chunk_strategy: str = Form(...),
     chunk_size: int = Form(...),
     overlap: int = Form(...),
@@ -102,7 +105,6 @@ async def create_chunks(
     """开始执行切块操作（异步）"""
     return await chunk_service.create_chunks(
         document_id, 
-        background_tasks,
         chunk_strategy, 
         chunk_size, 
         overlap, 
@@ -114,25 +116,49 @@ async def get_chunk_status(document_id: int):
     """获取切块任务状态"""
     return chunk_service.get_chunk_status(document_id)
 
+@router.get("/documents/{document_id}/chunk/events")
+async def chunk_status_events(document_id: int):
+    """订阅切块进度（Server-Sent Events，先发送完整状态，之后只发送变化）"""
+    return progress_bus.event_stream(
+        chunk_topic(document_id),
+        lambda: chunk_service.get_chunk_state(document_id)
+    )
+
 @router.get("/documents/{document_id}/chunks")
-async def view_chunks(document_id: int, request: Request, db: Session = Depends(get_db)):
-    """查看切块列表页面"""
-    document = db.query(Document).filter(Document.id == document_id).first()
+async def view_chunks(document_id: int):
+    """旧的切块列表地址：切块页面已通过 /chunks/page 分页加载切块，不再单独渲染列表模板，只保留跳转兼容旧链接"""
+    return RedirectResponse(url=f"/chunklab/documents/{document_id}/chunk")
+
+@router.get("/documents/{document_id}/chunks/page")
+async def get_chunk_page(
+    document_id: int,
+    after: int = Query(0, ge=0),
+    limit: int = Query(None, ge=1, le=500),
+    q: Optional[str] = None,
+    truncate: int = Query(None, ge=0),
+    db: Session = Depends(get_db)
+):
+    """按序号分页获取切块（JSON），支持内容截断和关键字搜索"""
+    document = db.query(Document.id).filter(Document.id == document_id).first()
     if not document:
         raise HTTPException(status_code=404, detail="文档不存在")
     
-    chunks = db.query(Chunk).filter(Chunk.document_id == document_id).order_by(Chunk.sequence).all()
-    
-    return templates.TemplateResponse(
-        "chunklab/view_chunks.html",
-        {
-            "request": request, 
-            "document": document, 
-            "chunks": chunks, 
-            "chunk_strategies": get_config('CHUNK_STRATEGIES'),
-            "now": datetime.now
-        }
-    )
+    return JSONResponse(chunk_service.get_chunk_page(
+        document_id,
+        db,
+        after=after,
+        limit=limit or APP_CONFIG['CHUNK_PAGE_SIZE'],
+        keyword=q,
+        truncate=APP_CONFIG['CHUNK_PREVIEW_LENGTH'] if truncate is None else truncate
+    ))
+
+@router.get("/documents/{document_id}/chunks/{sequence}")
+async def get_chunk(document_id: int, sequence: int, db: Session = Depends(get_db)):
+    """获取单个切块的完整内容"""
+    chunk = chunk_service.get_chunk(document_id, sequence, db)
+    if not chunk:
+        raise HTTPException(status_code=404, detail="切块不存在")
+    return JSONResponse(chunk)
 
 @router.get("/strategies/for-filetype")
 async def get_strategies_for_filetype(file_ext: str):
@@ -179,9 +205,9 @@ async def test_dify_connection():
     return dify_service.test_connection()
 
 @router.post("/dify/push/{document_id}")
-async def push_to_dify(document_id: int, dataset_id: str = Form(...), db: Session = Depends(get_db)):
-    """推送文档到Dify知识库"""
-    return dify_service.push_document_to_dify(document_id, dataset_id, db)
+async def push_to_dify(document_id: int, dataset_id: str = Form(...), mode: Optional[str] = Form(None), db: Session = Depends(get_db)):
+    """推送文档到Dify知识库（mode: full=完整推送，sync=只同步变化的切块）"""
+    return dify_service.push_document_to_dify(document_id, dataset_id, db, mode)
 
 @router.get("/dify/status/{document_id}")
 async def get_dify_push_status(document_id: int, db: Session = Depends(get_db)):
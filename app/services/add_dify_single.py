@@ -1,13 +1,14 @@
-import requests
-import json
 import logging
-import time
 import os
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 from ..config import get_config
+from ..services.dify_client import get_dify_client
+from ..services.dify_segments import build_segments, upload_segments
+from ..services.dify_sync import dify_sync_service
+from ..services.job_queue import job_queue, LeaseLostError
 from ..database import Document, Chunk, get_db_session
 
 # 配置日志
@@ -20,7 +21,7 @@ class AddDifySingleService:
         """初始化服务"""
         self.api_server = get_config('DIFY_API_SERVER')
         self.api_key = get_config('DIFY_API_KEY')
-        self.headers = {'Authorization': f'Bearer {self.api_key}'}
+        self.client = get_dify_client()
     
     def get_dataset_files(self, dataset_id: str, search_term: Optional[str] = None) -> Dict[str, Any]:
         """获取知识库中的文件列表，可选搜索筛选"""
@@ -31,7 +32,7 @@ class AddDifySingleService:
             if search_term:
                 params['keyword'] = search_term
             
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self.client.get(url, params=params)
             
             if response.status_code != 200:
                 return {'status': 'error', 'message': f'API错误: {response.status_code}'}
@@ -57,11 +58,12 @@ class AddDifySingleService:
             document.dify_push_status = "pushing"
             db.commit()
             
-            # 启动后台任务
-            from threading import Thread
-            thread = Thread(target=self._do_add_to_file, args=(document_id, dataset_id, target_file_id))
-            thread.daemon = True
-            thread.start()
+            # 加入持久化任务队列
+            job_queue.enqueue("dify_add", {
+                "document_id": document_id,
+                "dataset_id": dataset_id,
+                "target_file_id": target_file_id
+            }, dedupe_key=f"dify:{document_id}")
             
             return JSONResponse(status_code=200, content={
                 'message': '添加任务已启动',
@@ -72,8 +74,9 @@ class AddDifySingleService:
             logger.error(f"启动添加任务失败: {str(e)}")
             return JSONResponse(status_code=500, content={'message': str(e)})
     
-    def _do_add_to_file(self, document_id: int, dataset_id: str, target_file_id: str):
-        """实际执行添加切片的后台任务"""
+    def _do_add_to_file(self, document_id: int, dataset_id: str, target_file_id: str,
+                        check_lease: Optional[Callable[[], None]] = None):
+        """实际执行添加切片的后台任务（check_lease 同 DifySingleService._do_push_document）"""
         db = get_db_session()
         document = None
         
@@ -94,8 +97,21 @@ class AddDifySingleService:
                 logger.error(f"目标文件 {target_file_id} 不存在或无法访问")
                 return
             
+            # 上次添加到该文件时有上传失败的段落，只重新发送这些段落
+            resume_result = dify_sync_service.resume_push(document_id, dataset_id, target_file_id, check_lease)
+            if resume_result.get('status') != 'full_required':
+                self._update_status(document, "pushed" if resume_result.get('status') == 'success' else None, db)
+                if resume_result.get('status') != 'success':
+                    logger.error(f"补传段落失败: {resume_result.get('message', '未知错误')}")
+                return
+            
             # 添加自定义切块
-            add_response = self._add_segments_to_document(chunks, dataset_id, target_file_id)
+            add_response = self._add_segments_to_document(chunks, dataset_id, target_file_id,
+                                                          check_lease=check_lease)
+            # 记录失败的段落区间，再次添加到该文件时只重新发送这些段落
+            if 'landed' in add_response:
+                dify_sync_service.save_push_state(document_id, dataset_id, target_file_id, add_response.get('failed'),
+                                                  mode='add')
             if add_response.get('status') != 'success':
                 self._update_status(document, None, db)
                 logger.error(f"添加段落失败: {add_response.get('message', '未知错误')}")
@@ -104,6 +120,9 @@ class AddDifySingleService:
             # 更新状态为已推送
             self._update_status(document, "pushed", db)
             
+        except LeaseLostError:
+            logger.warning(f"文档 {document_id} 的添加任务租约已失效，停止添加")
+            raise
         except Exception as e:
             logger.error(f"添加切片失败: {str(e)}")
             if document:
@@ -137,7 +156,7 @@ class AddDifySingleService:
             url = f"{self.api_server}/v1/datasets/{dataset_id}/documents"
             params = {'page': 1, 'limit': 100}
             
-            response = requests.get(url, headers=self.headers, params=params)
+            response = self.client.get(url, params=params)
             if response.status_code != 200:
                 return False
                 
@@ -154,52 +173,20 @@ class AddDifySingleService:
             logger.error(f"验证目标文件失败: {str(e)}")
             return False
     
-    def _add_segments_to_document(self, chunks: List[Chunk], dataset_id: str, document_id: str) -> Dict[str, Any]:
-        """添加段落到Dify文档"""
+    def _add_segments_to_document(self, chunks: List[Chunk], dataset_id: str, document_id: str,
+                                  ranges: Optional[List[List[int]]] = None,
+                                  check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """分批添加段落到Dify文档，结果中的 landed/failed 记录成功和失败的段落序号区间"""
         try:
-            url = f"{self.api_server}/v1/datasets/{dataset_id}/documents/{document_id}/segments"
-            
-            # 准备段落数据
-            segments = []
-            for chunk in chunks:
-                # 将 chunk_metadata 转换为 keywords
-                keywords = []
-                if get_config('PASS_META_TO_DIFY') and chunk.chunk_metadata:
-                    for key, value in chunk.chunk_metadata.items():
-                        if isinstance(value, (list, dict)):
-                            keywords.append(f"{key}:{json.dumps(value, ensure_ascii=False)}")
-                        else:
-                            keywords.append(f"{key}:{str(value)}")
-                
-                segments.append({
-                    "content": chunk.content,
-                    "answer": "",
-                    "keywords": keywords
-                })
-            
+            segments = build_segments(chunks)
             if not segments:
                 return {'status': 'error', 'message': '没有可添加的段落'}
             
-            # 一次性添加所有段落
-            logger.info(f"一次性开始添加{len(segments)}个切块到文件 {document_id}")
-            start_time = time.time()
-            
-            response = requests.post(
-                url,
-                headers=self.headers,
-                json={"segments": segments}
-            )
-            
-            elapsed_time = time.time() - start_time
-            
-            if response.status_code < 400:
-                logger.info(f"所有 {len(segments)} 个段落添加成功")
-                logger.info(f"成功添加切块，耗时: {elapsed_time:.2f}秒")
-                return {'status': 'success', 'data': {'message': '所有段落添加成功'}}
-            else:
-                logger.error(f"添加段落失败: HTTP {response.status_code}")
-                return {'status': 'error', 'message': f'HTTP错误: {response.status_code}'}
-                
+            url = f"{self.api_server}/v1/datasets/{dataset_id}/documents/{document_id}/segments"
+            logger.info(f"开始添加{len(segments)}个切块到文件 {document_id}")
+            return upload_segments(url, segments, ranges, check_lease)
+        except LeaseLostError:
+            raise
         except Exception as e:
             logger.error(f"添加段落失败: {str(e)}")
             return {'status': 'error', 'message': str(e)}
@@ -0,0 +1,122 @@
+"""
+压缩包的流式展开
+
+依次读取 zip/tar 压缩包中的文件，每个文件以数据块的异步迭代器交给内容存储写入，不会解压到临时目录，
+也不会整体读入内存。读取在线程中执行，不阻塞事件循环。
+成员路径统一为以 / 分隔的相对路径，绝对路径和包含 .. 的路径视为不安全。
+"""
+import re
+import asyncio
+import logging
+import tarfile
+import zipfile
+from typing import AsyncIterator, BinaryIO, Callable, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+
+from .file_ingest import INGEST_BLOCK_SIZE
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# 成员：(原始路径, 安全的相对路径或None, 数据块迭代器或None)，数据块迭代器为None表示不是普通文件
+ArchiveMember = Tuple[str, Optional[str], Optional[AsyncIterator[bytes]]]
+
+
+def is_archive(filename: str) -> bool:
+    return (filename or "").lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def safe_member_path(name: str) -> Optional[str]:
+    """把成员路径规范为相对路径（与文件夹上传的 relative_path 一致），不安全时返回None"""
+    path = name.replace("\\", "/")
+    if path.startswith("/") or re.match(r"^[A-Za-z]:", path):
+        return None
+    parts = [part for part in path.split("/") if part not in ("", ".")]
+    if not parts or ".." in parts:
+        return None
+    return "/".join(parts)
+
+
+def _zip_member_name(info: zipfile.ZipInfo) -> str:
+    """未标记UTF-8的文件名按GBK解码（Windows中文系统创建的zip），失败时保持原样"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode('cp437').decode('gbk')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+async def _iter_member(open_member: Callable[[], BinaryIO]) -> AsyncIterator[bytes]:
+    """读取成员的数据块（开始读取时才打开成员，跳过的成员不占用文件句柄）"""
+    f = await asyncio.to_thread(open_member)
+    try:
+        while True:
+            block = await asyncio.to_thread(f.read, INGEST_BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+    finally:
+        f.close()
+
+
+async def _iter_zip(source: BinaryIO) -> AsyncIterator[ArchiveMember]:
+    archive = await asyncio.to_thread(zipfile.ZipFile, source)
+    try:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            name = _zip_member_name(info)
+            path = safe_member_path(name)
+            yield name, path, _iter_member(lambda info=info: archive.open(info)) if path else None
+    finally:
+        archive.close()
+
+
+async def _iter_tar(source: BinaryIO) -> AsyncIterator[ArchiveMember]:
+    # 流模式按顺序读取，不需要随机访问
+    archive = await asyncio.to_thread(tarfile.open, fileobj=source, mode="r|*")
+    try:
+        while True:
+            info = await asyncio.to_thread(archive.next)
+            if info is None:
+                return
+            if info.isdir():
+                continue
+            path = safe_member_path(info.name)
+            if not info.isfile():
+                # 链接和设备文件不展开
+                yield info.name, path, None
+                continue
+            yield info.name, path, _iter_member(lambda info=info: archive.extractfile(info)) if path else None
+    finally:
+        archive.close()
+
+
+async def iter_archive(file: UploadFile) -> AsyncIterator[ArchiveMember]:
+    """
+    依次产生压缩包中的成员
+
+    当前成员的数据块需要在取下一个成员之前读完（tar按流读取）。
+    不是 zip/tar 格式时抛出 HTTPException(400)。
+    """
+    source = file.file
+    await asyncio.to_thread(source.seek, 0)
+    if await asyncio.to_thread(zipfile.is_zipfile, source):
+        await asyncio.to_thread(source.seek, 0)
+        members = _iter_zip(source)
+    else:
+        await asyncio.to_thread(source.seek, 0)
+        try:
+            first = await asyncio.to_thread(tarfile.open, fileobj=source, mode="r|*")
+            first.close()
+        except tarfile.TarError:
+            raise HTTPException(status_code=400, detail=f"不支持的压缩包格式，支持: {', '.join(ARCHIVE_EXTENSIONS)}")
+        await asyncio.to_thread(source.seek, 0)
+        members = _iter_tar(source)
+
+    async for member in members:
+        yield member
@@ -3,15 +3,20 @@ import json
 import uuid
 import logging
 import time
-import shutil
 import asyncio
-from fastapi import BackgroundTasks, UploadFile, HTTPException
+from fastapi import UploadFile, HTTPException
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Optional
 from datetime import datetime
 
 from ..database import Document, Folder, BatchTask, get_db_session
-from ..services.chunking import ChunkService
+from ..services.chunking import ChunkService, CHUNK_TASKS, get_process_pool_size, run_in_process_pool, run_strategy_in_process
+from ..services.job_queue import job_queue, LeaseLostError
+from ..services.progress_bus import progress_bus, task_topic
+from ..services.batch_items import batch_item_service
+from ..services.blob_store import blob_store
+from ..services.document import assign_document_names
+from ..services.archive_ingest import iter_archive, is_archive, ARCHIVE_EXTENSIONS
 from ..config import get_config
 
 # 配置日志
@@ -21,6 +26,86 @@ logger = logging.getLogger(__name__)
 # 使用已有的切块服务
 chunk_service = ChunkService()
 
+class DocumentBatch:
+    """
+    批量登记上传的文档
+    
+    已写入内容存储的文件先累积起来，每 UPLOAD_COMMIT_BATCH_SIZE 个在一个事务中写入文档记录和引用计数，
+    提交失败时该批文件全部记为失败。数据库写入在线程中执行，同一时间只有一个批次使用会话。
+    """
+    
+    def __init__(self, db: Session, folder_id: int):
+        self.db = db
+        self.folder_id = folder_id
+        self.batch_size = max(1, get_config('UPLOAD_COMMIT_BATCH_SIZE'))
+        self.pending = []
+        self.success = {}
+        self.failed = {}
+        self._write_lock = asyncio.Lock()
+    
+    def fail(self, index: int, filename: str, reason: str):
+        self.failed[index] = {"filename": filename, "reason": reason}
+    
+    async def add(self, index: int, relative_path: str, ext: str, blob: Dict[str, Any]):
+        document = Document(
+            filename=relative_path,
+            filepath=blob["path"],
+            filetype=ext,
+            filesize=blob["size"],
+            folder_id=self.folder_id,
+            upload_time=datetime.now(),
+            status="未切块",
+            hash=blob["sha256"]
+        )
+        self.pending.append((index, document, blob))
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+    
+    async def flush(self):
+        """把累积的文档在一个事务中写入数据库"""
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        async with self._write_lock:
+            await asyncio.to_thread(self._write, pending)
+    
+    def _write(self, pending):
+        blobs = [blob for _, _, blob in pending]
+        try:
+            # 先flush取得文档ID（提交后再读取属性会逐个重新查询）
+            self.db.add_all([document for _, document, _ in pending])
+            self.db.flush()
+            entries = [(index, {
+                "id": document.id,
+                "filename": document.filename,
+                "size": document.filesize,
+                "duplicate": blob["duplicate"]
+            }) for index, document, blob in pending]
+        except Exception as e:
+            self.db.rollback()
+            blob_store.discard(blobs)
+            self._fail_all(pending, e)
+            return
+        try:
+            blob_store.commit_refs(self.db, blobs)
+        except Exception as e:
+            self._fail_all(pending, e)
+            return
+        self.success.update(entries)
+    
+    def _fail_all(self, pending, error: Exception):
+        logger.error(f"登记 {len(pending)} 个文档失败: {str(error)}")
+        for index, document, _ in pending:
+            self.fail(index, document.filename, f"保存文档记录失败: {str(error)}")
+    
+    def result(self, total: int) -> Dict[str, Any]:
+        return {
+            "success": [self.success[index] for index in sorted(self.success)],
+            "failed": [self.failed[index] for index in sorted(self.failed)],
+            "total": total
+        }
+
+
 class BatchChunkingService:
     """批量切片处理服务"""
     
@@ -28,82 +113,122 @@ class BatchChunkingService:
                                   folder_id: int, 
                                   files: List[UploadFile], 
                                   db: Session) -> Dict[str, Any]:
-        """上传多个文档到指定文件夹"""
+        """
+        上传多个文档到指定文件夹
+        
+        文件按 UPLOAD_CONCURRENCY 并发写入内容存储，文档记录每 UPLOAD_COMMIT_BATCH_SIZE 个在一个事务中批量写入，
+        单个文件失败不影响其他文件，结果按上传顺序逐个返回。
+        """
         # 验证文件夹是否存在
         folder = db.query(Folder).filter(Folder.id == folder_id).first()
         if not folder:
             raise HTTPException(status_code=404, detail="文件夹不存在")
         
         allowed_extensions = get_config('ALLOWED_EXTENSIONS')
-        result = {
-            "success": [],
-            "failed": [],
-            "total": len(files)
-        }
+        batch = DocumentBatch(db, folder_id)
         
-        for file in files:
-            try:
-                # 检查文件扩展名
-                filename = file.filename
-                ext = os.path.splitext(filename)[1].lower()
-                
+        # 检查文件扩展名
+        accepted = []
+        for index, file in enumerate(files):
+            ext = os.path.splitext(file.filename)[1].lower()
+            if ext not in allowed_extensions:
+                batch.fail(index, file.filename, f"不支持的文件类型 {ext}，支持的类型: {', '.join(allowed_extensions)}")
+            else:
+                accepted.append((index, file, ext))
+        
+        # 处理文件路径，支持子文件夹（文档名保留相对路径，同名时追加时间戳）
+        names = assign_document_names(db, folder_id, [file.filename.replace("\\", "/") for _, file, _ in accepted])
+        
+        semaphore = asyncio.Semaphore(max(1, get_config('UPLOAD_CONCURRENCY')))
+        
+        async def ingest(index: int, file: UploadFile, relative_path: str, ext: str):
+            async with semaphore:
+                try:
+                    # 分块写入内容存储，同时计算哈希（超过大小限制时记为失败，内容已存在时不再保存第二份）
+                    blob = await blob_store.store_upload(file, ext)
+                except Exception as e:
+                    logger.error(f"上传文件 {file.filename} 失败: {str(e)}")
+                    batch.fail(index, file.filename, str(e))
+                    return
+            await batch.add(index, relative_path, ext, blob)
+        
+        await asyncio.gather(*(
+            ingest(index, file, relative_path, ext)
+            for (index, file, ext), relative_path in zip(accepted, names)
+        ))
+        await batch.flush()
+        
+        return batch.result(len(files))
+    
+    async def upload_archive_to_folder(self,
+                                 folder_id: int,
+                                 file: UploadFile,
+                                 db: Session) -> Dict[str, Any]:
+        """
+        上传 zip/tar 压缩包，在服务器端展开到指定文件夹
+        
+        压缩包中的文件依次流式写入内容存储，文档名保留压缩包内的相对路径，文档记录与文件夹上传一样分批登记。
+        不支持的文件类型记入 skipped，不安全的路径（绝对路径、包含 ..）和写入失败的文件记入 failed。
+        """
+        # 验证文件夹是否存在
+        folder = db.query(Folder).filter(Folder.id == folder_id).first()
+        if not folder:
+            raise HTTPException(status_code=404, detail="文件夹不存在")
+        if not is_archive(file.filename):
+            raise HTTPException(status_code=400, detail=f"不支持的压缩包格式，支持: {', '.join(ARCHIVE_EXTENSIONS)}")
+        
+        allowed_extensions = get_config('ALLOWED_EXTENSIONS')
+        batch = DocumentBatch(db, folder_id)
+        skipped = []
+        stored = []  # 已写入内容存储、等待分配文档名的文件
+        
+        async def register():
+            # 每批文件一次查询分配文档名（之前的批次已写入数据库，不会重名）
+            names = await asyncio.to_thread(assign_document_names, db, folder_id, [path for _, path, _, _ in stored])
+            for (index, _, ext, blob), relative_path in zip(stored, names):
+                await batch.add(index, relative_path, ext, blob)
+            stored.clear()
+            await batch.flush()
+        
+        total = 0
+        try:
+            async for name, path, blocks in iter_archive(file):
+                index = total
+                total += 1
+                ext = os.path.splitext(name)[1].lower()
                 if ext not in allowed_extensions:
-                    result["failed"].append({
-                        "filename": filename,
-                        "reason": f"不支持的文件类型 {ext}，支持的类型: {', '.join(allowed_extensions)}"
-                    })
+                    skipped.append({"filename": name, "reason": f"不支持的文件类型 {ext}"})
+                    continue
+                if path is None:
+                    batch.fail(index, name, "不安全的路径")
+                    continue
+                if blocks is None:
+                    batch.fail(index, name, "不是普通文件")
                     continue
                 
-                # 处理文件路径，支持子文件夹
-                relative_path = filename.replace("\\", "/")
-                file_dir = os.path.dirname(relative_path)
-                base_filename = os.path.basename(relative_path)
-                
-                # 构建目标路径
-                target_dir = os.path.join(folder.folder_path, file_dir)
-                os.makedirs(target_dir, exist_ok=True)
-                
-                # 处理文件名冲突
-                file_path = os.path.join(target_dir, base_filename)
-                if os.path.exists(file_path):
-                    name, ext = os.path.splitext(base_filename)
-                    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-                    new_filename = f"{name}_{timestamp}{ext}"
-                    file_path = os.path.join(target_dir, new_filename)
-                    relative_path = os.path.join(file_dir, new_filename) if file_dir else new_filename
-                
-                # 保存文件
-                with open(file_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
-                
-                # 创建文档记录
-                document = Document(
-                    filename=relative_path,
-                    filepath=file_path,
-                    filetype=ext,
-                    filesize=os.path.getsize(file_path),
-                    folder_id=folder_id,
-                    upload_time=datetime.now(),
-                    status="未切块"
-                )
-                
-                db.add(document)
-                db.commit()
-                db.refresh(document)
-                
-                result["success"].append({
-                    "id": document.id,
-                    "filename": document.filename,
-                    "size": document.filesize
-                })
-                
-            except Exception as e:
-                logger.error(f"上传文件 {file.filename} 失败: {str(e)}")
-                result["failed"].append({
-                    "filename": file.filename,
-                    "reason": str(e)
-                })
+                try:
+                    blob = await blob_store.store_stream(blocks, ext)
+                except Exception as e:
+                    logger.error(f"展开文件 {name} 失败: {str(e)}")
+                    batch.fail(index, name, str(e))
+                    continue
+                stored.append((index, path, ext, blob))
+                if len(stored) >= batch.batch_size:
+                    await register()
+        except HTTPException:
+            raise
+        except Exception as e:
+            # 压缩包损坏：已展开的文件照常登记，其余记为失败
+            logger.error(f"读取压缩包 {file.filename} 失败: {str(e)}")
+            batch.fail(total, file.filename, f"读取压缩包失败: {str(e)}")
+            total += 1
+        
+        if stored:
+            await register()
         
+        result = batch.result(total - len(skipped))
+        result["skipped"] = skipped
+        logger.info(f"压缩包 {file.filename} 展开完成: 成功 {len(result['success'])}, 失败 {len(result['failed'])}, 跳过 {len(skipped)}")
         return result
     
     async def start_batch_chunking(self, 
@@ -112,7 +237,6 @@ class BatchChunkingService:
                            chunk_strategy: str, 
                            chunk_size: int, 
                            overlap: int,
-                           background_tasks: BackgroundTasks,
                            db: Session) -> Dict[str, Any]:
         """开始批量切片任务"""
         # 验证文件夹是否存在
@@ -154,22 +278,22 @@ class BatchChunkingService:
             success_count=0,
             error_count=0,
             document_ids=json.dumps(document_ids),
-            task_results=json.dumps({}),
             settings=json.dumps(settings)
         )
         
         db.add(task)
+        db.flush()
+        batch_item_service.create_items(db, task_id, document_ids)
         db.commit()
         
-        # 启动后台任务
-        background_tasks.add_task(
-            self._process_batch_chunking,
-            task_id=task_id,
-            document_ids=document_ids,
-            chunk_strategy=chunk_strategy,
-            chunk_size=chunk_size,
-            overlap=overlap
-        )
+        # 加入持久化任务队列
+        job_queue.enqueue("batch_chunk", {
+            "task_id": task_id,
+            "document_ids": document_ids,
+            "chunk_strategy": chunk_strategy,
+            "chunk_size": chunk_size,
+            "overlap": overlap
+        })
         
         return {
             "status": "processing",
@@ -183,8 +307,15 @@ class BatchChunkingService:
                               document_ids: List[int], 
                               chunk_strategy: str, 
                               chunk_size: int, 
-                              overlap: int):
-        """执行批量切片任务（后台）- 异步版本"""
+                              overlap: int,
+                              resume: bool = False,
+                              check_lease: Optional[Callable[[], None]] = None):
+        """
+        执行批量切片任务（后台）- 异步版本
+        
+        resume 为True时表示上次执行被中断，已记录结果的文档不再处理。
+        check_lease 在处理每个文档前和写入切块时调用，租约失效时抛出 LeaseLostError 并停止整个任务。
+        """
         db = get_db_session()  # 获取新的会话
         try:
             task = db.query(BatchTask).filter(BatchTask.id == task_id).first()
@@ -197,131 +328,146 @@ class BatchChunkingService:
             # 更新任务状态为处理中
             task.status = "processing"
             db.commit()
+            topic = task_topic(task_id)
+            # 先发布任务的基本信息，之后每完成一个文档只发布变化的计数
+            progress_bus.update(topic, {
+                "task_id": task_id,
+                "name": task.name,
+                "status": "processing",
+                "total_count": task.total_count
+            })
             
-            # 任务结果字典
-            results = {}
-            success_count = 0
-            error_count = 0
-            
-            # 计算并发数和批次大小
-            max_concurrency = min(8, len(document_ids))
-            batch_size = min(20, max(5, len(document_ids) // 2))
-            
-            # 创建信号量控制并发
-            semaphore = asyncio.Semaphore(max_concurrency)
+            # 只处理还没有结果的文档（继续执行时已记录结果的文档不再处理）
+            if resume:
+                batch_item_service.reset_unfinished(db, task_id)
+            pending_ids = batch_item_service.unfinished_document_ids(db, task_id)
+            counts = batch_item_service.count_items(db, task_id)
+            success_count = counts["completed"]
+            error_count = counts["failed"] + counts["skipped"]
+            if resume:
+                logger.info(f"任务 {task_id} 继续执行，已完成 {len(document_ids) - len(pending_ids)} 个，剩余 {len(pending_ids)} 个")
             
-            # 定义更新任务状态的函数
-            def update_task_status(force=False):
-                processed = success_count + error_count
-                if force or processed % 5 == 0 or processed == len(document_ids):
-                    nonlocal task
-                    task.task_results = json.dumps(results)
-                    task.success_count = success_count
-                    task.error_count = error_count
-                    db.commit()
-                    progress = int(processed / len(document_ids) * 100)
-                    logger.info(f"任务 {task_id} 进度: {progress}% (成功: {success_count}, 失败: {error_count})")
+            # 计算并发数（多进程模式下并发数与进程数一致）
+            use_process_pool = get_config('CHUNK_EXECUTOR') == 'process'
+            if use_process_pool:
+                max_concurrency = max(1, min(get_process_pool_size(), len(pending_ids)))
+            else:
+                max_concurrency = max(1, min(8, len(pending_ids)))
             
-            # 定义处理单个文档的异步函数
+            # 定义处理单个文档的异步函数（数据库读写、文件哈希等阻塞操作都在线程中执行）
             async def process_single_document(doc_id):
-                async with semaphore:  # 使用信号量控制并发
-                    # 每个协程使用自己的数据库会话
-                    thread_db = get_db_session()
-                    try:
-                        document = thread_db.query(Document).filter(Document.id == doc_id).first()
-                        if not document:
-                            return {"status": "failed", "error": "文档不存在", "time": datetime.now().isoformat()}
-                        
-                        # 如果文档正在处理中，则跳过
-                        if document.status == "处理中":
-                            return {"status": "skipped", "error": "文档正在被其他任务处理", "time": datetime.now().isoformat()}
-                        
-                        # 标记文档为处理中
-                        document.status = "处理中"
-                        thread_db.commit()
-                        
-                        # 异步调用切块功能
-                        logger.info(f"开始处理文档 {document.filename}")
-                        await asyncio.to_thread(
-                            chunk_service._process_chunks,
-                            document_id=doc_id,
-                            chunk_strategy=chunk_strategy,
-                            chunk_size=chunk_size,
-                            overlap=overlap
+                try:
+                    claimed = await asyncio.to_thread(
+                        self._claim_document, doc_id, chunk_strategy, chunk_size, overlap, use_process_pool
+                    )
+                    if "status" in claimed:
+                        return claimed
+                    
+                    # 多进程模式下在进程池中执行切块策略，结果回到父进程批量写入（已有切块或缓存可用时不再解析）
+                    logger.info(f"开始处理文档 {claimed['filename']}")
+                    chunk_results = None
+                    if use_process_pool and not claimed["reusable"]:
+                        chunk_results = await run_in_process_pool(
+                            run_strategy_in_process,
+                            chunk_strategy,
+                            claimed["filepath"],
+                            chunk_size,
+                            overlap
                         )
-                        
-                        # 处理成功
-                        return {"status": "completed", "error": None, "time": datetime.now().isoformat()}
-                        
-                    except Exception as e:
-                        error_msg = str(e)
-                        logger.error(f"处理文档 ID:{doc_id} 失败: {error_msg}")
-                        
-                        # 如果出现异常，将文档状态改回未处理
-                        try:
-                            document = thread_db.query(Document).filter(Document.id == doc_id).first()
-                            if document and document.status == "处理中":
-                                document.status = "未切块"
-                                thread_db.commit()
-                        except Exception as db_error:
-                            logger.error(f"更新文档状态失败: {str(db_error)}")
-                            
-                        return {"status": "failed", "error": error_msg, "time": datetime.now().isoformat()}
-                    finally:
-                        # 关闭数据库会话
-                        thread_db.close()
+                    
+                    # 异步调用切块功能
+                    await asyncio.to_thread(
+                        chunk_service._process_chunks,
+                        document_id=doc_id,
+                        chunk_strategy=chunk_strategy,
+                        chunk_size=chunk_size,
+                        overlap=overlap,
+                        chunk_results=chunk_results,
+                        check_lease=check_lease
+                    )
+                    
+                    # _process_chunks 内部捕获异常并记录在任务状态中
+                    chunk_state = CHUNK_TASKS.get(doc_id, {})
+                    if chunk_state.get("status") == "error":
+                        return {"status": "failed", "error": chunk_state.get("message"), "time": datetime.now().isoformat()}
+                    
+                    # 处理成功
+                    return {"status": "completed", "error": None, "time": datetime.now().isoformat()}
+                    
+                except LeaseLostError:
+                    raise
+                except Exception as e:
+                    error_msg = str(e)
+                    logger.error(f"处理文档 ID:{doc_id} 失败: {error_msg}")
+                    # 如果出现异常，将文档状态改回未处理
+                    await asyncio.to_thread(self._release_document, doc_id)
+                    return {"status": "failed", "error": error_msg, "time": datetime.now().isoformat()}
             
-            logger.info(f"任务 {task_id}: 共 {len(document_ids)} 个文档，并发数 {max_concurrency}，批次大小 {batch_size}")
+            # 按配置的顺序排列文档，放入工作队列
+            ordered_ids = self._order_documents(db, pending_ids)
+            queue = asyncio.Queue()
+            for doc_id in ordered_ids:
+                queue.put_nowait(doc_id)
             
-            # 按批次处理，使用异步方式
-            for i in range(0, len(document_ids), batch_size):
-                batch = document_ids[i:i+batch_size]
-                batch_num = i // batch_size + 1
-                total_batches = (len(document_ids) + batch_size - 1) // batch_size
-                logger.info(f"任务 {task_id}: 处理批次 {batch_num}/{total_batches}，共 {len(batch)} 个文档")
-                
-                # 创建当前批次的任务列表
-                tasks = [process_single_document(doc_id) for doc_id in batch]
-                
-                # 处理完成的任务
-                batch_results = {}
-                for doc_id, future in zip(batch, await asyncio.gather(*tasks, return_exceptions=True)):
-                    if isinstance(future, Exception):
-                        # 处理异常情况
-                        logger.error(f"处理文档 {doc_id} 时发生异常: {str(future)}")
-                        batch_results[str(doc_id)] = {
-                            "status": "failed", 
-                            "error": str(future), 
-                            "time": datetime.now().isoformat()
-                        }
-                        error_count += 1
+            # 工作协程：一个文档处理完立即从队列中取下一个，不再按批次等待
+            async def worker():
+                nonlocal success_count, error_count
+                while True:
+                    try:
+                        doc_id = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    
+                    if check_lease:
+                        check_lease()
+                    try:
+                        await asyncio.to_thread(batch_item_service.start_item, task_id, doc_id)
+                        result = await process_single_document(doc_id)
+                    except LeaseLostError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"处理文档 {doc_id} 时发生异常: {str(e)}")
+                        result = {"status": "failed", "error": str(e), "time": datetime.now().isoformat()}
+                    
+                    # 只写入该文档的一行结果，并累加任务计数
+                    await asyncio.to_thread(batch_item_service.finish_item, task_id, doc_id, result)
+                    if result["status"] == "completed":
+                        logger.info(f"文档 ID:{doc_id} 处理完成")
+                        success_count += 1
                     else:
-                        # 处理正常结果
-                        batch_results[str(doc_id)] = future
-                        if future["status"] == "completed":
-                            logger.info(f"文档 ID:{doc_id} 处理完成")
-                            success_count += 1
-                        elif future["status"] == "failed":
-                            error_count += 1
-                
-                # 更新批次结果
-                results.update(batch_results)
-                update_task_status(force=True)
-                
-                # 批次间短暂休息
-                if i + batch_size < len(document_ids):
-                    await asyncio.sleep(0.5)
+                        # 失败和跳过的文档都计为失败，进度才能到达总数
+                        error_count += 1
+                    # 每完成一个文档推送一次进度（只包含该文档的结果）
+                    progress_bus.update(topic, {
+                        "status": "processing",
+                        "success_count": success_count,
+                        "error_count": error_count,
+                        "progress": int((success_count + error_count) / task.total_count * 100) if task.total_count else 0,
+                        "last_item": {"document_id": doc_id, **result}
+                    })
+            
+            logger.info(f"任务 {task_id}: 共 {len(document_ids)} 个文档，并发数 {max_concurrency}，调度顺序 {get_config('BATCH_SCHEDULE_ORDER')}")
+            await asyncio.gather(*(worker() for _ in range(max_concurrency)))
             
             # 完成任务
             task.status = "completed"
             task.completed_at = datetime.now()
-            task.task_results = json.dumps(results)
-            task.success_count = success_count
-            task.error_count = error_count
+            batch_item_service.sync_counts(db, task)
+            success_count = task.success_count
+            error_count = task.error_count
             db.commit()
+            progress_bus.update(topic, {
+                "status": "completed",
+                "success_count": success_count,
+                "error_count": error_count,
+                "progress": int((success_count + error_count) / task.total_count * 100) if task.total_count else 0
+            })
             
             logger.info(f"批量切块任务 {task_id} 完成，共 {len(document_ids)} 个文档，成功 {success_count} 个，失败 {error_count} 个")
             
+        except LeaseLostError:
+            # 任务已由其他工作进程接手，不修改任务状态
+            raise
         except Exception as e:
             # 如果发生异常，记录错误
             logger.error(f"批量处理任务 {task_id} 失败: {str(e)}")
@@ -332,47 +478,81 @@ class BatchChunkingService:
                     task.status = "failed"
                     task.error_message = str(e)
                     db.commit()
+                progress_bus.update(task_topic(task_id), {"status": "failed", "error_message": str(e)})
             except:
                 pass
         finally:
             # 关闭数据库连接
             db.close()
     
-    def get_task_status(self, task_id: str, db: Session) -> Dict[str, Any]:
-        """获取任务状态"""
-        task = db.query(BatchTask).filter(BatchTask.id == task_id).first()
-        if not task:
-            raise HTTPException(status_code=404, detail="任务不存在")
+    def _claim_document(self, doc_id: int, chunk_strategy: str, chunk_size: int, overlap: int,
+                        check_reuse: bool) -> Dict[str, Any]:
+        """
+        校验文档并标记为处理中（在线程中调用，使用独立的短会话）
         
-        # 解析JSON字段
-        document_ids = json.loads(task.document_ids)
-        task_results = json.loads(task.task_results)
-        settings = json.loads(task.settings)
+        check_reuse 为True时同时判断切块结果能否直接复用（可能需要补算文件哈希）。
         
-        # 计算进度
-        progress = 0
-        if task.total_count > 0:
-            done_count = task.success_count + task.error_count
-            progress = int((done_count / task.total_count) * 100)
+        Returns:
+            失败或跳过时返回任务结果字典（含 status），否则返回 {"filename", "filepath", "reusable"}
+        """
+        db = get_db_session()
+        try:
+            document = db.query(Document).filter(Document.id == doc_id).first()
+            if not document:
+                return {"status": "failed", "error": "文档不存在", "time": datetime.now().isoformat()}
+            
+            # 如果文档正在处理中，则跳过
+            if document.status == "处理中":
+                return {"status": "skipped", "error": "文档正在被其他任务处理", "time": datetime.now().isoformat()}
+            
+            # 标记文档为处理中
+            document.status = "处理中"
+            db.commit()
+            
+            reusable = check_reuse and chunk_service.has_reusable_result(
+                document, chunk_strategy, chunk_size, overlap, db)
+            # 提交补算的文件哈希并结束事务，切块结果在另一个会话中写入
+            db.commit()
+            return {"filename": document.filename, "filepath": document.filepath, "reusable": reusable}
+        finally:
+            db.close()
+    
+    def _release_document(self, doc_id: int):
+        """处理失败时把仍为处理中的文档改回未切块（在线程中调用）"""
+        db = get_db_session()
+        try:
+            document = db.query(Document).filter(Document.id == doc_id).first()
+            if document and document.status == "处理中":
+                document.status = "未切块"
+                db.commit()
+        except Exception as db_error:
+            logger.error(f"更新文档状态失败: {str(db_error)}")
+        finally:
+            db.close()
+    
+    def _order_documents(self, db: Session, document_ids: List[int]) -> List[int]:
+        """
+        按配置的调度顺序排列待处理文档
         
-        return {
-            "task_id": task.id,
-            "name": task.name,
-            "type": task.task_type,
-            "status": task.status,
-            "created_at": task.created_at,
-            "updated_at": task.updated_at,
-            "completed_at": task.completed_at,
-            "total_count": task.total_count,
-            "success_count": task.success_count,
-            "error_count": task.error_count,
-            "progress": progress,
-            "settings": settings,
-            "documents": {
-                "ids": document_ids,
-                "results": task_results
-            }
-        }
+        largest_first: 大文件优先，减少大文件夹收尾阶段的长尾等待（默认）
+        smallest_first: 小文件优先（最短作业优先），尽快产出结果
+        fifo: 保持原有顺序
+        """
+        order = get_config('BATCH_SCHEDULE_ORDER')
+        if order not in ("largest_first", "smallest_first"):
+            return list(document_ids)
+        
+        sizes = dict(db.query(Document.id, Document.filesize).filter(Document.id.in_(document_ids)).all())
+        return sorted(
+            document_ids,
+            key=lambda doc_id: sizes.get(doc_id) or 0,
+            reverse=(order == "largest_first")
+        )
+    
+    def get_task_status(self, task_id: str, db: Session, page: int = 1, page_size: int = 50,
+                        status: Optional[str] = None) -> Dict[str, Any]:
+        """获取任务状态（文档结果分页返回）"""
+        return batch_item_service.get_task_status(task_id, db, page, page_size, status)
     
     def get_folder_tasks(self, folder_id: int, db: Session) -> List[Dict[str, Any]]:
         """获取文件夹的任务列表"""
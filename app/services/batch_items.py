@@ -0,0 +1,173 @@
+"""
+批量任务的文档结果
+
+批量切块和批量推送的每个文档对应 batch_task_items 中的一行。处理完一个文档只更新这一行，
+并在同一个事务中累加任务的成功/失败计数，写入量与任务规模无关；任务状态接口返回按状态汇总的数量和分页的文档列表。
+"""
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from ..database import BatchTask, BatchTaskItem, get_db_session
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+ITEM_STATUSES = ("pending", "processing", "completed", "failed", "skipped")
+UNFINISHED_STATUSES = ("pending", "processing")
+FINISHED_STATUSES = ("completed", "failed", "skipped")
+
+
+class BatchItemService:
+    """批量任务文档结果的读写"""
+
+    def create_items(self, db: Session, task_id: str, document_ids: List[int]):
+        """创建任务时为每个文档插入一行待处理记录（与任务记录在同一事务中提交）"""
+        if document_ids:
+            db.execute(insert(BatchTaskItem), [
+                {"task_id": task_id, "document_id": doc_id, "status": "pending"}
+                for doc_id in dict.fromkeys(document_ids)
+            ])
+
+    def start_item(self, task_id: str, document_id: int):
+        """标记文档开始处理"""
+        db = get_db_session()
+        try:
+            db.query(BatchTaskItem).filter(
+                BatchTaskItem.task_id == task_id,
+                BatchTaskItem.document_id == document_id
+            ).update({
+                BatchTaskItem.status: "processing",
+                BatchTaskItem.started_at: datetime.now()
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def finish_item(self, task_id: str, document_id: int, result: Dict[str, Any]):
+        """
+        记录文档的处理结果，并累加任务的成功/失败计数（跳过的文档计为失败）
+
+        Args:
+            result: 处理结果，status 为 completed/failed/skipped，error 为错误信息，其余字段保存在 details 中
+        """
+        status = result.get("status", "failed")
+        details = {k: v for k, v in result.items() if k not in ("status", "error", "time")}
+        db = get_db_session()
+        try:
+            db.query(BatchTaskItem).filter(
+                BatchTaskItem.task_id == task_id,
+                BatchTaskItem.document_id == document_id
+            ).update({
+                BatchTaskItem.status: status,
+                BatchTaskItem.error: result.get("error"),
+                BatchTaskItem.details: details or None,
+                BatchTaskItem.finished_at: datetime.now()
+            }, synchronize_session=False)
+            if status in FINISHED_STATUSES:
+                counter = BatchTask.success_count if status == "completed" else BatchTask.error_count
+                db.query(BatchTask).filter(BatchTask.id == task_id).update(
+                    {counter: counter + 1}, synchronize_session=False
+                )
+            db.commit()
+        finally:
+            db.close()
+
+    def count_items(self, db: Session, task_id: str) -> Dict[str, int]:
+        """按状态统计任务中的文档数量"""
+        counts = {status: 0 for status in ITEM_STATUSES}
+        rows = db.query(BatchTaskItem.status, func.count(BatchTaskItem.id)).filter(
+            BatchTaskItem.task_id == task_id
+        ).group_by(BatchTaskItem.status).all()
+        for status, count in rows:
+            counts[status] = count
+        return counts
+
+    def unfinished_document_ids(self, db: Session, task_id: str) -> List[int]:
+        """尚未得到结果的文档（任务中断后继续执行时只处理这些文档）"""
+        rows = db.query(BatchTaskItem.document_id).filter(
+            BatchTaskItem.task_id == task_id,
+            BatchTaskItem.status.in_(UNFINISHED_STATUSES)
+        ).order_by(BatchTaskItem.id).all()
+        return [row[0] for row in rows]
+
+    def reset_unfinished(self, db: Session, task_id: str):
+        """中断时处理到一半的文档恢复为待处理"""
+        db.query(BatchTaskItem).filter(
+            BatchTaskItem.task_id == task_id,
+            BatchTaskItem.status == "processing"
+        ).update({BatchTaskItem.status: "pending", BatchTaskItem.started_at: None}, synchronize_session=False)
+        db.commit()
+
+    def sync_counts(self, db: Session, task: BatchTask) -> Dict[str, int]:
+        """按文档结果重新计算任务的成功/失败计数（任务结束时校正，跳过的文档计为失败）"""
+        counts = self.count_items(db, task.id)
+        task.success_count = counts["completed"]
+        task.error_count = counts["failed"] + counts["skipped"]
+        return counts
+
+    def list_items(self, db: Session, task_id: str, page: int = 1, page_size: int = 50,
+                   status: Optional[str] = None) -> Dict[str, Any]:
+        """分页获取任务中的文档结果"""
+        page = max(1, page)
+        page_size = max(1, min(page_size, 500))
+        query = db.query(BatchTaskItem).filter(BatchTaskItem.task_id == task_id)
+        if status:
+            query = query.filter(BatchTaskItem.status == status)
+        total = query.count()
+        items = query.order_by(BatchTaskItem.id).offset((page - 1) * page_size).limit(page_size).all()
+        return {
+            "page": page,
+            "page_size": page_size,
+            "total": total,
+            "items": [{
+                "document_id": item.document_id,
+                "status": item.status,
+                "error": item.error,
+                "details": item.details,
+                "started_at": item.started_at,
+                "finished_at": item.finished_at
+            } for item in items]
+        }
+
+    def get_task_status(self, task_id: str, db: Session, page: int = 1, page_size: int = 50,
+                        status: Optional[str] = None) -> Dict[str, Any]:
+        """获取任务状态：汇总数量和一页文档结果"""
+        task = db.query(BatchTask).filter(BatchTask.id == task_id).first()
+        if not task:
+            raise HTTPException(status_code=404, detail="任务不存在")
+
+        settings = json.loads(task.settings) if task.settings else {}
+
+        # 计算进度
+        progress = 0
+        if task.total_count > 0:
+            done_count = task.success_count + task.error_count
+            progress = int((done_count / task.total_count) * 100)
+
+        return {
+            "task_id": task.id,
+            "name": task.name,
+            "type": task.task_type,
+            "status": task.status,
+            "error_message": task.error_message,
+            "created_at": task.created_at,
+            "updated_at": task.updated_at,
+            "completed_at": task.completed_at,
+            "total_count": task.total_count,
+            "success_count": task.success_count,
+            "error_count": task.error_count,
+            "progress": progress,
+            "settings": settings,
+            "counts": self.count_items(db, task_id),
+            "documents": self.list_items(db, task_id, page, page_size, status)
+        }
+
+
+# 全局批量任务结果服务
+batch_item_service = BatchItemService()
@@ -0,0 +1,171 @@
+"""
+按内容寻址的上传文件存储
+
+上传的文件按 SHA-256 保存在 data/blobs/<前两位>/<哈希><扩展名>，内容相同的文件只保存一份，
+Document.filepath 指向该文件，blobs 表记录引用它的文档数，最后一个文档删除时才删除文件。
+内容相同的文档哈希相同，切块时可以直接复用已有的切块结果。
+"""
+import os
+import uuid
+import asyncio
+import logging
+import threading
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import UploadFile
+from sqlalchemy.orm import Session
+
+from ..database import Blob, get_db_session
+from ..config import BLOBS_DIR
+from .file_ingest import iter_upload, write_stream
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """内容寻址的文件存储，引用计数保存在数据库中"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        # 同一进程内放置文件和释放引用串行执行，避免释放时删除正在上传的相同内容
+        self._lock = threading.Lock()
+        self._pending: Dict[str, int] = {}  # 已放入存储但尚未登记引用的文件数（按哈希）
+
+    def _path(self, sha256: str, ext: str) -> str:
+        return os.path.join(self.root, sha256[:2], f"{sha256}{ext}")
+
+    def is_blob_path(self, path: Optional[str]) -> bool:
+        """判断文件是否保存在内容存储中（旧版本上传的文件位于 data/uploads 下）"""
+        return bool(path) and os.path.abspath(path).startswith(self.root + os.sep)
+
+    async def store_stream(self, blocks: AsyncIterator[bytes], ext: str,
+                           max_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        保存数据流
+
+        先写入临时文件并计算哈希，内容已存在时丢弃临时文件。返回的文件在 commit_refs 登记引用之前
+        不会被 release 删除；不再需要时调用 discard。
+
+        Returns:
+            {"path": 文件路径, "size": 大小, "sha256": 哈希, "duplicate": 内容是否已存在}
+        """
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        size, sha256 = await write_stream(blocks, tmp_path, max_size)
+        try:
+            # 查询数据库和移动文件在线程中执行（持有进程内的锁），不阻塞事件循环
+            path, duplicate = await asyncio.to_thread(self._place, tmp_path, sha256, ext.lower())
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return {"path": path, "size": size, "sha256": sha256, "duplicate": duplicate}
+
+    async def store_upload(self, file: UploadFile, ext: str, max_size: Optional[int] = None) -> Dict[str, Any]:
+        """保存上传文件"""
+        return await self.store_stream(iter_upload(file), ext, max_size)
+
+    def _place(self, tmp_path: str, sha256: str, ext: str):
+        """把临时文件放到内容存储中，返回 (文件路径, 内容是否已存在)"""
+        with self._lock:
+            db = get_db_session()
+            try:
+                blob = db.get(Blob, sha256)
+            finally:
+                db.close()
+            path = blob.path if blob and os.path.exists(blob.path) else self._path(sha256, ext)
+            duplicate = os.path.exists(path)
+            if duplicate:
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            self._pending[sha256] = self._pending.get(sha256, 0) + 1
+            return path, duplicate
+
+    def commit_refs(self, db: Session, blobs: List[Dict[str, Any]]):
+        """
+        登记引用并提交调用方的事务
+
+        文档记录与引用计数在同一个事务中提交；提交失败时回滚、清理不再被引用的文件并重新抛出异常。
+        会访问数据库并等待锁，协程中应通过 asyncio.to_thread 调用。
+        """
+        counts = Counter(blob["sha256"] for blob in blobs)
+        try:
+            for blob in {blob["sha256"]: blob for blob in blobs}.values():
+                row = db.get(Blob, blob["sha256"])
+                if row:
+                    row.ref_count = (row.ref_count or 0) + counts[blob["sha256"]]
+                    row.path = blob["path"]
+                else:
+                    db.add(Blob(sha256=blob["sha256"], path=blob["path"], size=blob["size"],
+                                ref_count=counts[blob["sha256"]]))
+            db.commit()
+        except Exception:
+            db.rollback()
+            self.discard(blobs)
+            raise
+        with self._lock:
+            for sha256, count in counts.items():
+                self._unpend(sha256, count)
+
+    def discard(self, blobs: List[Dict[str, Any]]):
+        """放弃未登记引用的文件，没有文档引用时删除"""
+        with self._lock:
+            for blob in blobs:
+                if self._unpend(blob["sha256"], 1):
+                    continue
+                db = get_db_session()
+                try:
+                    row = db.get(Blob, blob["sha256"])
+                    referenced = bool(row and row.ref_count and row.ref_count > 0)
+                finally:
+                    db.close()
+                if not referenced:
+                    self._remove(blob["path"])
+
+    def _unpend(self, sha256: str, count: int) -> int:
+        """减少尚未登记的引用数，返回剩余数量（调用方持有锁）"""
+        remaining = self._pending.get(sha256, 0) - count
+        if remaining > 0:
+            self._pending[sha256] = remaining
+        else:
+            self._pending.pop(sha256, None)
+        return max(remaining, 0)
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+            logger.info(f"已删除不再被引用的文件: {path}")
+        except OSError:
+            pass
+
+    def release(self, sha256: Optional[str]):
+        """释放一次引用，没有文档引用时删除文件"""
+        if not sha256:
+            return
+        with self._lock:
+            db = get_db_session()
+            try:
+                blob = db.get(Blob, sha256)
+                if not blob:
+                    return
+                blob.ref_count = (blob.ref_count or 0) - 1
+                if blob.ref_count > 0 or self._pending.get(sha256):
+                    # 仍有文档引用，或正在上传的相同内容尚未登记引用
+                    blob.ref_count = max(blob.ref_count, 0)
+                    db.commit()
+                    return
+                path = blob.path
+                db.delete(blob)
+                db.commit()
+            finally:
+                db.close()
+            self._remove(path)
+
+
+# 全局内容存储
+blob_store = BlobStore(str(BLOBS_DIR))
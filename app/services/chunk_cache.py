@@ -0,0 +1,192 @@
+"""
+切块结果缓存
+
+以 (文件哈希, 策略名称, 策略版本, 切块大小, 重叠度) 为键，把切块结果以JSONL格式保存在 data/chunk_cache 下。
+同一个文件用相同参数再次切块时直接读取缓存，不再解析文件。
+
+同一文件的缓存放在以文件哈希命名的目录中，删除文档（且没有其他文档引用相同内容）时整个目录一起删除。
+命中缓存时更新文件的修改时间，写入新缓存后定期清理：超过保留天数的缓存删除，总大小超过上限时从最久未使用的开始删除。
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from ..config import get_config, CHUNK_CACHE_DIR
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+# 两次清理之间的最短间隔（秒）
+EVICT_INTERVAL = 600
+# 未完成的临时文件（写入进程异常退出时留下）超过该时间后删除（秒）
+STALE_TMP_SECONDS = 3600
+
+
+def compute_file_hash(filepath: str) -> str:
+    """分块计算文件的SHA-256，用于补算旧文档缺失的 Document.hash 和迁移旧的MD5哈希（与上传时 file_ingest.write_stream 的算法相同）"""
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class ChunkCacheWriter:
+    """边切块边写入缓存，切块结果保存成功后 commit，失败时 discard"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+
+    def write(self, chunk_data: Dict[str, Any]):
+        self._file.write(json.dumps(
+            {"content": chunk_data["content"], "meta": chunk_data.get("meta", {})},
+            ensure_ascii=False
+        ))
+        self._file.write('\n')
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+class ChunkCache:
+    """切块结果缓存（文件存储，多个进程可以共用同一个缓存目录）"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._evict_lock = threading.Lock()
+        self._last_evict = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(get_config('CHUNK_CACHE_ENABLED'))
+
+    def make_key(self, file_hash: str, strategy: str, strategy_version: Optional[str],
+                 chunk_size: int, overlap: int) -> Optional[str]:
+        """生成缓存键，无法确定策略版本时返回None（不使用缓存）"""
+        if not file_hash or not strategy_version:
+            return None
+        raw = json.dumps([file_hash, strategy, strategy_version, chunk_size, overlap])
+        return f"{file_hash}/{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+    def _file_dir(self, file_hash: str) -> str:
+        return os.path.join(self.cache_dir, file_hash[:2], file_hash)
+
+    def _path(self, key: str) -> str:
+        file_hash, params_hash = key.split('/', 1)
+        return os.path.join(self._file_dir(file_hash), f"{params_hash}.jsonl")
+
+    def has(self, key: Optional[str]) -> bool:
+        """判断缓存是否存在，存在时更新修改时间（清理时视为最近使用）"""
+        if not key or not self.enabled:
+            return False
+        try:
+            os.utime(self._path(key))
+            return True
+        except OSError:
+            return False
+
+    def load(self, key: str) -> Iterator[Dict[str, Any]]:
+        """逐条读取缓存的切块结果"""
+        with open(self._path(key), 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def writer(self, key: Optional[str]) -> Optional[ChunkCacheWriter]:
+        """创建缓存写入器，缓存未启用或无法写入时返回None"""
+        if not key or not self.enabled:
+            return None
+        try:
+            return ChunkCacheWriter(self._path(key))
+        except OSError as e:
+            logger.warning(f"无法写入切块缓存: {str(e)}")
+            return None
+
+    def remove_file(self, file_hash: Optional[str]):
+        """删除一个文件的全部缓存（文档删除且没有其他文档引用相同内容时调用）"""
+        if not file_hash:
+            return
+        path = self._file_dir(file_hash)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            logger.info(f"已删除文件 {file_hash[:12]} 的切块缓存")
+
+    def maybe_evict(self):
+        """距上次清理超过 EVICT_INTERVAL 时执行一次清理（写入新缓存后调用）"""
+        with self._evict_lock:
+            if time.time() - self._last_evict < EVICT_INTERVAL:
+                return
+            self._last_evict = time.time()
+        try:
+            self.evict()
+        except Exception as e:
+            logger.warning(f"清理切块缓存失败: {str(e)}")
+
+    def evict(self) -> int:
+        """按保留天数和总大小上限清理缓存，返回删除的文件数"""
+        max_age_days = get_config('CHUNK_CACHE_MAX_AGE_DAYS')
+        max_bytes = get_config('CHUNK_CACHE_MAX_SIZE_MB') * 1024 * 1024
+        now = time.time()
+        entries: List[Tuple[float, int, str]] = []
+        removed = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                age = now - stat.st_mtime
+                if name.endswith('.tmp'):
+                    if age > STALE_TMP_SECONDS:
+                        removed += self._remove(path)
+                elif max_age_days and age > max_age_days * 86400:
+                    removed += self._remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if max_bytes and total > max_bytes:
+            # 从最久未使用的开始删除，直到低于上限
+            for _, size, path in sorted(entries):
+                if total <= max_bytes:
+                    break
+                removed += self._remove(path)
+                total -= size
+        if removed:
+            logger.info(f"已清理 {removed} 个切块缓存文件")
+        return removed
+
+    def _remove(self, path: str) -> int:
+        try:
+            os.remove(path)
+        except OSError:
+            return 0
+        # 删除空的文件目录
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+        return 1
+
+
+# 全局切块缓存
+chunk_cache = ChunkCache(str(CHUNK_CACHE_DIR))
@@ -1,32 +1,93 @@
-from fastapi import HTTPException, BackgroundTasks
+from fastapi import HTTPException
 from fastapi.responses import JSONResponse
+from sqlalchemy import insert, func, select, literal
 from sqlalchemy.orm import Session
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Optional, Iterable, List
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import multiprocessing
+import threading
 import logging
 import traceback
 import os
 import time
-import importlib
-import inspect
 
 from ..database import Document, Chunk, get_db
 from ..config import get_config
 from ..chunk_func.base import BaseChunkStrategy
-from ..chunk_func.word_strategy import WordChunkStrategy
+from ..chunk_func.registry import strategy_registry
+from ..services.chunk_cache import chunk_cache, compute_file_hash
+from ..services.job_queue import job_queue, LeaseLostError
+from ..services.progress_bus import progress_bus, chunk_topic
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 用于跟踪后台任务
+# 执行中切块任务的实时进度（仅在执行任务的进程内可见，持久的任务状态见 Job 表）
 CHUNK_TASKS = {}
 
+# 多进程切块的进程池（按需创建，进程内的策略实例由注册表缓存）
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def get_process_pool_size() -> int:
+    """切块进程池的进程数，默认为CPU核心数"""
+    return get_config('CHUNK_PROCESS_WORKERS') or os.cpu_count() or 1
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """获取切块进程池"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            max_workers = get_process_pool_size()
+            # 使用spawn启动子进程，避免fork时复制父进程中的数据库连接和线程状态
+            _process_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            logger.info(f"已创建切块进程池，进程数: {max_workers}")
+        return _process_pool
+
+def discard_process_pool(pool: ProcessPoolExecutor):
+    """丢弃已损坏的进程池（子进程异常退出后进程池不再可用），下次获取时重新创建"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+async def run_in_process_pool(func: Callable, *args):
+    """
+    在切块进程池中执行函数
+    
+    子进程异常退出（如内存不足被杀死）会使整个进程池损坏，之后提交的任务都会立即抛出 BrokenProcessPool。
+    此时丢弃该进程池并在新建的进程池中重试一次，第二次仍然损坏时抛出异常，由调用方记录为该文档失败。
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = get_process_pool()
+        try:
+            return await loop.run_in_executor(pool, func, *args)
+        except BrokenProcessPool:
+            discard_process_pool(pool)
+            if attempt:
+                raise
+            logger.warning("切块进程池已损坏（子进程异常退出），重新创建进程池后重试")
+
+def run_strategy_in_process(strategy_name: str, file_path: str, chunk_size: int, overlap: int) -> List[Dict[str, Any]]:
+    """在子进程中执行切块策略，返回切块结果交由父进程批量写入数据库"""
+    strategy = strategy_registry.get_instance(strategy_name)
+    if not strategy:
+        raise ValueError(f"不支持的切块策略: {strategy_name}")
+    return list(strategy.iter_chunks(file_path, chunk_size, overlap))
+
 class ChunkService:
     """切块服务类 - 处理文档切块相关操作"""
     
     async def create_chunks(
         self,
         document_id: int,
-        background_tasks: BackgroundTasks,
         chunk_strategy: str,
         chunk_size: int,
         overlap: int,
@@ -56,8 +117,14 @@ class ChunkService:
             if overlap < 0 or overlap >= chunk_size:
                 raise HTTPException(status_code=400, detail="重叠度必须大于等于0且小于切块大小")
             
-            # 检查是否有正在进行的任务
-            if document_id in CHUNK_TASKS and CHUNK_TASKS[document_id].get("status") == "processing":
+            # 加入持久化任务队列，同一文档已有未完成的切块任务时不重复添加
+            job_id, created = job_queue.enqueue("chunk", {
+                "document_id": document_id,
+                "chunk_strategy": chunk_strategy,
+                "chunk_size": chunk_size,
+                "overlap": overlap
+            }, dedupe_key=f"chunk:{document_id}")
+            if not created:
                 return JSONResponse({
                     "status": "processing",
                     "message": "切块任务正在处理中",
@@ -68,18 +135,6 @@ class ChunkService:
             document.status = "处理中"
             db.commit()
             
-            # 启动后台任务
-            background_tasks.add_task(
-                self._process_chunks, 
-                document_id, 
-                chunk_strategy, 
-                chunk_size, 
-                overlap
-            )
-            
-            # 初始化任务状态
-            CHUNK_TASKS[document_id] = {"status": "processing", "progress": 0}
-            
             return JSONResponse({
                 "status": "processing",
                 "message": "切块任务已开始处理",
@@ -95,113 +150,337 @@ class ChunkService:
     
     def get_chunk_status(self, document_id: int) -> JSONResponse:
         """获取切块任务状态"""
-        if document_id not in CHUNK_TASKS:
-            return JSONResponse({"status": "unknown", "message": "未找到相关任务"})
+        return JSONResponse(self.get_chunk_state(document_id))
+    
+    def get_chunk_state(self, document_id: int) -> Dict[str, Any]:
+        """
+        获取切块任务状态
+        
+        以任务队列中的记录为准；任务在本进程执行时使用实时进度，在其他进程执行时使用心跳保存的进度。
+        """
+        job = job_queue.get_latest_job(f"chunk:{document_id}")
+        if not job:
+            return dict(CHUNK_TASKS.get(document_id) or {"status": "unknown", "message": "未找到相关任务"})
         
-        return JSONResponse(CHUNK_TASKS[document_id])
+        if job["status"] == "waiting":
+            return {"status": "processing", "progress": 0, "queued": True}
+        if job["status"] == "processing":
+            live = CHUNK_TASKS.get(document_id)
+            if live and live.get("status") == "processing":
+                return dict(live)
+            return job["progress"] or {"status": "processing", "progress": 0}
+        if job["status"] == "failed":
+            return {"status": "error", "message": job["error_message"] or "切块处理失败"}
+        return job["result"] or {"status": "success", "progress": 100}
     
-    def _process_chunks(self, document_id: int, chunk_strategy: str, chunk_size: int, overlap: int):
-        """后台处理切块任务"""
+    def get_chunk_page(
+        self,
+        document_id: int,
+        db: Session,
+        after: int = 0,
+        limit: int = 50,
+        keyword: Optional[str] = None,
+        truncate: int = 0
+    ) -> Dict[str, Any]:
+        """
+        按序号分页获取切块（keyset分页）
+        
+        Args:
+            document_id: 文档ID
+            db: 数据库会话
+            after: 上一页最后一个切块的序号，从该序号之后开始返回
+            limit: 每页数量
+            keyword: 搜索关键字，只返回内容包含关键字的切块
+            truncate: 内容截断长度，大于0时只返回前truncate个字符
+        
+        Returns:
+            切块列表及下一页游标
+        """
+        limit = max(1, min(limit, 500))
+        content_col = func.substr(Chunk.content, 1, truncate) if truncate > 0 else Chunk.content
+        
+        query = db.query(
+            Chunk.id,
+            Chunk.sequence,
+            content_col.label("content"),
+            func.length(Chunk.content).label("char_count"),
+            Chunk.chunk_metadata
+        ).filter(Chunk.document_id == document_id, Chunk.sequence > after)
+        
+        if keyword:
+            query = query.filter(Chunk.content.contains(keyword, autoescape=True))
+        
+        rows = query.order_by(Chunk.sequence).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        items = [{
+            "id": row.id,
+            "sequence": row.sequence,
+            "content": row.content,
+            "char_count": row.char_count or 0,
+            "truncated": truncate > 0 and (row.char_count or 0) > truncate,
+            "meta": row.chunk_metadata if isinstance(row.chunk_metadata, dict) else {}
+        } for row in rows]
+        
+        return {
+            "items": items,
+            "has_more": has_more,
+            "next_after": items[-1]["sequence"] if has_more else None
+        }
+    
+    def get_chunk(self, document_id: int, sequence: int, db: Session) -> Optional[Dict[str, Any]]:
+        """获取单个切块的完整内容"""
+        chunk = db.query(Chunk).filter(Chunk.document_id == document_id, Chunk.sequence == sequence).first()
+        if not chunk:
+            return None
+        
+        return {
+            "id": chunk.id,
+            "sequence": chunk.sequence,
+            "content": chunk.content,
+            "char_count": len(chunk.content or ""),
+            "truncated": False,
+            "meta": chunk.chunk_metadata if isinstance(chunk.chunk_metadata, dict) else {}
+        }
+    
+    def _process_chunks(
+        self,
+        document_id: int,
+        chunk_strategy: str,
+        chunk_size: int,
+        overlap: int,
+        chunk_results: Optional[Iterable[Dict[str, Any]]] = None,
+        check_lease: Optional[Callable[[], None]] = None
+    ):
+        """
+        后台处理切块任务
+        
+        chunk_results 不为空时表示切块已在其他进程中完成，这里只负责保存结果。
+        check_lease 在每批写入前调用（JobContext.check_lease），租约失效时回滚本次写入并抛出 LeaseLostError，
+        文档状态留给接手任务的工作进程处理。
+        """
         db = next(get_db())
-        CHUNK_TASKS[document_id] = {"status": "processing", "progress": 0}
+        self._set_task_state(document_id, {"status": "processing", "progress": 0})
+        cache_writer = None
         
         try:
             # 检查文档和文件
             document = db.query(Document).filter(Document.id == document_id).first()
             if not document or not os.path.exists(document.filepath):
                 error_msg = "文档不存在" if not document else "文件不存在或已被删除"
-                CHUNK_TASKS[document_id] = {"status": "error", "message": error_msg}
+                self._set_task_state(document_id, {"status": "error", "message": error_msg})
                 return
             
             # 更新进度
-            CHUNK_TASKS[document_id]["progress"] = 10
+            self._set_task_state(document_id, {"status": "processing", "progress": 10})
+            if check_lease:
+                check_lease()
             
-            # 选择切块策略
-            strategy = self._get_strategy_instance(chunk_strategy)
-            if not strategy:
-                CHUNK_TASKS[document_id] = {"status": "error", "message": f"不支持的切块策略: {chunk_strategy}"}
+            # 文件内容和切块参数（含策略版本）都没有变化时沿用已有切块
+            chunk_params = self._build_chunk_params(document, chunk_strategy, chunk_size, overlap)
+            existing_count = self._count_reusable_chunks(document, chunk_params, db)
+            if existing_count:
+                document.status = "已切块"
+                db.commit()
+                logger.info(f"文档 {document_id} 的文件和切块参数均未变化，沿用已有的 {existing_count} 个切块")
+                self._set_task_state(document_id, {"status": "success", "progress": 100, "chunk_count": existing_count, "reused": True})
                 return
             
-            # 执行切块处理
-            start_time = time.time()
-            chunk_results = strategy.process_document(document.filepath, chunk_size, overlap)
-            processing_time = time.time() - start_time
+            # 内容相同的其他文档已用相同参数切块时，在数据库内直接复制其切块
+            source_id = self._find_shared_result(document, chunk_params, db) if chunk_results is None else None
+            if source_id:
+                db.query(Chunk).filter(Chunk.document_id == document_id).delete()
+                copied = self._copy_chunks(source_id, document_id, db)
+                document.last_chunk_params = chunk_params
+                document.status = "已切块"
+                db.commit()
+                logger.info(f"文档 {document_id} 与文档 {source_id} 内容相同，复制了 {copied} 个切块")
+                self._set_task_state(document_id, {"status": "success", "progress": 100, "chunk_count": copied, "reused": True})
+                return
             
-            logger.info(f"切块处理完成，耗时: {processing_time:.2f}秒，共产生 {len(chunk_results)} 个块")
-            CHUNK_TASKS[document_id]["progress"] = 50
+            # 选择切块结果来源：已有结果 > 切块缓存 > 执行策略，新产生的结果同时写入缓存
+            cache_key = chunk_cache.make_key(
+                chunk_params["file_hash"], chunk_strategy, chunk_params["strategy_version"], chunk_size, overlap
+            )
+            cache_hit = chunk_cache.has(cache_key)
+            if chunk_results is None and cache_hit:
+                logger.info(f"文档 {document_id} 命中切块缓存，跳过文件解析")
+                chunk_results = chunk_cache.load(cache_key)
+            elif chunk_results is None:
+                strategy = self._get_strategy_instance(chunk_strategy)
+                if not strategy:
+                    self._set_task_state(document_id, {"status": "error", "message": f"不支持的切块策略: {chunk_strategy}"})
+                    return
+                chunk_results = strategy.iter_chunks(document.filepath, chunk_size, overlap)
+            if not cache_hit:
+                cache_writer = chunk_cache.writer(cache_key)
             
-            # 保存结果
+            # 先删除旧切块，新切块在同一个事务中边生成边写入，失败时整体回滚
             db.query(Chunk).filter(Chunk.document_id == document_id).delete()
-            document.last_chunk_params = {
-                "strategy": chunk_strategy,
-                "size": chunk_size,
-                "overlap": overlap
-            }
+            document.last_chunk_params = chunk_params
             document.status = "已切块"
+            db.flush()
+            
+            # 流式执行切块处理，按批次使用Core insert批量写入（executemany），绕过ORM工作单元开销
+            start_time = time.time()
+            batch_size = get_config('CHUNK_INSERT_BATCH_SIZE') or 1000
+            file_size = document.filesize or os.path.getsize(document.filepath)
+            batch = []
+            chunk_count = 0
+            content_chars = 0
             
-            # 保存切块结果到数据库
-            chunk_count = len(chunk_results)
-            update_interval = max(1, chunk_count // 5)  # 每20%更新一次进度
-            
-            for i, chunk_data in enumerate(chunk_results, 1):
-                chunk = Chunk(
-                    document_id=document_id,
-                    sequence=i,
-                    content=chunk_data["content"],
-                    chunk_size=chunk_size,
-                    overlap=overlap,
-                    chunk_strategy=chunk_strategy,
-                    chunk_metadata=chunk_data.get("meta", {})
-                )
-                db.add(chunk)
+            for chunk_count, chunk_data in enumerate(chunk_results, 1):
+                if cache_writer:
+                    cache_writer.write(chunk_data)
+                content = chunk_data["content"]
+                content_chars += len(content)
+                batch.append({
+                    "document_id": document_id,
+                    "sequence": chunk_count,
+                    "content": content,
+                    "chunk_size": chunk_size,
+                    "overlap": overlap,
+                    "chunk_strategy": chunk_strategy,
+                    "chunk_metadata": chunk_data.get("meta", {})
+                })
                 
-                # 更新进度
-                if i % update_interval == 0:
-                    progress = 50 + int(i / chunk_count * 40)
-                    CHUNK_TASKS[document_id]["progress"] = min(progress, 90)
+                if len(batch) >= batch_size:
+                    if check_lease:
+                        check_lease()
+                    db.execute(insert(Chunk), batch)
+                    batch = []
+                    self._update_progress(document_id, chunk_count, content_chars, file_size)
+            
+            if batch:
+                db.execute(insert(Chunk), batch)
+                self._update_progress(document_id, chunk_count, content_chars, file_size)
+            
+            if check_lease:
+                check_lease()
+            processing_time = time.time() - start_time
+            logger.info(f"切块处理完成，耗时: {processing_time:.2f}秒，共产生 {chunk_count} 个块")
             
             db.commit()
-            CHUNK_TASKS[document_id] = {"status": "success", "progress": 100}
+            if cache_writer:
+                cache_writer.commit()
+                cache_writer = None
+                chunk_cache.maybe_evict()
+            self._set_task_state(document_id, {"status": "success", "progress": 100, "chunk_count": chunk_count})
         
+        except LeaseLostError:
+            logger.warning(f"文档 {document_id} 的切块任务租约已失效，放弃本次写入")
+            db.rollback()
+            CHUNK_TASKS.pop(document_id, None)
+            raise
         except Exception as e:
             logger.error(f"切块处理异常: {str(e)}")
             logger.error(traceback.format_exc())
-            CHUNK_TASKS[document_id] = {"status": "error", "message": f"切块处理失败: {str(e)}"}
+            self._set_task_state(document_id, {"status": "error", "message": f"切块处理失败: {str(e)}"})
             
-            # 出错时恢复文档状态
+            # 出错时回滚未提交的切块并恢复文档状态
             try:
+                db.rollback()
                 document = db.query(Document).filter(Document.id == document_id).first()
                 if document and document.status == "处理中":
                     document.status = "未切块"
                     db.commit()
             except Exception:
                 pass
+        finally:
+            if cache_writer:
+                cache_writer.discard()
+            db.close()
+
+    def _build_chunk_params(self, document: Document, chunk_strategy: str, chunk_size: int, overlap: int) -> Dict[str, Any]:
+        """
+        生成本次切块的参数记录（保存为 last_chunk_params）
+        
+        除策略和大小外还记录文件哈希和策略版本，文件哈希缺失时（旧数据）补算并保存到文档。
+        """
+        if not document.hash:
+            document.hash = compute_file_hash(document.filepath)
+        return {
+            "strategy": chunk_strategy,
+            "size": chunk_size,
+            "overlap": overlap,
+            "strategy_version": strategy_registry.get_strategy_version(chunk_strategy),
+            "file_hash": document.hash
+        }
+    
+    def _count_reusable_chunks(self, document: Document, chunk_params: Dict[str, Any], db: Session) -> int:
+        """上次切块的参数与本次完全一致时返回已有切块数量，否则返回0"""
+        last_params = document.last_chunk_params
+        if not isinstance(last_params, dict) or last_params != chunk_params:
+            return 0
+        if not chunk_params["strategy_version"]:
+            return 0
+        return db.query(func.count(Chunk.id)).filter(Chunk.document_id == document.id).scalar() or 0
+    
+    def _find_shared_result(self, document: Document, chunk_params: Dict[str, Any], db: Session) -> Optional[int]:
+        """查找内容相同且已用相同参数切块的其他文档，返回其ID"""
+        if not document.hash or not chunk_params["strategy_version"]:
+            return None
+        candidates = db.query(Document.id, Document.last_chunk_params).filter(
+            Document.hash == document.hash,
+            Document.id != document.id,
+            Document.status == "已切块"
+        ).all()
+        for candidate_id, last_params in candidates:
+            if last_params == chunk_params:
+                return candidate_id
+        return None
+    
+    def _copy_chunks(self, source_id: int, target_id: int, db: Session) -> int:
+        """用 INSERT ... SELECT 复制切块，返回复制的数量"""
+        columns = ["sequence", "content", "chunk_size", "overlap", "chunk_strategy", "chunk_metadata"]
+        db.execute(insert(Chunk).from_select(
+            ["document_id"] + columns,
+            select(literal(target_id), *[getattr(Chunk, column) for column in columns]).where(
+                Chunk.document_id == source_id
+            ).order_by(Chunk.sequence)
+        ))
+        return db.query(func.count(Chunk.id)).filter(Chunk.document_id == target_id).scalar() or 0
+    
+    def has_reusable_result(self, document: Document, chunk_strategy: str, chunk_size: int, overlap: int, db: Session) -> bool:
+        """
+        判断切块结果是否可以不经解析直接获得（已有切块仍然有效、内容相同的文档已切块或命中切块缓存）
+        
+        多进程批量切块在把文档交给进程池之前调用，可复用时直接调用 _process_chunks 即可。
+        旧文档缺失的文件哈希会在这里补算并写入 document，由调用方提交。
+        """
+        chunk_params = self._build_chunk_params(document, chunk_strategy, chunk_size, overlap)
+        if self._count_reusable_chunks(document, chunk_params, db):
+            return True
+        if self._find_shared_result(document, chunk_params, db):
+            return True
+        return chunk_cache.has(chunk_cache.make_key(
+            chunk_params["file_hash"], chunk_strategy, chunk_params["strategy_version"], chunk_size, overlap
+        ))
+    
+    def _update_progress(self, document_id: int, chunk_count: int, content_chars: int, file_size: int):
+        """
+        每写入一批切块后更新任务进度
+        
+        切块总数在流式处理结束前无法得知，进度按已处理的文本量相对文件大小估算（10%~90%），
+        同时返回已保存的切块数量，最终完成时进度为100%。
+        """
+        task = CHUNK_TASKS.setdefault(document_id, {"status": "processing", "progress": 10})
+        if file_size:
+            estimated = 10 + int(min(1.0, content_chars / file_size) * 80)
+            task["progress"] = max(task.get("progress", 10), min(estimated, 90))
+        task["chunk_count"] = chunk_count
+        progress_bus.set(chunk_topic(document_id), task)
+    
+    def _set_task_state(self, document_id: int, state: Dict[str, Any]):
+        """更新切块任务状态并推送给订阅者"""
+        CHUNK_TASKS[document_id] = state
+        progress_bus.set(chunk_topic(document_id), state)
 
     def _get_strategy_instance(self, strategy_name: str) -> BaseChunkStrategy:
-        """获取策略实例"""
-        # 如果是内置策略直接返回
-        if strategy_name == "word":
-            return WordChunkStrategy()
-            
-        # 获取所有可用策略
-        strategies = get_config('CHUNK_STRATEGIES')
-        
-        # 寻找匹配的策略
-        for strategy_meta in strategies:
-            if strategy_meta.get('name') == strategy_name:
-                module_path = f"app.chunk_func.{strategy_name}_strategy"
-                
-                try:
-                    # 动态导入模块
-                    module = importlib.import_module(module_path)
-                    
-                    # 查找策略类
-                    for name, obj in inspect.getmembers(module):
-                        if (inspect.isclass(obj) and 
-                            issubclass(obj, BaseChunkStrategy) and 
-                            obj is not BaseChunkStrategy):
-                            return obj()
-                except Exception as e:
-                    logger.error(f"加载切块策略 {strategy_name} 时出错: {str(e)}")
-                    
-        return None 
\ No newline at end of file
+        """获取策略实例（由策略注册表缓存复用）"""
+        try:
+            return strategy_registry.get_instance(strategy_name)
+        except Exception as e:
+            logger.error(f"加载切块策略 {strategy_name} 时出错: {str(e)}")
+            return None
@@ -0,0 +1,178 @@
+"""
+Dify段落批量删除
+
+删除文档中已有的段落（例如Dify自动分段生成的段落）时，边分页获取边删除：
+获取到的段落ID进入队列，由一组删除协程并发处理。所有删除请求都在共享的后台事件循环中执行，
+共用一个令牌桶限速器和全局并发上限，无论同时清理多少个文档，对Dify的请求速率都不会超过配置值。
+"""
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Any, Iterable, List, Optional, Set
+
+from ..config import get_config
+from .dify_client import get_async_dify_client, run_in_background
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100         # 每次获取的段落数
+MAX_LIST_PASSES = 5     # 最多重新列举的轮数（删除会使后续分页前移，需要从头再列举确认）
+MAX_RETRIES = 3         # 单个段落的最大尝试次数
+
+
+class TokenBucket:
+    """令牌桶限速器（在单个事件循环内使用）"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SegmentCleaner:
+    """
+    段落删除流水线
+
+    delete_all() / delete_segments() 可以在任意线程或事件循环中调用，实际的删除在共享的后台事件循环中执行，
+    返回 concurrent.futures.Future：同步调用方 result()，协程 await asyncio.wrap_future(...)。
+    """
+
+    def __init__(self, rate: float, concurrency: int):
+        self.rate = rate
+        self.concurrency = concurrency
+        # 以下对象只在后台事件循环中创建和使用
+        self._bucket: Optional[TokenBucket] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def delete_all(self, dataset_id: str, document_id: str) -> Future:
+        """删除文档的所有段落，结果为 {'status', 'deleted', 'failed'}"""
+        return run_in_background(self._delete_all(dataset_id, document_id))
+
+    def delete_segments(self, dataset_id: str, document_id: str, segment_ids: Iterable[str],
+                        check_lease: Optional[Callable[[], None]] = None) -> Future:
+        """删除指定的段落，结果为 {'status', 'deleted', 'failed', 'failed_ids'}；check_lease 在每次删除请求前调用"""
+        return run_in_background(self._delete_segments(dataset_id, document_id, list(segment_ids), check_lease))
+
+    def _ensure_limits(self):
+        if self._bucket is None:
+            self._bucket = TokenBucket(self.rate, max(1.0, self.rate))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def _limited(self, client, method: str, url: str, **kwargs):
+        await self._bucket.acquire()
+        async with self._semaphore:
+            return await client.request(method, url, **kwargs)
+
+    async def _delete_one(self, client, base_url: str, segment_id: str,
+                          check_lease: Optional[Callable[[], None]] = None) -> bool:
+        for attempt in range(MAX_RETRIES):
+            if check_lease:
+                check_lease()
+            try:
+                response = await self._limited(client, 'DELETE', f"{base_url}/{segment_id}")
+                response.raise_for_status()
+                return True
+            except Exception as e:
+                if attempt < MAX_RETRIES - 1:
+                    await asyncio.sleep(1 * (2 ** attempt) + random.uniform(0, 1))
+                else:
+                    logger.warning(f"删除段落 {segment_id} 失败: {str(e)}")
+        return False
+
+    def _base_url(self, dataset_id: str, document_id: str) -> str:
+        return f"{get_config('DIFY_API_SERVER')}/v1/datasets/{dataset_id}/documents/{document_id}/segments"
+
+    async def _delete_segments(self, dataset_id: str, document_id: str, segment_ids: List[str],
+                               check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        self._ensure_limits()
+        client = get_async_dify_client()
+        base_url = self._base_url(dataset_id, document_id)
+        outcomes = await asyncio.gather(*(self._delete_one(client, base_url, sid, check_lease) for sid in segment_ids))
+        failed_ids = [sid for sid, ok in zip(segment_ids, outcomes) if not ok]
+        return {
+            'status': 'success',
+            'deleted': len(segment_ids) - len(failed_ids),
+            'failed': len(failed_ids),
+            'failed_ids': failed_ids
+        }
+
+    async def _delete_all(self, dataset_id: str, document_id: str) -> Dict[str, Any]:
+        self._ensure_limits()
+        client = get_async_dify_client()
+        base_url = self._base_url(dataset_id, document_id)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=PAGE_SIZE * 2)
+        seen: Set[str] = set()
+        counts = {'deleted': 0, 'failed': 0}
+        start_time = time.time()
+
+        async def deleter():
+            while True:
+                segment_id = await queue.get()
+                try:
+                    if await self._delete_one(client, base_url, segment_id):
+                        counts['deleted'] += 1
+                    else:
+                        counts['failed'] += 1
+                finally:
+                    queue.task_done()
+
+        async def list_pass() -> int:
+            """从第一页开始列举一轮，把未处理过的段落送入删除队列，返回新发现的段落数"""
+            found = 0
+            page = 1
+            while True:
+                response = await self._limited(client, 'GET', base_url, params={'page': page, 'limit': PAGE_SIZE})
+                response.raise_for_status()
+                data = response.json()
+                segments = data.get('data', []) if isinstance(data, dict) else data
+                for segment in segments:
+                    segment_id = segment.get('id') if isinstance(segment, dict) else None
+                    if segment_id and segment_id not in seen:
+                        seen.add(segment_id)
+                        found += 1
+                        await queue.put(segment_id)
+                if len(segments) < PAGE_SIZE:
+                    return found
+                page += 1
+
+        workers = [asyncio.create_task(deleter()) for _ in range(self.concurrency)]
+        try:
+            # 删除会让后面的段落前移到已经读过的页，所以每轮列举结束后等删除完成再从头列举，直到没有新段落
+            for _ in range(MAX_LIST_PASSES):
+                found = await list_pass()
+                await queue.join()
+                if found == 0:
+                    break
+        except Exception as e:
+            logger.error(f"获取段落列表失败: {str(e)}")
+            await queue.join()
+            return {'status': 'error', 'message': str(e), **counts}
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        logger.info(f"段落删除完成: 成功 {counts['deleted']} 个, 失败 {counts['failed']} 个，耗时 {time.time() - start_time:.2f} 秒")
+        return {'status': 'success', **counts}
+
+
+# 全局段落删除流水线
+segment_cleaner = SegmentCleaner(
+    rate=get_config('DIFY_DELETE_RATE'),
+    concurrency=get_config('DIFY_DELETE_CONCURRENCY')
+)
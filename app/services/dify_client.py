@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import Coroutine, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..config import get_config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+class DifyClient:
+    """
+    线程安全的Dify HTTP客户端
+    
+    所有Dify服务共用一个 requests.Session，通过 HTTPAdapter 连接池复用 TCP/TLS 连接（keep-alive），
+    并为每个请求设置默认超时，避免挂起的请求长期占用工作线程。
+    """
+    
+    def __init__(self, api_key: str, pool_size: int, timeout: Tuple[float, float]):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization': f'Bearer {api_key}'})
+        
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+    
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """发送请求，未指定timeout时使用默认的（连接超时, 读取超时）"""
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+    
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+    
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+    
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+    
+    def close(self):
+        self.session.close()
+
+# 全局共享的客户端
+_client: Optional[DifyClient] = None
+_client_lock = threading.Lock()
+
+def get_dify_client() -> DifyClient:
+    """获取全局共享的Dify客户端"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DifyClient(
+                api_key=get_config('DIFY_API_KEY'),
+                pool_size=get_config('DIFY_POOL_SIZE'),
+                timeout=get_config('DIFY_TIMEOUT')
+            )
+        return _client
+
+class AsyncDifyClient:
+    """
+    异步Dify HTTP客户端（基于httpx）
+    
+    批量推送使用协程处理等待、分页和上传，大量文档可以同时处于推送中而不占用线程。
+    httpx的连接池绑定在事件循环上，因此每个事件循环各有一个客户端。
+    """
+    
+    def __init__(self, api_key: str, pool_size: int, timeout: Tuple[float, float]):
+        connect_timeout, read_timeout = timeout
+        self.client = httpx.AsyncClient(
+            headers={'Authorization': f'Bearer {api_key}'},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+    
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        return await self.client.request(method, url, **kwargs)
+    
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('GET', url, **kwargs)
+    
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('POST', url, **kwargs)
+    
+    async def delete(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('DELETE', url, **kwargs)
+    
+    async def aclose(self):
+        await self.client.aclose()
+
+# 每个事件循环一个异步客户端，事件循环结束后自动释放
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncDifyClient]" = weakref.WeakKeyDictionary()
+
+def get_async_dify_client() -> AsyncDifyClient:
+    """获取当前事件循环共享的异步Dify客户端"""
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = AsyncDifyClient(
+                api_key=get_config('DIFY_API_KEY'),
+                pool_size=get_config('DIFY_ASYNC_POOL_SIZE'),
+                timeout=get_config('DIFY_TIMEOUT')
+            )
+            _async_clients[loop] = client
+        return client
+
+async def close_async_dify_client():
+    """关闭当前事件循环的异步客户端（在 asyncio.run 等临时事件循环结束前调用）"""
+    with _client_lock:
+        client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+# 后台事件循环：让同步代码（线程中的单文档推送等）也能执行异步的Dify操作，
+# 并使这些操作共用同一套限速器和并发上限
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_lock = threading.Lock()
+
+def run_in_background(coro: Coroutine) -> Future:
+    """在共享的后台事件循环中执行协程，返回 concurrent.futures.Future"""
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name='dify-background-loop', daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop)
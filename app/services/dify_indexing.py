@@ -0,0 +1,198 @@
+"""
+Dify文档索引状态监视器
+
+所有等待Dify完成索引的推送共用一个调度线程：待检查的 (dataset_id, batch_id) 按下次检查时间放在一个堆中，
+到期后通过共享的HTTP连接池查询 indexing-status，结果通过 Future 通知等待方。
+检查间隔根据已观测到的"每KB索引耗时"自适应调整：预计尚未完成时少查，预计快完成时再密集检查。
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from ..config import get_config
+from .dify_client import get_dify_client
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+MAX_WAIT_TIME = 600     # 最长等待10分钟，超时后按完成处理（与原逐文档轮询一致）
+MIN_INTERVAL = 1.0      # 最短检查间隔（秒）
+MAX_INTERVAL = 10.0     # 最长检查间隔（秒）
+ERROR_INTERVAL = 5.0    # 请求失败后的重试间隔（秒）
+EWMA_ALPHA = 0.3        # 每KB耗时估计的平滑系数
+
+
+class _PendingIndexing:
+    """一个等待中的索引任务"""
+
+    __slots__ = ('dataset_id', 'batch_id', 'size_kb', 'started', 'last_pending', 'checks', 'future')
+
+    def __init__(self, dataset_id: str, batch_id: str, size_kb: float):
+        self.dataset_id = dataset_id
+        self.batch_id = batch_id
+        self.size_kb = size_kb
+        self.started = time.time()
+        # 最近一次确认"尚未完成"的时间，实际完成时间介于它和检查到完成之间
+        self.last_pending = self.started
+        self.checks = 0
+        self.future: Future = Future()
+
+
+class IndexingWatcher:
+    """
+    集中式索引状态监视器
+
+    watch() 返回 concurrent.futures.Future，结果为 True（完成或等待超时）或 False（索引失败）。
+    同步调用方可以直接 future.result()，协程可以 await asyncio.wrap_future(future)。
+    """
+
+    def __init__(self, poll_workers: int):
+        self._lock = threading.Condition()
+        self._heap = []
+        self._counter = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._poll_workers = poll_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # 观测到的每KB索引耗时（秒），尚无观测时为None
+        self._seconds_per_kb: Optional[float] = None
+
+    def watch(self, dataset_id: str, batch_id: str, size_bytes: int = 0) -> Future:
+        """
+        登记一个等待索引完成的文档
+
+        Args:
+            dataset_id: 知识库ID
+            batch_id: 创建文档时返回的批次ID
+            size_bytes: 原始文件大小，用于估计索引耗时
+        """
+        pending = _PendingIndexing(dataset_id, batch_id, max(size_bytes, 1) / 1024)
+        with self._lock:
+            self._ensure_started()
+            self._schedule(pending, self._first_delay(pending))
+        return pending.future
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._executor = ThreadPoolExecutor(max_workers=self._poll_workers,
+                                                thread_name_prefix='dify-indexing-poll')
+            self._thread = threading.Thread(target=self._run, name='dify-indexing-watcher', daemon=True)
+            self._thread.start()
+
+    def _schedule(self, pending: _PendingIndexing, delay: float):
+        heapq.heappush(self._heap, (time.time() + delay, next(self._counter), pending))
+        self._lock.notify()
+
+    def _expected_duration(self, pending: _PendingIndexing) -> Optional[float]:
+        if self._seconds_per_kb is None:
+            return None
+        return self._seconds_per_kb * pending.size_kb
+
+    def _first_delay(self, pending: _PendingIndexing) -> float:
+        expected = self._expected_duration(pending)
+        if expected is None:
+            return 2.0
+        return min(max(expected, MIN_INTERVAL), MAX_INTERVAL)
+
+    def _next_delay(self, pending: _PendingIndexing) -> float:
+        """根据预计剩余时间计算下次检查间隔"""
+        elapsed = time.time() - pending.started
+        expected = self._expected_duration(pending)
+
+        if expected is None:
+            # 还没有观测数据，沿用原来的固定间隔
+            if elapsed < 60:
+                return 2.0
+            elif elapsed < 180:
+                return 5.0
+            return 10.0
+
+        remaining = expected - elapsed
+        if remaining > 0:
+            # 预计还需要一段时间：在预计完成时再查，最长不超过 MAX_INTERVAL
+            return min(max(remaining, MIN_INTERVAL), MAX_INTERVAL)
+
+        # 已超过预计时间：从最短间隔开始逐步放宽
+        overdue = -remaining
+        return min(max(MIN_INTERVAL, overdue / 4), MAX_INTERVAL)
+
+    def _observe(self, pending: _PendingIndexing, checked_at: float):
+        """
+        记录一次完成的索引耗时，更新每KB耗时估计
+
+        实际完成时间只知道落在"上次未完成"和"本次检查"之间，取中点，避免检查间隔本身把估计越推越大。
+        """
+        duration = (pending.last_pending + checked_at) / 2 - pending.started
+        sample = duration / pending.size_kb
+        with self._lock:
+            if self._seconds_per_kb is None:
+                self._seconds_per_kb = sample
+            else:
+                self._seconds_per_kb = EWMA_ALPHA * sample + (1 - EWMA_ALPHA) * self._seconds_per_kb
+
+    def _run(self):
+        """调度线程：取出到期的检查并交给轮询线程池"""
+        while True:
+            with self._lock:
+                while not self._heap or self._heap[0][0] > time.time():
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._lock.wait(timeout)
+                _, _, pending = heapq.heappop(self._heap)
+            self._executor.submit(self._check, pending)
+
+    def _check(self, pending: _PendingIndexing):
+        """查询一次索引状态，完成则通知等待方，否则重新排期"""
+        if pending.future.done():
+            return
+
+        elapsed = time.time() - pending.started
+        if elapsed >= MAX_WAIT_TIME:
+            logger.warning(f"等待文档处理超时(>{MAX_WAIT_TIME // 60}分钟)，继续处理")
+            pending.future.set_result(True)
+            return
+
+        pending.checks += 1
+        delay = None
+        checked_at = time.time()
+        try:
+            url = f"{get_config('DIFY_API_SERVER')}/v1/datasets/{pending.dataset_id}/documents/{pending.batch_id}/indexing-status"
+            response = get_dify_client().get(url)
+
+            if response.status_code != 200:
+                delay = ERROR_INTERVAL
+            else:
+                data = response.json()
+
+                # 尝试从不同可能的格式获取状态
+                if 'data' in data and isinstance(data['data'], list) and data['data']:
+                    status = data['data'][0].get('indexing_status', '')
+                else:
+                    status = data.get('status', data.get('indexing_status', ''))
+
+                if status in ['completed', 'ready', 'done']:
+                    self._observe(pending, checked_at)
+                    pending.future.set_result(True)
+                    return
+
+                if status in ['failed', 'error']:
+                    pending.future.set_result(False)
+                    return
+
+                pending.last_pending = checked_at
+
+                # 等待较久时定期记录日志
+                if elapsed > 60 and pending.checks % 10 == 0:
+                    logger.info(f"文档处理中，已等待 {int(elapsed // 60)}分{int(elapsed % 60)}秒")
+        except Exception as e:
+            logger.warning(f"检查文档状态出错: {str(e)}")
+            delay = MAX_INTERVAL
+
+        with self._lock:
+            self._schedule(pending, delay if delay is not None else self._next_delay(pending))
+
+
+# 全局索引状态监视器
+indexing_watcher = IndexingWatcher(poll_workers=get_config('DIFY_INDEXING_POLL_WORKERS'))
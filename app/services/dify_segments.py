@@ -0,0 +1,244 @@
+"""
+Dify段落数据构建与分批上传
+
+切块转换为Dify段落、按批次并行上传并对单个批次重试，同步和异步推送共用。
+上传结果按段落序号区间（左闭右开）记录成功和失败的批次，重试时只需重新发送失败的区间。
+"""
+import json
+import time
+import hashlib
+import random
+import asyncio
+import logging
+from typing import Callable, List, Dict, Any, Optional, Sequence, Tuple
+
+from ..config import get_config
+from .dify_client import get_async_dify_client, run_in_background
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+Range = Tuple[int, int]
+
+# 一轮上传结束后重新发送失败区间前的等待时间（秒）
+RESEND_DELAY = 5
+
+
+def build_segments(chunks: Sequence[Any]) -> List[Dict[str, Any]]:
+    """将切块转换为Dify段落数据，chunk_metadata 按配置转换为 keywords"""
+    pass_meta = get_config('PASS_META_TO_DIFY')
+    segments = []
+    for chunk in chunks:
+        keywords = []
+        if pass_meta and chunk.chunk_metadata:
+            # 将 chunk_metadata 字典转换为字符串列表
+            for key, value in chunk.chunk_metadata.items():
+                if isinstance(value, (list, dict)):
+                    keywords.append(f"{key}:{json.dumps(value, ensure_ascii=False)}")
+                else:
+                    keywords.append(f"{key}:{str(value)}")
+
+        segments.append({
+            "content": chunk.content,
+            "answer": "",
+            "keywords": keywords
+        })
+    return segments
+
+
+def segment_hash(segment: Dict[str, Any]) -> str:
+    """计算段落数据的哈希，用于判断段落在两次推送之间是否发生变化"""
+    raw = json.dumps(
+        [segment.get("content", ""), segment.get("answer", ""), segment.get("keywords", [])],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def split_ranges(total: int, batch_size: int, ranges: Optional[Sequence[Range]] = None) -> List[Range]:
+    """
+    将段落序号划分为批次区间
+
+    Args:
+        total: 段落总数
+        batch_size: 每批段落数
+        ranges: 只划分这些区间（重试失败区间时使用），为空时划分全部段落
+    """
+    batch_size = max(1, batch_size)
+    source = ranges if ranges is not None else [(0, total)]
+    batches = []
+    for start, end in source:
+        end = min(end, total)
+        for batch_start in range(start, end, batch_size):
+            batches.append((batch_start, min(batch_start + batch_size, end)))
+    return batches
+
+
+def merge_ranges(ranges: Sequence[Range]) -> List[List[int]]:
+    """合并相邻或重叠的区间，便于记录和展示"""
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _retry_delay(attempt: int) -> float:
+    return 1 * (2 ** attempt) + random.uniform(0, 1)
+
+
+def _extract_created(data: Any) -> List[Dict]:
+    if isinstance(data, dict) and isinstance(data.get('data'), list):
+        return data['data']
+    return []
+
+
+def _summarize(outcomes: Dict[Range, Optional[List[Dict]]], errors: Dict[Range, str],
+               elapsed: float) -> Dict[str, Any]:
+    """汇总各批次上传结果"""
+    landed = [r for r, created in outcomes.items() if created is not None]
+    failed = [r for r in outcomes if outcomes[r] is None]
+
+    # 按序号顺序拼接Dify返回的段落
+    created_segments = []
+    for r in sorted(landed):
+        created_segments.extend(outcomes[r])
+
+    landed_count = sum(end - start for start, end in landed)
+    result = {
+        'landed': merge_ranges(landed),
+        'failed': merge_ranges(failed),
+        'data': {'data': created_segments}
+    }
+    if failed:
+        logger.error(f"段落上传部分失败: 成功 {landed_count} 个, 失败区间 {result['failed']}")
+        result['status'] = 'error'
+        result['message'] = f"{len(failed)} 个批次上传失败: {next(iter(errors.values()), '未知错误')}"
+    else:
+        logger.info(f"添加 {landed_count} 个段落完成，耗时 {elapsed:.2f} 秒")
+        result['status'] = 'success'
+    return result
+
+
+async def _upload_batches_async(client, url: str, segments: List[Dict[str, Any]], batches: List[Range],
+                                errors: Dict[Range, str],
+                                check_lease: Optional[Callable[[], None]] = None) -> Dict[Range, Optional[List[Dict]]]:
+    """上传一轮批次，返回 区间 -> Dify返回的段落（失败为None）"""
+    max_retries = get_config('DIFY_SEGMENT_MAX_RETRIES')
+    semaphore = asyncio.Semaphore(max(1, get_config('DIFY_SEGMENT_UPLOAD_CONCURRENCY')))
+
+    async def upload_batch(batch: Range) -> Optional[List[Dict]]:
+        start, end = batch
+        async with semaphore:
+            for attempt in range(max_retries):
+                if check_lease:
+                    check_lease()
+                try:
+                    response = await client.post(url, json={"segments": segments[start:end]})
+                    response.raise_for_status()
+                    errors.pop(batch, None)
+                    return _extract_created(response.json())
+                except Exception as e:
+                    if attempt < max_retries - 1:
+                        logger.warning(f"上传段落 [{start}, {end}) 失败: {str(e)}，第{attempt + 1}次重试...")
+                        await asyncio.sleep(_retry_delay(attempt))
+                    else:
+                        errors[batch] = str(e)
+        return None
+
+    created = await asyncio.gather(*(upload_batch(batch) for batch in batches))
+    return dict(zip(batches, created))
+
+
+def _failed_batches(outcomes: Dict[Range, Optional[List[Dict]]]) -> List[Range]:
+    return [batch for batch, created in outcomes.items() if created is None]
+
+
+def upload_segments(url: str, segments: List[Dict[str, Any]],
+                    ranges: Optional[Sequence[Range]] = None,
+                    check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """
+    分批并行上传段落（同步调用）
+
+    在共享的后台事件循环中执行 upload_segments_async，不为每次调用创建线程池，
+    所有单文档推送的段落上传共用同一个异步客户端的连接池。
+
+    Args:
+        url: 段落接口地址
+        segments: 文档的全部段落数据
+        ranges: 只上传这些区间（例如上一次结果中的 failed），为空时上传全部段落
+        check_lease: 每次发送批次前调用（JobContext.check_lease），租约失效时抛出 LeaseLostError 停止上传
+
+    Returns:
+        {'status', 'landed', 'failed', 'data'}，landed/failed 为段落序号区间列表
+    """
+    async def upload():
+        return await upload_segments_async(get_async_dify_client(), url, segments, ranges, check_lease)
+
+    return run_in_background(upload()).result()
+
+
+async def upload_segments_async(client, url: str, segments: List[Dict[str, Any]],
+                                ranges: Optional[Sequence[Range]] = None,
+                                check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """
+    分批并行上传段落（异步）
+
+    每个批次失败后按指数退避重试；一轮结束后仍有失败批次时，等待片刻再只重新发送失败的区间一次。
+    client 为 AsyncDifyClient，其余参数和返回值同 upload_segments。
+    """
+    batches = split_ranges(len(segments), get_config('DIFY_SEGMENT_BATCH_SIZE'), ranges)
+    if not batches:
+        return {'status': 'success', 'landed': [], 'failed': [], 'data': {'data': []}}
+
+    start_time = time.time()
+    logger.info(f"开始分 {len(batches)} 批上传 {sum(e - s for s, e in batches)} 个段落...")
+    errors: Dict[Range, str] = {}
+    outcomes = await _upload_batches_async(client, url, segments, batches, errors, check_lease)
+
+    failed = _failed_batches(outcomes)
+    if failed:
+        logger.info(f"重新发送失败的段落区间: {merge_ranges(failed)}")
+        await asyncio.sleep(RESEND_DELAY)
+        outcomes.update(await _upload_batches_async(client, url, segments, failed, errors, check_lease))
+
+    return _summarize(outcomes, errors, time.time() - start_time)
+
+
+async def update_segments_async(client, base_url: str, updates: List[Tuple[str, Dict[str, Any]]],
+                                check_lease: Optional[Callable[[], None]] = None) -> List[str]:
+    """
+    并发更新已有段落的内容（异步）
+
+    Args:
+        client: AsyncDifyClient
+        base_url: 段落接口地址
+        updates: [(段落ID, 新的段落数据)]
+        check_lease: 每次发送请求前调用，租约失效时抛出 LeaseLostError 停止更新
+
+    Returns:
+        更新失败的段落ID列表
+    """
+    max_retries = get_config('DIFY_SEGMENT_MAX_RETRIES')
+    semaphore = asyncio.Semaphore(max(1, get_config('DIFY_SEGMENT_UPLOAD_CONCURRENCY')))
+
+    async def update_one(segment_id: str, segment: Dict[str, Any]) -> bool:
+        async with semaphore:
+            for attempt in range(max_retries):
+                if check_lease:
+                    check_lease()
+                try:
+                    response = await client.post(f"{base_url}/{segment_id}", json={"segment": segment})
+                    response.raise_for_status()
+                    return True
+                except Exception as e:
+                    if attempt < max_retries - 1:
+                        await asyncio.sleep(_retry_delay(attempt))
+                    else:
+                        logger.warning(f"更新段落 {segment_id} 失败: {str(e)}")
+        return False
+
+    outcomes = await asyncio.gather(*(update_one(sid, segment) for sid, segment in updates))
+    return [sid for (sid, _), ok in zip(updates, outcomes) if not ok]
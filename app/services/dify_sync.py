@@ -0,0 +1,334 @@
+"""
+Dify增量同步
+
+完整推送（create-by-file + 添加全部段落）后，记录每个切块对应的Dify段落ID和段落数据哈希。
+之后以同步模式推送同一文档到同一知识库时，只比较哈希：内容未变的段落保持不动，
+变化的段落原地更新，多出的切块追加为新段落，多余的段落删除，不再重建Dify文档。
+
+部分段落上传失败时，Dify文档ID和失败的段落区间保存在 Document.dify_push_state 中，
+再次推送同一文档到同一知识库（切块未变化）时只向已有的Dify文档重新发送这些区间。
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, Any, List, Optional, Sequence
+
+from ..database import Chunk, DifySegment, Document, get_db_session
+from ..config import get_config
+from .dify_client import get_async_dify_client, run_in_background
+from .dify_segments import build_segments, segment_hash, upload_segments_async, update_segments_async
+from .dify_cleanup import segment_cleaner
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+PUSH_MODES = ('full', 'sync')
+
+
+class DifySyncService:
+    """维护切块与Dify段落的对应关系，并执行增量同步"""
+
+    def _replace_mappings(self, document_id: int, dataset_id: str, rows: List[Dict[str, Any]]):
+        """用新的对应关系替换文档在该知识库下的全部记录"""
+        db = get_db_session()
+        try:
+            db.query(DifySegment).filter(
+                DifySegment.document_id == document_id,
+                DifySegment.dataset_id == dataset_id
+            ).delete()
+            db.add_all([DifySegment(document_id=document_id, dataset_id=dataset_id, **row) for row in rows])
+            db.commit()
+        finally:
+            db.close()
+
+    def _add_mappings(self, document_id: int, dataset_id: str, rows: List[Dict[str, Any]]):
+        """追加对应关系（继续上传失败的段落后使用）"""
+        db = get_db_session()
+        try:
+            db.add_all([DifySegment(document_id=document_id, dataset_id=dataset_id, **row) for row in rows])
+            db.commit()
+        finally:
+            db.close()
+
+    def record_push(self, document_id: int, dataset_id: str, dify_document_id: str,
+                    sequences: Sequence[int], segments: Sequence[Dict[str, Any]],
+                    add_response: Dict[str, Any], append: bool = False):
+        """
+        上传段落后记录切块与Dify段落的对应关系，以及仍未上传的段落区间
+
+        Args:
+            sequences: 切块序号，与 segments 一一对应
+            segments: 文档的全部段落数据
+            add_response: 上传结果（landed 为成功的区间，data.data 为Dify按区间顺序返回的新段落，failed 为失败的区间）
+            append: True 表示继续上传失败的区间，对应关系追加到已有记录中；否则替换已有记录
+        """
+        created = (add_response.get('data') or {}).get('data') or []
+        landed = add_response.get('landed')
+        if landed is None:
+            landed = [[0, len(segments)]]
+        indices = [i for start, end in landed for i in range(start, end)]
+        mapped = len(created) == len(indices)
+        if not mapped:
+            logger.warning(f"文档 {document_id}: Dify返回的段落数量({len(created)})与推送数量({len(indices)})不一致，"
+                           f"不记录段落对应关系，下次同步将完整推送")
+
+        rows = [{
+            "dify_document_id": dify_document_id,
+            "segment_id": item['id'],
+            "sequence": sequences[i],
+            "content_hash": segment_hash(segments[i])
+        } for i, item in zip(indices, created) if mapped and isinstance(item, dict) and item.get('id')]
+
+        try:
+            if append and mapped:
+                self._add_mappings(document_id, dataset_id, rows)
+            else:
+                # 对应关系不完整时清空，下次同步改为完整推送
+                self._replace_mappings(document_id, dataset_id, rows)
+            self.save_push_state(document_id, dataset_id, dify_document_id, add_response.get('failed'), mapped)
+        except Exception as e:
+            logger.error(f"记录文档 {document_id} 的段落对应关系失败: {str(e)}")
+
+    def save_push_state(self, document_id: int, dataset_id: str, dify_document_id: Optional[str],
+                        failed_ranges: Optional[List[List[int]]], mapped: bool = False, mode: str = 'full'):
+        """
+        记录未完成的推送，failed_ranges 为空时清除该知识库的记录
+
+        Args:
+            mapped: 已上传的段落是否记录了对应关系（继续上传时追加对应关系）
+            mode: full=推送时创建的Dify文档；add=添加到Dify中已有的文件
+        """
+        db = get_db_session()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if not document:
+                return
+            state = document.dify_push_state
+            if failed_ranges:
+                document.dify_push_state = {
+                    "dataset_id": dataset_id,
+                    "dify_document_id": dify_document_id,
+                    "failed_ranges": failed_ranges,
+                    "chunk_params": document.last_chunk_params,
+                    "mapped": mapped,
+                    "mode": mode
+                }
+            elif (isinstance(state, dict) and state.get("dataset_id") == dataset_id
+                    and state.get("mode", 'full') == mode):
+                document.dify_push_state = None
+            db.commit()
+        finally:
+            db.close()
+
+    def resume_push(self, document_id: int, dataset_id: str, dify_document_id: Optional[str] = None,
+                    check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """继续未完成的推送（同步调用，在共享的后台事件循环中执行）"""
+        return run_in_background(self.resume_push_async(document_id, dataset_id, dify_document_id, check_lease)).result()
+
+    async def resume_push_async(self, document_id: int, dataset_id: str, dify_document_id: Optional[str] = None,
+                                check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """
+        继续未完成的推送：只向已有的Dify文档重新发送上次失败的段落区间
+
+        Args:
+            dify_document_id: 添加到已有文件时为目标文件ID，只继续添加到该文件的记录；为空时继续完整推送创建的Dify文档
+
+        Returns:
+            上传结果（同 upload_segments，另含 dify_document_id）；没有可继续的推送（没有记录、知识库或目标文档不同、
+            切块已变化、Dify文档已被删除）时 status 为 full_required，调用方应照常完整推送
+        """
+        mode = 'add' if dify_document_id else 'full'
+        loaded = await asyncio.to_thread(self._load_push_state, document_id, dataset_id, dify_document_id, mode)
+        if loaded is None:
+            return {'status': 'full_required', 'message': '没有未完成的推送'}
+        state, sequences, segments = loaded
+
+        target_id = state["dify_document_id"]
+        client = get_async_dify_client()
+        base_url = f"{get_config('DIFY_API_SERVER')}/v1/datasets/{dataset_id}/documents/{target_id}/segments"
+
+        # 确认Dify文档仍然存在
+        try:
+            response = await client.get(base_url, params={'page': 1, 'limit': 1})
+            if response.status_code == 404:
+                await asyncio.to_thread(self.save_push_state, document_id, dataset_id, None, None, False, mode)
+                return {'status': 'full_required', 'message': 'Dify文档已不存在'}
+            response.raise_for_status()
+        except Exception as e:
+            return {'status': 'error', 'message': f'无法访问Dify文档: {str(e)}', 'dify_document_id': target_id}
+
+        logger.info(f"文档 {document_id} 继续上次未完成的推送，重新发送段落区间 {state['failed_ranges']}")
+        add_result = await upload_segments_async(client, base_url, segments, state["failed_ranges"], check_lease)
+        if state.get("mapped"):
+            await asyncio.to_thread(self.record_push, document_id, dataset_id, target_id, sequences, segments,
+                                    add_result, True)
+        else:
+            await asyncio.to_thread(self.save_push_state, document_id, dataset_id, target_id,
+                                    add_result.get('failed'), False, mode)
+        return {**add_result, 'dify_document_id': target_id, 'resumed': True}
+
+    def _load_push_state(self, document_id: int, dataset_id: str, dify_document_id: Optional[str],
+                         mode: str) -> Optional[tuple]:
+        """读取可继续的推送记录和文档的段落数据，没有可继续的推送时返回None"""
+        db = get_db_session()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            state = document.dify_push_state if document else None
+            if (not isinstance(state, dict) or not state.get("failed_ranges")
+                    or state.get("dataset_id") != dataset_id
+                    or state.get("mode", 'full') != mode
+                    or (dify_document_id and state.get("dify_document_id") != dify_document_id)
+                    or state.get("chunk_params") != document.last_chunk_params):
+                return None
+            chunks = db.query(Chunk).filter(Chunk.document_id == document_id).order_by(Chunk.sequence).all()
+            return state, [chunk.sequence for chunk in chunks], build_segments(chunks)
+        finally:
+            db.close()
+
+    def _load_sync_inputs(self, document_id: int, dataset_id: str) -> tuple:
+        """读取切块和已有的对应关系，返回 (序号, 段落, 旧记录, Dify文档ID集合)"""
+        db = get_db_session()
+        try:
+            chunks = db.query(Chunk).filter(Chunk.document_id == document_id).order_by(Chunk.sequence).all()
+            mappings = db.query(DifySegment).filter(
+                DifySegment.document_id == document_id,
+                DifySegment.dataset_id == dataset_id
+            ).all()
+            return ([chunk.sequence for chunk in chunks], build_segments(chunks),
+                    [(m.segment_id, m.sequence, m.content_hash) for m in mappings],
+                    {m.dify_document_id for m in mappings})
+        finally:
+            db.close()
+
+    def sync_document(self, document_id: int, dataset_id: str,
+                      check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """增量同步文档（同步调用，在共享的后台事件循环中执行）"""
+        return run_in_background(self.sync_document_async(document_id, dataset_id, check_lease)).result()
+
+    async def sync_document_async(self, document_id: int, dataset_id: str,
+                                  check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """
+        增量同步文档到Dify
+
+        check_lease 在更新、追加、删除段落的每个请求前调用，租约失效时抛出 LeaseLostError 停止同步
+
+        Returns:
+            status 为 success / error；没有可用的对应关系（从未完整推送过、Dify文档已被删除）时为 full_required，
+            调用方应改为完整推送
+        """
+        # 数据库读写在线程中执行，不阻塞事件循环
+        sequences, segments, old_rows, dify_document_ids = await asyncio.to_thread(
+            self._load_sync_inputs, document_id, dataset_id
+        )
+
+        if not old_rows or len(dify_document_ids) != 1:
+            return {'status': 'full_required', 'message': '没有可用的段落对应关系'}
+        if not segments:
+            return {'status': 'error', 'message': '文档没有切块'}
+
+        dify_document_id = dify_document_ids.pop()
+        client = get_async_dify_client()
+        base_url = f"{get_config('DIFY_API_SERVER')}/v1/datasets/{dataset_id}/documents/{dify_document_id}/segments"
+
+        # 确认Dify文档仍然存在
+        try:
+            response = await client.get(base_url, params={'page': 1, 'limit': 1})
+            if response.status_code == 404:
+                await asyncio.to_thread(self._replace_mappings, document_id, dataset_id, [])
+                return {'status': 'full_required', 'message': 'Dify文档已不存在'}
+            response.raise_for_status()
+        except Exception as e:
+            return {'status': 'error', 'message': f'无法访问Dify文档: {str(e)}'}
+
+        new_items = [(seq, segment, segment_hash(segment)) for seq, segment in zip(sequences, segments)]
+        plan = self._diff(new_items, old_rows)
+        logger.info(f"文档 {document_id} 增量同步: 不变 {len(plan['keep'])}, 更新 {len(plan['update'])}, "
+                    f"新增 {len(plan['add'])}, 删除 {len(plan['delete'])}")
+
+        rows = [{"dify_document_id": dify_document_id, "segment_id": sid, "sequence": seq, "content_hash": h}
+                for sid, seq, h in plan['keep']]
+        failures = 0
+
+        # 原地更新内容变化的段落
+        if plan['update']:
+            failed_updates = set(await update_segments_async(
+                client, base_url, [(old[0], item[1]) for item, old in plan['update']], check_lease
+            ))
+            failures += len(failed_updates)
+            for (seq, _, new_hash), (segment_id, _, old_hash) in plan['update']:
+                # 更新失败的段落保留旧哈希，下次同步会再次更新
+                rows.append({"dify_document_id": dify_document_id, "segment_id": segment_id, "sequence": seq,
+                             "content_hash": old_hash if segment_id in failed_updates else new_hash})
+
+        # 追加新增的段落
+        if plan['add']:
+            add_result = await upload_segments_async(client, base_url, [item[1] for item in plan['add']],
+                                                     check_lease=check_lease)
+            created = iter(add_result.get('data', {}).get('data', []))
+            for start, end in add_result.get('landed', []):
+                for seq, _, new_hash in plan['add'][start:end]:
+                    item = next(created, None)
+                    if isinstance(item, dict) and item.get('id'):
+                        rows.append({"dify_document_id": dify_document_id, "segment_id": item['id'],
+                                     "sequence": seq, "content_hash": new_hash})
+            failures += sum(end - start for start, end in add_result.get('failed', []))
+
+        # 删除多余的段落，删除失败的保留为待删除记录
+        if plan['delete']:
+            delete_result = await asyncio.wrap_future(segment_cleaner.delete_segments(
+                dataset_id, dify_document_id, [row[0] for row in plan['delete']], check_lease
+            ))
+            failures += delete_result['failed']
+            rows.extend({"dify_document_id": dify_document_id, "segment_id": sid, "sequence": None,
+                         "content_hash": None} for sid in delete_result['failed_ids'])
+
+        await asyncio.to_thread(self._replace_mappings, document_id, dataset_id, rows)
+
+        result = {
+            'kept': len(plan['keep']),
+            'updated': len(plan['update']),
+            'added': len(plan['add']),
+            'deleted': len(plan['delete']),
+            'failed': failures
+        }
+        if failures:
+            return {'status': 'error', 'message': f'{failures} 个段落同步失败', **result}
+        # 同步后Dify文档与本地切块一致，不再需要继续上次未完成的推送
+        await asyncio.to_thread(self.save_push_state, document_id, dataset_id, None, None)
+        return {'status': 'success', **result}
+
+    def _diff(self, new_items: List[tuple], old_rows: List[tuple]) -> Dict[str, List]:
+        """
+        按段落哈希比较本地切块和已推送的段落
+
+        哈希相同的段落直接保留（优先匹配同一序号），其余的新旧段落两两配对原地更新，
+        剩下的新切块追加，剩下的旧段落删除。
+        """
+        by_hash: Dict[Optional[str], List[tuple]] = defaultdict(list)
+        for row in old_rows:
+            by_hash[row[2]].append(row)
+
+        keep, unmatched_new = [], []
+        for seq, segment, new_hash in new_items:
+            candidates = by_hash.get(new_hash)
+            if candidates:
+                match = next((row for row in candidates if row[1] == seq), candidates[0])
+                candidates.remove(match)
+                keep.append((match[0], seq, new_hash))
+            else:
+                unmatched_new.append((seq, segment, new_hash))
+
+        unmatched_old = [row for rows in by_hash.values() for row in rows]
+        unmatched_old.sort(key=lambda row: (row[1] is None, row[1] or 0))
+
+        pairs = min(len(unmatched_new), len(unmatched_old))
+        return {
+            'keep': keep,
+            'update': list(zip(unmatched_new[:pairs], unmatched_old[:pairs])),
+            'add': unmatched_new[pairs:],
+            'delete': unmatched_old[pairs:]
+        }
+
+
+# 全局同步服务
+dify_sync_service = DifySyncService()
@@ -2,18 +2,52 @@ from fastapi import UploadFile
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 import os
+import asyncio
 from pathlib import Path
 import logging
-import hashlib
 from datetime import datetime
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 from ..database import Document, Chunk
-from ..config import APP_CONFIG, UPLOADS_DIR
+from ..config import APP_CONFIG
+from ..services.file_ingest import FileTooLargeError
+from ..services.blob_store import blob_store
+from ..services.chunk_cache import chunk_cache
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+
+def assign_document_names(db: Session, folder_id: Optional[int], filenames: List[str]) -> List[str]:
+    """
+    为一批新文档分配名称
+
+    与同一位置（根目录或文件夹）已有的文档或本批中前面的文档同名时在文件名后追加时间戳，仍然重复时再追加序号。
+    """
+    scope = Document.folder_id.is_(None) if folder_id is None else Document.folder_id == folder_id
+    requested = list(dict.fromkeys(filenames))
+    taken = set()
+    for i in range(0, len(requested), 500):
+        taken.update(row[0] for row in db.query(Document.filename).filter(
+            scope, Document.filename.in_(requested[i:i + 500])
+        ))
+    
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    names = []
+    for filename in filenames:
+        new_filename = filename
+        if new_filename in taken:
+            name, ext = os.path.splitext(filename)
+            new_filename = f"{name}_{timestamp}{ext}"
+            counter = 1
+            while new_filename in taken:
+                new_filename = f"{name}_{timestamp}_{counter}{ext}"
+                counter += 1
+        taken.add(new_filename)
+        names.append(new_filename)
+    return names
+
+
 class DocumentService:
     """文档服务类 - 处理文档上传、删除等操作"""
     
@@ -30,46 +64,41 @@ class DocumentService:
                     content={"message": f"不支持的文件类型。允许的类型: {', '.join(APP_CONFIG['ALLOWED_EXTENSIONS'])}"}
                 )
             
-            # 移除文件名中可能包含的路径分隔符，确保文件直接保存在UPLOADS_DIR
-            safe_filename = os.path.basename(filename)
-            new_filename = safe_filename
-            file_path = UPLOADS_DIR / safe_filename
+            # 移除文件名中可能包含的路径分隔符，根目录文档只保留文件名
+            new_filename = assign_document_names(db, None, [os.path.basename(filename)])[0]
             
-            if os.path.exists(file_path):
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                name, ext = os.path.splitext(safe_filename)
-                new_filename = f"{name}_{timestamp}{ext}"
-                file_path = UPLOADS_DIR / new_filename
-            
-            # 读取文件内容并保存
-            file_content = await file.read()
-            with open(file_path, "wb") as buffer:
-                buffer.write(file_content)
-                
-            # 文件信息
-            file_size = os.path.getsize(file_path)
-            file_hash = hashlib.md5(file_content).hexdigest()
+            # 分块写入内容存储，同时计算哈希（内容已存在时不再保存第二份）
+            try:
+                blob = await blob_store.store_upload(file, file_ext)
+            except FileTooLargeError as e:
+                logger.warning(f"文件过大: {filename}")
+                return JSONResponse(status_code=413, content={"message": str(e)})
             
             # 保存到数据库
             document = Document(
                 filename=new_filename,
-                filepath=str(file_path),
+                filepath=blob["path"],
                 filetype=file_ext,
-                filesize=file_size,
+                filesize=blob["size"],
                 upload_time=datetime.now(),
                 status="未切块",
-                hash=file_hash
+                hash=blob["sha256"]
             )
             
-            db.add(document)
-            db.commit()
-            db.refresh(document)
+            def save():
+                db.add(document)
+                blob_store.commit_refs(db, [blob])
+                db.refresh(document)
             
-            logger.info(f"文件上传成功: {new_filename}, ID: {document.id}")
+            # 登记引用需要访问数据库并等待内容存储的锁，在线程中执行
+            await asyncio.to_thread(save)
+            
+            logger.info(f"文件上传成功: {new_filename}, ID: {document.id}{'（内容已存在）' if blob['duplicate'] else ''}")
             
             return JSONResponse(
                 status_code=200,
-                content={"message": "文件上传成功", "document_id": document.id, "filename": new_filename}
+                content={"message": "文件上传成功", "document_id": document.id, "filename": new_filename,
+                         "duplicate": blob["duplicate"]}
             )
             
         except Exception as e:
@@ -91,17 +120,21 @@ class DocumentService:
                     content={"status": "error", "message": "文档不存在"}
                 )
             
-            # 删除文件
-            file_path = document.filepath
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"已删除文件: {file_path}")
-            
             # 删除关联的切块和文档记录
+            file_path = document.filepath
+            file_hash = document.hash
             db.query(Chunk).filter(Chunk.document_id == document_id).delete()
             db.delete(document)
             db.commit()
             
+            # 删除文件：内容存储中的文件只释放引用，没有其他文档引用时才删除
+            if blob_store.is_blob_path(file_path):
+                blob_store.release(file_hash)
+            elif os.path.exists(file_path):
+                os.remove(file_path)
+                logger.info(f"已删除文件: {file_path}")
+            self._remove_unreferenced_cache(db, [file_hash])
+            
             logger.info(f"已删除文档: ID {document_id}, 文件名 {document.filename}")
             
             return JSONResponse(
@@ -122,19 +155,32 @@ class DocumentService:
         
         # 找出需要删除的文档ID
         if len(valid_docs) < len(documents):
-            missing_ids = [doc.id for doc in documents if not os.path.exists(doc.filepath)]
+            missing = [doc for doc in documents if not os.path.exists(doc.filepath)]
+            missing_ids = [doc.id for doc in missing]
+            released = [doc.hash for doc in missing if blob_store.is_blob_path(doc.filepath)]
             # 批量删除
             db.query(Chunk).filter(Chunk.document_id.in_(missing_ids)).delete(synchronize_session=False)
             db.query(Document).filter(Document.id.in_(missing_ids)).delete(synchronize_session=False)
             db.commit()
+            for file_hash in released:
+                blob_store.release(file_hash)
+            self._remove_unreferenced_cache(db, [doc.hash for doc in missing])
             
         return valid_docs
 
+    def _remove_unreferenced_cache(self, db: Session, file_hashes: List[Optional[str]]):
+        """删除已没有文档引用的文件内容的切块缓存"""
+        hashes = {h for h in file_hashes if h}
+        if not hashes:
+            return
+        referenced = {row[0] for row in db.query(Document.hash).filter(Document.hash.in_(hashes)).distinct()}
+        for file_hash in hashes - referenced:
+            chunk_cache.remove_file(file_hash)
+
     def get_root_documents(self, db: Session) -> List[Document]:
-        """获取uploads根目录下的文档（不包括子文件夹）"""
+        """获取根目录下的文档（不属于任何文件夹）"""
         documents = db.query(Document).filter(
-            Document.filepath.like(f"{UPLOADS_DIR}/%") & 
-            ~Document.filepath.like(f"{UPLOADS_DIR}/%/%")
+            Document.folder_id.is_(None)
         ).order_by(Document.upload_time.desc()).all()
         
         return self.clean_missing_documents(documents, db)
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""
+上传文件的流式保存
+
+按固定大小的块读取上传内容并通过 aiofiles 写入磁盘，写入的同时计算文件哈希、检查大小上限（MAX_CONTENT_LENGTH），
+文件不会整体读入内存，也不会阻塞事件循环。单文件上传和文件夹批量上传都使用这里的函数。
+"""
+import os
+import hashlib
+import logging
+from typing import AsyncIterator, Optional, Tuple
+
+import aiofiles
+from fastapi import UploadFile
+
+from ..config import get_config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+INGEST_BLOCK_SIZE = 1024 * 1024  # 每次读取和写入的字节数
+
+
+class FileTooLargeError(ValueError):
+    """文件超过 MAX_CONTENT_LENGTH"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"文件超过大小限制 {limit // (1024 * 1024)}MB")
+        self.limit = limit
+
+
+async def iter_upload(file: UploadFile, block_size: int = INGEST_BLOCK_SIZE) -> AsyncIterator[bytes]:
+    """按块读取上传文件"""
+    while True:
+        block = await file.read(block_size)
+        if not block:
+            return
+        yield block
+
+
+async def write_stream(blocks: AsyncIterator[bytes], file_path: str,
+                       max_size: Optional[int] = None) -> Tuple[int, str]:
+    """
+    把数据块依次写入文件，同时计算SHA-256（与 Document.hash 一致）
+
+    Args:
+        blocks: 数据块的异步迭代器
+        file_path: 目标文件路径
+        max_size: 大小上限（字节），默认为配置 MAX_CONTENT_LENGTH，0 表示不限制
+
+    Returns:
+        (文件大小, 文件哈希)；超过大小上限时删除已写入的部分并抛出 FileTooLargeError
+    """
+    if max_size is None:
+        max_size = get_config('MAX_CONTENT_LENGTH')
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(file_path, 'wb') as f:
+            async for block in blocks:
+                size += len(block)
+                if max_size and size > max_size:
+                    raise FileTooLargeError(max_size)
+                sha256.update(block)
+                await f.write(block)
+    except BaseException:
+        # 写入失败或被取消时不留下不完整的文件
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+        raise
+    return size, sha256.hexdigest()
+
+
+async def save_upload(file: UploadFile, file_path: str, max_size: Optional[int] = None) -> Tuple[int, str]:
+    """流式保存上传文件，返回 (文件大小, 文件哈希)"""
+    return await write_stream(iter_upload(file), file_path, max_size)
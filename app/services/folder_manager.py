@@ -1,6 +1,7 @@
 import os
 import shutil
 from fastapi import HTTPException
+from sqlalchemy import func, case
 from sqlalchemy.orm import Session
 from datetime import datetime
 from typing import List, Dict, Any, Optional
@@ -54,51 +55,49 @@ class FolderManager:
             db.rollback()
             raise HTTPException(status_code=500, detail=f"创建文件夹失败: {str(e)}")
     
-    def get_folders(self, db: Session) -> List[Dict[str, Any]]:
-        """获取所有文件夹列表"""
-        folders = db.query(Folder).all()
+    def _folder_summaries(self, db: Session, folder_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        一次GROUP BY查询汇总文件夹信息
+        
+        文档数量、最近上传时间、已切块/已推送数量和文件总大小在同一条聚合查询中计算，
+        避免为每个文件夹单独查询文档。
+        """
+        query = db.query(
+            Folder,
+            func.count(Document.id).label("document_count"),
+            func.max(Document.upload_time).label("latest_upload"),
+            func.coalesce(func.sum(case((Document.status == "已切块", 1), else_=0)), 0).label("chunked_count"),
+            func.coalesce(func.sum(case((Document.dify_push_status == "pushed", 1), else_=0)), 0).label("pushed_count"),
+            func.coalesce(func.sum(Document.filesize), 0).label("total_size")
+        ).outerjoin(Document, Document.folder_id == Folder.id)
+        
+        if folder_id is not None:
+            query = query.filter(Folder.id == folder_id)
         
         result = []
-        for folder in folders:
-            # 获取文件夹中的文档数量
-            doc_count = db.query(Document).filter(Document.folder_id == folder.id).count()
-            
-            # 获取最近更新时间
-            latest_doc = db.query(Document).filter(Document.folder_id == folder.id).order_by(Document.upload_time.desc()).first()
-            latest_update = latest_doc.upload_time if latest_doc else folder.create_time
-            
+        for folder, doc_count, latest_upload, chunked_count, pushed_count, total_size in query.group_by(Folder.id).all():
             result.append({
                 "id": folder.id,
                 "name": folder.name,
                 "path": folder.folder_path,
                 "create_time": folder.create_time,
                 "document_count": doc_count,
-                "latest_update": latest_update
+                "latest_update": latest_upload or folder.create_time,
+                "chunked_count": chunked_count,
+                "pushed_count": pushed_count,
+                "total_size": total_size
             })
         
         return result
     
+    def get_folders(self, db: Session) -> List[Dict[str, Any]]:
+        """获取所有文件夹列表"""
+        return self._folder_summaries(db)
+    
     def get_folder(self, folder_id: int, db: Session) -> Optional[Dict[str, Any]]:
         """获取单个文件夹详情"""
-        folder = db.query(Folder).filter(Folder.id == folder_id).first()
-        if not folder:
-            return None
-        
-        # 获取文件夹中的文档数量
-        doc_count = db.query(Document).filter(Document.folder_id == folder.id).count()
-        
-        # 获取最近更新时间
-        latest_doc = db.query(Document).filter(Document.folder_id == folder.id).order_by(Document.upload_time.desc()).first()
-        latest_update = latest_doc.upload_time if latest_doc else folder.create_time
-        
-        return {
-            "id": folder.id,
-            "name": folder.name,
-            "path": folder.folder_path,
-            "create_time": folder.create_time,
-            "document_count": doc_count,
-            "latest_update": latest_update
-        }
+        summaries = self._folder_summaries(db, folder_id)
+        return summaries[0] if summaries else None
     
     def delete_folder(self, folder_id: int, db: Session) -> Dict[str, Any]:
         """删除文件夹"""
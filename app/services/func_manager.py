@@ -6,6 +6,7 @@ import time
 from pathlib import Path
 
 from ..chunk_func.base import BaseChunkStrategy
+from ..chunk_func.registry import strategy_registry
 from ..config import get_config, STRATEGY_DIR, DOCS_DIR
 
 # 配置日志
@@ -150,6 +151,9 @@ async def validate_and_save_strategy(file_content, filename):
             # 清理临时文件
             os.remove(temp_file)
             
+            # 让策略注册表重新加载该文件
+            strategy_registry.invalidate(target_filename)
+            
             result = {
                 "strategy_name": strategy_name,
                 "filename": target_filename
@@ -212,6 +216,7 @@ def delete_strategy(strategy_name):
     try:
         # 删除文件
         os.remove(target_path)
+        strategy_registry.invalidate(target_filename)
         logger.info(f"成功删除策略文件: {target_filename}")
         return True, "策略文件已删除"
     except Exception as e:
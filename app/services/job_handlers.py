@@ -0,0 +1,180 @@
+"""
+各类后台任务的处理函数
+
+由 JobWorker 启动时导入并登记到 job_queue。处理函数直接调用原有服务中的执行方法，
+恢复函数在任务最终失败时把仍处于"处理中"/"pushing"的文档恢复为可再次操作的状态。
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Iterable
+
+from ..database import Document, BatchTask, get_db_session
+from .job_queue import job_queue, JobContext, JobError
+from .chunking import ChunkService, CHUNK_TASKS
+from .batch_chunking import BatchChunkingService
+from .to_dify_single import DifySingleService
+from .to_dify_batch import DifyBatchService
+from .add_dify_single import AddDifySingleService
+from .dify_client import close_async_dify_client
+from .batch_items import batch_item_service
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+chunk_service = ChunkService()
+batch_chunking_service = BatchChunkingService()
+dify_single_service = DifySingleService()
+dify_batch_service = DifyBatchService()
+add_dify_service = AddDifySingleService()
+
+
+def reset_document_status(document_ids: Iterable[int], field: str, stuck_value: str, reset_value: Any):
+    """把仍停留在中间状态的文档恢复为指定状态"""
+    document_ids = list(document_ids)
+    if not document_ids:
+        return
+    db = get_db_session()
+    try:
+        count = db.query(Document).filter(
+            Document.id.in_(document_ids),
+            getattr(Document, field) == stuck_value
+        ).update({getattr(Document, field): reset_value}, synchronize_session=False)
+        db.commit()
+        if count:
+            logger.info(f"已恢复 {count} 个文档的状态（{field}: {stuck_value} -> {reset_value}）")
+    finally:
+        db.close()
+
+
+def _unfinished_batch_documents(task_id: str) -> list:
+    """批量任务中尚未记录结果的文档"""
+    db = get_db_session()
+    try:
+        return batch_item_service.unfinished_document_ids(db, task_id)
+    finally:
+        db.close()
+
+
+def _fail_batch_task(task_id: str, message: str):
+    db = get_db_session()
+    try:
+        task = db.query(BatchTask).filter(BatchTask.id == task_id).first()
+        if task and task.status in ("waiting", "processing"):
+            task.status = "failed"
+            task.error_message = message
+            db.commit()
+    finally:
+        db.close()
+
+
+# ---- 单文档切块 ----
+
+def run_chunk(payload: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    document_id = payload["document_id"]
+    ctx.progress_source = lambda: CHUNK_TASKS.get(document_id)
+    chunk_service._process_chunks(
+        document_id,
+        payload["chunk_strategy"],
+        payload["chunk_size"],
+        payload["overlap"],
+        check_lease=ctx.check_lease
+    )
+    state = CHUNK_TASKS.get(document_id, {})
+    if state.get("status") == "error":
+        raise JobError(state.get("message", "切块处理失败"))
+    return state
+
+
+def recover_chunk(payload: Dict[str, Any]):
+    reset_document_status([payload["document_id"]], "status", "处理中", "未切块")
+
+
+# ---- 单文档推送 ----
+
+def _check_pushed(document_id: int):
+    db = get_db_session()
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if not document or document.dify_push_status != "pushed":
+            state = document.dify_push_state if document else None
+            if isinstance(state, dict) and state.get("failed_ranges"):
+                raise JobError(f"段落区间 {state['failed_ranges']} 上传失败，再次推送时只重新发送这些段落")
+            raise JobError("推送失败，详见日志")
+    finally:
+        db.close()
+
+
+def run_dify_push(payload: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    dify_single_service._do_push_document(payload["document_id"], payload["dataset_id"], payload.get("mode", "full"),
+                                          check_lease=ctx.check_lease)
+    _check_pushed(payload["document_id"])
+    return {"status": "pushed"}
+
+
+def run_dify_add(payload: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    add_dify_service._do_add_to_file(payload["document_id"], payload["dataset_id"], payload["target_file_id"],
+                                     check_lease=ctx.check_lease)
+    _check_pushed(payload["document_id"])
+    return {"status": "pushed"}
+
+
+def recover_push(payload: Dict[str, Any]):
+    reset_document_status([payload["document_id"]], "dify_push_status", "pushing", None)
+
+
+# ---- 批量任务 ----
+
+def run_batch_chunk(payload: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    task_id = payload["task_id"]
+    if ctx.resumed:
+        # 上次执行被中断：已记录结果的文档不再处理，中断时停留在"处理中"的文档先恢复
+        reset_document_status(_unfinished_batch_documents(task_id), "status", "处理中", "未切块")
+    asyncio.run(batch_chunking_service._process_batch_chunking(
+        task_id=task_id,
+        document_ids=payload["document_ids"],
+        chunk_strategy=payload["chunk_strategy"],
+        chunk_size=payload["chunk_size"],
+        overlap=payload["overlap"],
+        resume=ctx.resumed,
+        check_lease=ctx.check_lease
+    ))
+    return {"task_id": task_id}
+
+
+def recover_batch_chunk(payload: Dict[str, Any]):
+    reset_document_status(_unfinished_batch_documents(payload["task_id"]), "status", "处理中", "未切块")
+    _fail_batch_task(payload["task_id"], "任务多次中断，已停止")
+
+
+def run_batch_to_dify(payload: Dict[str, Any], ctx: JobContext) -> Dict[str, Any]:
+    task_id = payload["task_id"]
+    if ctx.resumed:
+        reset_document_status(_unfinished_batch_documents(task_id), "dify_push_status", "pushing", None)
+
+    async def run():
+        try:
+            await dify_batch_service._process_batch_to_dify(
+                task_id=task_id,
+                document_ids=payload["document_ids"],
+                dataset_id=payload["dataset_id"],
+                mode=payload.get("mode", "full"),
+                resume=ctx.resumed,
+                check_lease=ctx.check_lease
+            )
+        finally:
+            await close_async_dify_client()
+
+    asyncio.run(run())
+    return {"task_id": task_id}
+
+
+def recover_batch_to_dify(payload: Dict[str, Any]):
+    reset_document_status(_unfinished_batch_documents(payload["task_id"]), "dify_push_status", "pushing", None)
+    _fail_batch_task(payload["task_id"], "任务多次中断，已停止")
+
+
+job_queue.register("chunk", run_chunk, recover_chunk)
+job_queue.register("dify_push", run_dify_push, recover_push)
+job_queue.register("dify_add", run_dify_add, recover_push)
+job_queue.register("batch_chunk", run_batch_chunk, recover_batch_chunk)
+job_queue.register("batch_to_dify", run_batch_to_dify, recover_batch_to_dify)
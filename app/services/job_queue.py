@@ -0,0 +1,474 @@
+"""
+持久化任务队列
+
+切块、Dify推送、批量任务等后台作业以 Job 记录保存在SQLite中，由工作进程（默认内嵌在Web进程中）领取执行。
+领取任务时取得一个有期限的租约，执行期间心跳线程定期续约并保存进度；进程退出或重启后租约到期，
+任务自动回到队列由其他（或重启后的）工作进程重新执行，超过最大次数后标记为失败并恢复相关文档的状态。
+"""
+import os
+import socket
+import logging
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, case, or_
+from sqlalchemy.exc import IntegrityError
+
+from ..database import Job, get_db_session
+from ..config import get_config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("waiting", "processing")
+
+
+class JobError(Exception):
+    """任务执行失败且重试无意义（如文档不存在），直接标记为失败"""
+
+
+class LeaseLostError(Exception):
+    """任务的租约已失效（可能已被其他工作进程重新领取），停止执行且不记录结果"""
+
+
+class JobContext:
+    """传给任务处理函数的执行上下文"""
+
+    def __init__(self, job_id: str, attempts: int):
+        self.job_id = job_id
+        self.attempts = attempts  # 本次为第几次执行，大于1表示上次执行被中断
+        self.progress: Optional[Dict[str, Any]] = None
+        # 可选：返回当前进度的函数，心跳时调用（优先于 progress）
+        self.progress_source: Optional[Callable[[], Optional[Dict[str, Any]]]] = None
+        self.lease_lost = False
+
+    @property
+    def resumed(self) -> bool:
+        return self.attempts > 1
+
+    def check_lease(self):
+        """租约已失效时抛出 LeaseLostError，处理函数在循环中定期调用"""
+        if self.lease_lost:
+            raise LeaseLostError(f"任务 {self.job_id} 的租约已失效")
+
+    def current_progress(self) -> Optional[Dict[str, Any]]:
+        if self.progress_source:
+            try:
+                return self.progress_source()
+            except Exception:
+                return None
+        return self.progress
+
+
+class JobQueue:
+    """
+    任务队列（数据库存储，多个进程可以共用）
+
+    处理函数通过 register() 登记：handler(payload, ctx) 返回结果字典，抛出 JobError 表示失败不重试，
+    抛出其他异常时在次数未用完前重新排队；长时间执行的处理函数应定期调用 ctx.check_lease()，租约失效时停止。recover(payload) 在任务最终失败时调用，用于恢复文档状态。
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, Tuple[Callable, Optional[Callable]]] = {}
+        self._listeners: List[threading.Event] = []
+
+    def register(self, job_type: str, handler: Callable[[Dict[str, Any], JobContext], Any],
+                 recover: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self._handlers[job_type] = (handler, recover)
+
+    def get_handler(self, job_type: str) -> Tuple[Optional[Callable], Optional[Callable]]:
+        return self._handlers.get(job_type, (None, None))
+
+    def add_listener(self, event: threading.Event):
+        """登记同一进程内的工作进程，有新任务时立即唤醒而不必等待下一次轮询"""
+        self._listeners.append(event)
+
+    def remove_listener(self, event: threading.Event):
+        if event in self._listeners:
+            self._listeners.remove(event)
+
+    def enqueue(self, job_type: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        添加任务
+
+        Args:
+            dedupe_key: 去重键，已有同一键的未完成任务时不再添加
+
+        Returns:
+            (任务ID, 是否新建)
+        """
+        db = get_db_session()
+        try:
+            # 检查和插入之间可能有其他请求加入同一键的任务，唯一索引（ux_jobs_dedupe_active）拒绝后返回已有的任务
+            for _ in range(2):
+                if dedupe_key:
+                    existing = db.query(Job.id).filter(
+                        Job.dedupe_key == dedupe_key,
+                        Job.status.in_(ACTIVE_STATUSES)
+                    ).first()
+                    if existing:
+                        return existing[0], False
+
+                job = Job(
+                    id=str(uuid.uuid4()),
+                    job_type=job_type,
+                    payload=payload,
+                    dedupe_key=dedupe_key,
+                    status="waiting",
+                    attempts=0,
+                    max_attempts=get_config('JOB_MAX_ATTEMPTS')
+                )
+                db.add(job)
+                try:
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+                    if not dedupe_key:
+                        raise
+                    continue
+                job_id = job.id
+                break
+            else:
+                raise RuntimeError(f"添加任务失败：去重键 {dedupe_key} 冲突")
+        finally:
+            db.close()
+
+        for event in list(self._listeners):
+            event.set()
+        return job_id, True
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        db = get_db_session()
+        try:
+            job = db.query(Job).filter(Job.id == job_id).first()
+            return self._to_dict(job) if job else None
+        finally:
+            db.close()
+
+    def get_latest_job(self, dedupe_key: str) -> Optional[Dict[str, Any]]:
+        """获取同一去重键下最近的任务"""
+        db = get_db_session()
+        try:
+            job = db.query(Job).filter(Job.dedupe_key == dedupe_key).order_by(Job.created_at.desc()).first()
+            return self._to_dict(job) if job else None
+        finally:
+            db.close()
+
+    def _to_dict(self, job: Job) -> Dict[str, Any]:
+        return {
+            "id": job.id,
+            "job_type": job.job_type,
+            "payload": job.payload,
+            "status": job.status,
+            "attempts": job.attempts,
+            "max_attempts": job.max_attempts,
+            "progress": job.progress,
+            "result": job.result,
+            "error_message": job.error_message,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at
+        }
+
+    def _claimable(self, now: datetime):
+        """可领取的任务：等待中的任务，以及租约已过期的执行中任务"""
+        return or_(
+            Job.status == "waiting",
+            and_(Job.status == "processing", Job.lease_expires_at < now)
+        )
+
+    def claim(self, owner: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        领取最多 limit 个任务并取得租约
+
+        先查出候选任务，再逐个用带条件的UPDATE抢占，受影响行数为1才算领取成功，多个工作进程之间不会重复领取。
+        租约过期且次数已用完的任务在这里标记为失败。
+        """
+        if limit <= 0:
+            return []
+
+        self._fail_exhausted()
+        claimed = []
+        db = get_db_session()
+        try:
+            now = datetime.now()
+            candidates = db.query(Job.id).filter(
+                self._claimable(now),
+                Job.attempts < Job.max_attempts
+            ).order_by(Job.created_at).limit(limit).all()
+
+            for (job_id,) in candidates:
+                now = datetime.now()
+                updated = db.query(Job).filter(
+                    Job.id == job_id,
+                    self._claimable(now),
+                    Job.attempts < Job.max_attempts
+                ).update({
+                    Job.status: "processing",
+                    Job.lease_owner: owner,
+                    Job.lease_expires_at: now + timedelta(seconds=get_config('JOB_LEASE_SECONDS')),
+                    Job.attempts: Job.attempts + 1,
+                    Job.started_at: now
+                }, synchronize_session=False)
+                db.commit()
+                if updated == 1:
+                    job = db.query(Job).filter(Job.id == job_id).first()
+                    if job.attempts > 1:
+                        logger.warning(f"任务 {job.job_type} {job.id} 上次执行未完成，第 {job.attempts} 次执行")
+                    claimed.append(self._to_dict(job))
+        finally:
+            db.close()
+        return claimed
+
+    def _fail_exhausted(self):
+        """租约过期且已达到最大执行次数的任务标记为失败"""
+        db = get_db_session()
+        try:
+            now = datetime.now()
+            jobs = db.query(Job).filter(
+                Job.status == "processing",
+                Job.lease_expires_at < now,
+                Job.attempts >= Job.max_attempts
+            ).all()
+            for job in jobs:
+                updated = db.query(Job).filter(
+                    Job.id == job.id,
+                    Job.status == "processing",
+                    Job.lease_expires_at < now
+                ).update({
+                    Job.status: "failed",
+                    Job.error_message: f"任务执行 {job.attempts} 次均未完成（进程退出或租约过期）",
+                    Job.lease_owner: None,
+                    Job.lease_expires_at: None,
+                    Job.finished_at: now
+                }, synchronize_session=False)
+                db.commit()
+                if updated == 1:
+                    logger.error(f"任务 {job.job_type} {job.id} 多次中断，已标记为失败")
+                    self.recover(job.job_type, job.payload)
+        finally:
+            db.close()
+
+    def recover(self, job_type: str, payload: Dict[str, Any]):
+        """任务最终失败后调用处理函数登记的恢复函数"""
+        _, recover = self.get_handler(job_type)
+        if recover:
+            try:
+                recover(payload or {})
+            except Exception as e:
+                logger.error(f"恢复任务 {job_type} 的文档状态失败: {str(e)}")
+
+    def heartbeat(self, owner: str, job_id: str, progress: Optional[Dict[str, Any]] = None) -> bool:
+        """续约并保存进度，租约已被其他工作进程取得时返回False"""
+        db = get_db_session()
+        try:
+            values = {Job.lease_expires_at: datetime.now() + timedelta(seconds=get_config('JOB_LEASE_SECONDS'))}
+            if progress is not None:
+                values[Job.progress] = progress
+            updated = db.query(Job).filter(
+                Job.id == job_id,
+                Job.status == "processing",
+                Job.lease_owner == owner
+            ).update(values, synchronize_session=False)
+            db.commit()
+            return updated == 1
+        finally:
+            db.close()
+
+    def finish(self, owner: str, job_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error_message: Optional[str] = None, release: bool = False) -> bool:
+        """
+        结束任务
+
+        Args:
+            status: completed / failed / waiting（重新排队）
+            release: 工作进程正常退出时释放租约，本次执行不计入执行次数（只对 waiting 有效）
+        """
+        db = get_db_session()
+        try:
+            values = {
+                Job.status: status,
+                Job.lease_owner: None,
+                Job.lease_expires_at: None,
+                Job.error_message: error_message
+            }
+            if status == "waiting" and release:
+                values[Job.attempts] = case((Job.attempts > 0, Job.attempts - 1), else_=0)
+            if status != "waiting":
+                values[Job.result] = result
+                values[Job.finished_at] = datetime.now()
+            updated = db.query(Job).filter(
+                Job.id == job_id,
+                Job.status == "processing",
+                Job.lease_owner == owner
+            ).update(values, synchronize_session=False)
+            db.commit()
+            return updated == 1
+        finally:
+            db.close()
+
+    def purge(self, days: int) -> int:
+        """删除早于指定天数的已结束任务"""
+        db = get_db_session()
+        try:
+            deleted = db.query(Job).filter(
+                Job.status.in_(("completed", "failed")),
+                Job.finished_at < datetime.now() - timedelta(days=days)
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+
+class JobWorker:
+    """
+    任务工作进程
+
+    一个调度线程从队列领取任务，每个任务在单独的守护线程中执行（同时执行的数量不超过 concurrency），
+    心跳线程定期为执行中的任务续约并保存进度。
+    """
+
+    def __init__(self, queue: JobQueue, concurrency: int, worker_id: Optional[str] = None):
+        self.queue = queue
+        self.concurrency = max(1, concurrency)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._active: Dict[str, JobContext] = {}
+        self._active_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        if self._threads:
+            return
+        # 登记各类任务的处理函数
+        from . import job_handlers  # noqa: F401
+
+        retention_days = get_config('JOB_RETENTION_DAYS')
+        if retention_days:
+            purged = self.queue.purge(retention_days)
+            if purged:
+                logger.info(f"已清理 {purged} 个过期的任务记录")
+
+        self._stop.clear()
+        self.queue.add_listener(self._wake)
+        self._threads = [
+            threading.Thread(target=self._run, name='job-worker', daemon=True),
+            threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"任务工作进程 {self.worker_id} 已启动，并发数 {self.concurrency}")
+
+    def stop(self):
+        """停止领取新任务，并释放执行中任务的租约使其立即可以被重新领取（本次执行不计入执行次数）"""
+        if not self._threads:
+            return
+        self._stop.set()
+        self._wake.set()
+        self.queue.remove_listener(self._wake)
+        with self._active_lock:
+            active = list(self._active)
+        for job_id in active:
+            try:
+                self.queue.finish(self.worker_id, job_id, "waiting", error_message="工作进程退出，任务重新排队",
+                                  release=True)
+            except Exception as e:
+                logger.warning(f"释放任务 {job_id} 失败: {str(e)}")
+        self._threads = []
+        logger.info(f"任务工作进程 {self.worker_id} 已停止，{len(active)} 个执行中的任务重新排队")
+
+    def _run(self):
+        """调度线程：有空闲名额时领取任务"""
+        while not self._stop.is_set():
+            # 先清除唤醒标记再领取，领取期间新加入的任务会再次唤醒
+            self._wake.clear()
+            with self._active_lock:
+                free = self.concurrency - len(self._active)
+            jobs = []
+            if free > 0:
+                try:
+                    jobs = self.queue.claim(self.worker_id, free)
+                except Exception as e:
+                    logger.error(f"领取任务失败: {str(e)}")
+            if self._stop.is_set():
+                for job in jobs:
+                    self.queue.finish(self.worker_id, job["id"], "waiting", release=True)
+                return
+            for job in jobs:
+                ctx = JobContext(job["id"], job["attempts"])
+                with self._active_lock:
+                    self._active[job["id"]] = ctx
+                threading.Thread(target=self._execute, args=(job, ctx),
+                                 name=f"job-{job['job_type']}", daemon=True).start()
+            # 等待任务结束、新任务加入或下一次轮询（其他进程加入的任务和过期的租约靠轮询发现）
+            self._wake.wait(get_config('JOB_POLL_INTERVAL'))
+
+    def _heartbeat(self):
+        """心跳线程：为执行中的任务续约并保存进度"""
+        while not self._stop.wait(get_config('JOB_HEARTBEAT_SECONDS')):
+            with self._active_lock:
+                active = list(self._active.values())
+            for ctx in active:
+                try:
+                    if not self.queue.heartbeat(self.worker_id, ctx.job_id, ctx.current_progress()):
+                        if not ctx.lease_lost:
+                            logger.warning(f"任务 {ctx.job_id} 的租约已失效")
+                        ctx.lease_lost = True
+                except Exception as e:
+                    logger.warning(f"任务 {ctx.job_id} 续约失败: {str(e)}")
+
+    def _execute(self, job: Dict[str, Any], ctx: JobContext):
+        """执行单个任务并记录结果"""
+        job_id, job_type = job["id"], job["job_type"]
+        payload = job["payload"] or {}
+        handler, _ = self.queue.get_handler(job_type)
+        try:
+            if handler is None:
+                raise JobError(f"未知的任务类型: {job_type}")
+            result = handler(payload, ctx)
+            self.queue.finish(self.worker_id, job_id, "completed", result=result)
+        except LeaseLostError:
+            # 任务已由其他工作进程接手，不再记录结果，也不恢复文档状态
+            logger.warning(f"任务 {job_type} {job_id} 的租约已失效，停止执行")
+        except JobError as e:
+            logger.error(f"任务 {job_type} {job_id} 失败: {str(e)}")
+            if self.queue.finish(self.worker_id, job_id, "failed", error_message=str(e)):
+                self.queue.recover(job_type, payload)
+        except Exception as e:
+            logger.error(f"任务 {job_type} {job_id} 执行异常: {str(e)}")
+            logger.error(traceback.format_exc())
+            if job["attempts"] < job["max_attempts"]:
+                self.queue.finish(self.worker_id, job_id, "waiting", error_message=str(e))
+            elif self.queue.finish(self.worker_id, job_id, "failed", error_message=str(e)):
+                self.queue.recover(job_type, payload)
+        finally:
+            with self._active_lock:
+                self._active.pop(job_id, None)
+            self._wake.set()
+
+
+# 全局任务队列
+job_queue = JobQueue()
+
+# 当前进程的工作进程（由 start_worker 创建）
+_worker: Optional[JobWorker] = None
+
+
+def start_worker(concurrency: Optional[int] = None) -> JobWorker:
+    """启动当前进程的任务工作进程（Web服务内嵌运行，或由 worker.py 独立运行）"""
+    global _worker
+    if _worker is None:
+        _worker = JobWorker(job_queue, concurrency or get_config('JOB_WORKER_CONCURRENCY'))
+    _worker.start()
+    return _worker
+
+
+def stop_worker():
+    """停止当前进程的任务工作进程"""
+    if _worker is not None:
+        _worker.stop()
@@ -0,0 +1,230 @@
+"""
+进度推送
+
+切块和批量任务在执行过程中把最新状态发布到进程内的进度总线，浏览器通过 Server-Sent Events 订阅：
+连接时收到一次完整状态（snapshot），之后只收到发生变化的字段（delta），任务结束后服务器关闭连接。
+
+任务由其他进程执行（JOB_WORKER_MODE=external）时本进程收不到发布，此时按固定间隔从数据库读取状态，
+同一主题的所有订阅者共用一次读取。
+"""
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Set, Tuple
+
+from fastapi.responses import StreamingResponse
+
+from ..config import get_config
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("success", "error", "completed", "failed", "unknown")
+MAX_TOPICS = 500  # 最多保留的主题状态数，超过时淘汰最久未更新的
+
+
+def chunk_topic(document_id: int) -> str:
+    return f"chunk:{document_id}"
+
+
+def task_topic(task_id: str) -> str:
+    return f"task:{task_id}"
+
+
+def _diff(old: Dict[str, Any], new: Dict[str, Any], replace: bool) -> Dict[str, Any]:
+    """计算从 old 到 new 的变化，字典逐层比较；replace 为True时 new 中没有的键以 None 表示删除"""
+    delta = {}
+    for key, value in new.items():
+        old_value = old.get(key)
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            nested = _diff(old_value, value, replace)
+            if nested:
+                delta[key] = nested
+        elif key not in old or old_value != value:
+            delta[key] = value
+    if replace:
+        for key in old:
+            if key not in new:
+                delta[key] = None
+    return delta
+
+
+def _apply(state: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """把变化合并到状态中（原地修改并返回）"""
+    for key, value in delta.items():
+        if value is None:
+            state.pop(key, None)
+        elif isinstance(value, dict) and isinstance(state.get(key), dict):
+            _apply(state[key], value)
+        elif isinstance(value, dict):
+            state[key] = _apply({}, value)
+        else:
+            state[key] = value
+    return state
+
+
+def _is_terminal(state: Optional[Dict[str, Any]]) -> bool:
+    return bool(state) and state.get("status") in TERMINAL_STATUSES
+
+
+class _Subscriber:
+    """一个SSE连接，变化通过所在事件循环的队列送达"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def push(self, delta: Dict[str, Any]):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, delta)
+        except RuntimeError:
+            # 事件循环已关闭，连接随之结束
+            pass
+
+
+class ProgressBus:
+    """
+    进程内进度总线
+
+    set() 发布完整状态（单文档切块），update() 发布部分字段并合并（批量任务每完成一个文档发布一次），
+    两者都可以在任意线程中调用，只有真正变化的字段会发送给订阅者。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._subscribers: Dict[str, Set[_Subscriber]] = defaultdict(set)
+        # 正在由本进程执行并发布进度的主题（这些主题不需要从数据库读取）
+        self._local: Set[str] = set()
+        self._refreshed: Dict[str, float] = {}
+
+    def set(self, topic: str, state: Dict[str, Any], local: bool = True):
+        self._publish(topic, state, replace=True, local=local)
+
+    def update(self, topic: str, changes: Dict[str, Any], local: bool = True):
+        self._publish(topic, changes, replace=False, local=local)
+
+    def seed(self, topic: str, state: Dict[str, Any]):
+        """用 state 补充主题中还没有的字段，已有的字段以发布方的为准（本进程正在执行的任务使用）"""
+        with self._lock:
+            current = self._states.get(topic) or {}
+            missing = {key: value for key, value in state.items() if key not in current}
+        if missing:
+            self._publish(topic, missing, replace=False, local=False)
+
+    def get_state(self, topic: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            state = self._states.get(topic)
+            return json.loads(json.dumps(state)) if state is not None else None
+
+    def _publish(self, topic: str, data: Dict[str, Any], replace: bool, local: bool):
+        with self._lock:
+            state = self._states.get(topic)
+            if state is None:
+                state = {}
+                self._states[topic] = state
+            delta = _diff(state, data, replace)
+            if delta:
+                # 保存副本，发布方之后继续修改自己的字典不影响总线中的状态
+                _apply(state, json.loads(json.dumps(delta)))
+            self._states.move_to_end(topic)
+            while len(self._states) > MAX_TOPICS:
+                evicted, _ = self._states.popitem(last=False)
+                self._local.discard(evicted)
+
+            if local and not _is_terminal(state):
+                self._local.add(topic)
+            elif local:
+                self._local.discard(topic)
+            subscribers = list(self._subscribers.get(topic, ()))
+
+        if delta:
+            for subscriber in subscribers:
+                subscriber.push(delta)
+
+    def _is_local(self, topic: str) -> bool:
+        with self._lock:
+            return topic in self._local
+
+    async def _refresh(self, topic: str, snapshot: Callable[[], Optional[Dict[str, Any]]], force: bool = False):
+        """从数据库读取状态并发布（同一主题在间隔内只读取一次）"""
+        now = time.monotonic()
+        if not force and now - self._refreshed.get(topic, 0) < get_config('PROGRESS_SNAPSHOT_INTERVAL'):
+            return
+        self._refreshed[topic] = now
+        try:
+            state = await asyncio.to_thread(snapshot)
+        except Exception as e:
+            logger.warning(f"读取 {topic} 的状态失败: {str(e)}")
+            return
+        if state is None:
+            return
+        if self._is_local(topic):
+            # 总线中的计数可能比数据库更新，只补充缺少的字段（任务名称、总数等）
+            self.seed(topic, state)
+        else:
+            self.set(topic, state, local=False)
+
+    async def stream(self, topic: str, snapshot: Callable[[], Optional[Dict[str, Any]]]) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        订阅主题，依次产生 ('snapshot', 完整状态)、('delta', 变化)，空闲时产生 ('ping', None)
+
+        状态进入结束状态（success/error/completed/failed）后结束。
+        """
+        # 连接时总是读取一次最新状态；本进程正在执行时只用它补充总线中缺少的字段
+        await self._refresh(topic, snapshot, force=True)
+
+        # 在同一把锁内复制状态并登记订阅，之后发布的变化不会遗漏也不会重复
+        subscriber = _Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            state = self._states.get(topic)
+            state = json.loads(json.dumps(state)) if state else {"status": "unknown", "message": "未找到相关任务"}
+            self._subscribers[topic].add(subscriber)
+        try:
+            yield "snapshot", state
+            if _is_terminal(state):
+                return
+
+            interval = get_config('PROGRESS_SNAPSHOT_INTERVAL')
+            while True:
+                try:
+                    delta = await asyncio.wait_for(subscriber.queue.get(), timeout=interval)
+                except asyncio.TimeoutError:
+                    if not self._is_local(topic):
+                        await self._refresh(topic, snapshot)
+                    if subscriber.queue.empty():
+                        yield "ping", None
+                    continue
+                _apply(state, delta)
+                yield "delta", delta
+                if _is_terminal(state):
+                    return
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._subscribers[topic]
+                        self._refreshed.pop(topic, None)
+
+    def event_stream(self, topic: str, snapshot: Callable[[], Optional[Dict[str, Any]]]) -> StreamingResponse:
+        """返回SSE响应"""
+        async def events():
+            async for event, data in self.stream(topic, snapshot):
+                if event == "ping":
+                    yield ": ping\n\n"
+                else:
+                    yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # 禁止反向代理缓冲
+        })
+
+
+# 全局进度总线
+progress_bus = ProgressBus()
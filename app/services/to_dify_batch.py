@@ -1,18 +1,24 @@
 import json
 import uuid
-import time
 import logging
-import requests
 import os
 import asyncio
-from typing import List, Dict, Any, Optional
-from fastapi import BackgroundTasks, HTTPException
+import httpx
+from typing import Callable, List, Dict, Any, Optional
+from fastapi import HTTPException
 from sqlalchemy.orm import Session
 from datetime import datetime
-from functools import wraps
 
 from ..database import Document, Folder, BatchTask, Chunk, get_db_session
 from ..services.to_dify_single import DifySingleService
+from ..services.dify_client import get_async_dify_client
+from ..services.dify_segments import build_segments, upload_segments_async
+from ..services.dify_indexing import indexing_watcher
+from ..services.dify_cleanup import segment_cleaner
+from ..services.dify_sync import dify_sync_service, PUSH_MODES
+from ..services.job_queue import job_queue, LeaseLostError
+from ..services.progress_bus import progress_bus, task_topic
+from ..services.batch_items import batch_item_service
 from ..config import get_config, BASE_DIR
 
 # 配置日志
@@ -22,26 +28,9 @@ logger = logging.getLogger(__name__)
 # 使用已有的Dify服务
 dify_service = DifySingleService()
 
-# 重试装饰器（异步版本）
-def async_retry(max_retries=3, delay=1.0):
-    def decorator(func):
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            retries = 0
-            while retries < max_retries:
-                try:
-                    return await func(*args, **kwargs)
-                except Exception as e:
-                    retries += 1
-                    if retries < max_retries:
-                        logger.warning(f"操作失败: {str(e)}，{delay}秒后第{retries}次重试...")
-                        await asyncio.sleep(delay)
-                    else:
-                        logger.error(f"操作失败，已达最大重试次数: {str(e)}")
-                        raise
-            return None
-        return wrapper
-    return decorator
+# 创建Dify文档的最大尝试次数和重试间隔（秒）
+CREATE_MAX_RETRIES = 3
+CREATE_RETRY_DELAY = 2.0
 
 class DifyBatchService:
     """批量推送到Dify服务"""
@@ -50,9 +39,13 @@ class DifyBatchService:
                           folder_id: int,
                           document_ids: List[int],
                           dataset_id: str,
-                          background_tasks: BackgroundTasks,
-                          db: Session) -> Dict[str, Any]:
-        """开始批量推送到Dify任务"""
+                          db: Session,
+                          mode: Optional[str] = None) -> Dict[str, Any]:
+        """开始批量推送到Dify任务（mode 同 DifySingleService.push_document_to_dify）"""
+        mode = mode or get_config('DIFY_PUSH_MODE')
+        if mode not in PUSH_MODES:
+            raise HTTPException(status_code=400, detail=f"无效的推送方式: {mode}")
+        
         # 验证文件夹是否存在
         folder = db.query(Folder).filter(Folder.id == folder_id).first()
         if not folder:
@@ -97,7 +90,8 @@ class DifyBatchService:
         # 保存任务设置
         settings = {
             "dataset_id": dataset_id,
-            "dataset_name": kb_check.get("name", "未知知识库")
+            "dataset_name": kb_check.get("name", "未知知识库"),
+            "mode": mode
         }
         
         # 创建任务记录
@@ -113,20 +107,21 @@ class DifyBatchService:
             success_count=0,
             error_count=0,
             document_ids=json.dumps(document_ids),
-            task_results=json.dumps({}),
             settings=json.dumps(settings)
         )
         
         db.add(task)
+        db.flush()
+        batch_item_service.create_items(db, task_id, document_ids)
         db.commit()
         
-        # 启动后台任务
-        background_tasks.add_task(
-            self._process_batch_to_dify,
-            task_id=task_id,
-            document_ids=document_ids,
-            dataset_id=dataset_id
-        )
+        # 加入持久化任务队列
+        job_queue.enqueue("batch_to_dify", {
+            "task_id": task_id,
+            "document_ids": document_ids,
+            "dataset_id": dataset_id,
+            "mode": mode
+        })
         
         return {
             "status": "processing",
@@ -142,8 +137,18 @@ class DifyBatchService:
     async def _process_batch_to_dify(self,
                              task_id: str,
                              document_ids: List[int],
-                             dataset_id: str):
-        """执行批量推送到Dify任务（后台）- 异步版本"""
+                             dataset_id: str,
+                             mode: str = 'full',
+                             resume: bool = False,
+                             check_lease: Optional[Callable[[], None]] = None):
+        """
+        执行批量推送到Dify任务（后台）- 异步版本
+        
+        所有与Dify的交互（上传文件、轮询处理状态、分页获取段落、删除和添加段落）都通过
+        异步客户端以协程方式执行，等待期间不占用线程，可以同时推送大量文档。
+        resume 为True时表示上次执行被中断，已记录结果的文档不再推送。
+        check_lease 在推送每个文档前和上传每批段落前调用，租约失效时抛出 LeaseLostError 并停止整个任务。
+        """
         # 获取数据库会话
         db = get_db_session()
         try:
@@ -157,229 +162,90 @@ class DifyBatchService:
             # 更新任务状态为处理中
             task.status = "processing"
             db.commit()
+            topic = task_topic(task_id)
+            # 先发布任务的基本信息，之后每完成一个文档只发布变化的计数
+            progress_bus.update(topic, {
+                "task_id": task_id,
+                "name": task.name,
+                "status": "processing",
+                "total_count": task.total_count
+            })
             
-            # 任务结果字典
-            results = {}
-            success_count = 0
-            error_count = 0
-            
-            # 计算动态批次大小和并发数
-            batch_size = min(40, max(5, len(document_ids) // 2))
-            max_concurrency = min(8, len(document_ids))
-            
-            # 定义批量更新任务状态的函数
-            def update_task_status(force=False):
-                # 已处理文档数量
-                processed = success_count + error_count
-                
-                # 只有达到更新阈值或强制更新时才更新
-                if force or processed % 5 == 0 or processed == len(document_ids):
-                    nonlocal task
-                    task.task_results = json.dumps(results)
-                    task.success_count = success_count
-                    task.error_count = error_count
-                    db.commit()
-                    
-                    # 计算进度
-                    progress = int(processed / len(document_ids) * 100)
-                    logger.info(f"任务 {task_id} 进度: {progress}% (成功: {success_count}, 失败: {error_count})")
-            
-            # 定义处理单个文档的异步函数
-            @async_retry(max_retries=3, delay=2.0)
-            async def process_single_document(doc_id):
-                # 每个协程使用自己的数据库会话
-                thread_db = get_db_session()
-                try:
-                    document = thread_db.query(Document).filter(Document.id == doc_id).first()
-                    if not document:
-                        return {"status": "failed", "error": "文档不存在", "time": datetime.now().isoformat()}
-                    
-                    # 检查文档状态
-                    if document.status != "已切块":
-                        return {"status": "skipped", "error": "文档尚未切块", "time": datetime.now().isoformat()}
-                    
-                    if document.dify_push_status == "pushing":
-                        return {"status": "skipped", "error": "文档正在被其他任务推送", "time": datetime.now().isoformat()}
-                    
-                    # 标记文档为推送中
-                    document.dify_push_status = "pushing"
-                    thread_db.commit()
-                    
-                    # 获取文档的切块
-                    chunks = thread_db.query(Chunk).filter(Chunk.document_id == doc_id).order_by(Chunk.sequence).all()
-                    if not chunks:
-                        document.dify_push_status = None
-                        thread_db.commit()
-                        return {"status": "failed", "error": "文档没有切块", "time": datetime.now().isoformat()}
-                    
-                    # 调用推送函数
-                    logger.info(f"开始推送文档 '{document.filename}' 到Dify知识库")
-                    
-                    # 处理文件路径 - 支持相对路径
-                    filepath = document.filepath
-                    if not os.path.isabs(filepath):
-                        filepath = os.path.join(BASE_DIR, filepath)
-                    
-                    # 检查文件是否存在
-                    if not os.path.exists(filepath):
-                        document.dify_push_status = None
-                        thread_db.commit()
-                        return {
-                            "status": "failed", 
-                            "error": f"文件不存在: {filepath}", 
-                            "time": datetime.now().isoformat()
-                        }
-                    
-                    # 在事件循环的线程池中执行同步代码
-                    document_response = await asyncio.to_thread(
-                        dify_service._create_dify_document_by_file, 
-                        document, dataset_id, filepath
-                    )
-                    
-                    if document_response.get("status") != "success":
-                        document.dify_push_status = None
-                        thread_db.commit()
-                        return {
-                            "status": "failed", 
-                            "error": f"创建文档失败: {document_response.get('message', '未知错误')}", 
-                            "time": datetime.now().isoformat()
-                        }
-                    
-                    # 获取文档ID和批次ID
-                    data = document_response.get("data", {})
-                    dify_document_id = None
-                    if 'document' in data and 'id' in data['document']:
-                        dify_document_id = data['document']['id']
-                    elif 'id' in data:
-                        dify_document_id = data['id']
-                    
-                    batch_id = data.get('batch', dify_document_id)
-                    
-                    if not dify_document_id:
-                        document.dify_push_status = None
-                        thread_db.commit()
-                        return {"status": "failed", "error": "无法获取文档ID", "time": datetime.now().isoformat()}
-                    
-                    # 等待文档处理完成
-                    logger.info(f"文档 '{document.filename}': 等待Dify文档处理...")
-                    process_success = await asyncio.to_thread(
-                        dify_service._wait_for_document_processing, 
-                        dataset_id, batch_id
-                    )
-                    
-                    # 根据配置决定是否删除自动生成的段落
-                    if get_config('DIFY_DELETE_EXISTING_SEGMENTS'):
-                        logger.info(f"文档 '{document.filename}': 正在删除自动生成的段落...")
-                        segments_response = await asyncio.to_thread(
-                            dify_service._get_document_segments, 
-                            dataset_id, dify_document_id
-                        )
-                        
-                        if segments_response.get('status') == 'success':
-                            segments_data = segments_response.get('data', {})
-                            delete_result = await asyncio.to_thread(
-                                dify_service._delete_all_segments, 
-                                dataset_id, dify_document_id, segments_data
-                            )
-                            
-                            if delete_result.get('status') != 'success':
-                                logger.warning(f"文档 '{document.filename}': 删除段落失败: {delete_result.get('message', '未知错误')}")
-                    else:
-                        logger.info(f"文档 '{document.filename}': 已跳过删除段落步骤，根据配置 DIFY_DELETE_EXISTING_SEGMENTS=False")
-                    
-                    # 添加自定义切块
-                    logger.info(f"文档 '{document.filename}': 正在添加 {len(chunks)} 个切块...")
-                    add_response = await asyncio.to_thread(
-                        dify_service._add_segments_to_document, 
-                        chunks, dataset_id, dify_document_id
-                    )
-                    
-                    if add_response.get('status') != 'success':
-                        document.dify_push_status = None
-                        thread_db.commit()
-                        return {
-                            "status": "failed", 
-                            "error": f"添加段落失败: {add_response.get('message', '未知错误')}", 
-                            "time": datetime.now().isoformat()
-                        }
-                    
-                    # 成功处理
-                    document.dify_push_status = "pushed"
-                    thread_db.commit()
-                    logger.info(f"文档 '{document.filename}' 推送完成")
-                    return {"status": "completed", "error": None, "time": datetime.now().isoformat()}
-                    
-                except Exception as e:
-                    logger.error(f"推送文档 {doc_id} 到Dify失败: {str(e)}")
-                    # 如果出现异常，恢复文档状态
+            # 只推送还没有结果的文档（继续执行时已记录结果的文档不再推送）
+            if resume:
+                batch_item_service.reset_unfinished(db, task_id)
+            pending_ids = batch_item_service.unfinished_document_ids(db, task_id)
+            counts = batch_item_service.count_items(db, task_id)
+            success_count = counts["completed"]
+            error_count = counts["failed"] + counts["skipped"]
+            if resume:
+                logger.info(f"任务 {task_id} 继续执行，已完成 {len(document_ids) - len(pending_ids)} 个，剩余 {len(pending_ids)} 个")
+            
+            # 同时处理的文档数（协程数）
+            max_concurrency = max(1, min(get_config('DIFY_BATCH_CONCURRENCY'), len(pending_ids)))
+            
+            logger.info(f"任务 {task_id}: 共 {len(document_ids)} 个文档，并发数 {max_concurrency}")
+            
+            # 文档队列，固定数量的协程持续从队列中取文档处理
+            queue: asyncio.Queue = asyncio.Queue()
+            for doc_id in pending_ids:
+                queue.put_nowait(doc_id)
+            
+            async def worker():
+                nonlocal success_count, error_count
+                while True:
                     try:
-                        document = thread_db.query(Document).filter(Document.id == doc_id).first()
-                        if document and document.dify_push_status == "pushing":
-                            document.dify_push_status = None
-                            thread_db.commit()
-                    except:
-                        pass
-                    # 重新抛出异常以允许重试
-                    raise
-                finally:
-                    # 关闭线程数据库会话
-                    thread_db.close()
-            
-            logger.info(f"任务 {task_id}: 共 {len(document_ids)} 个文档，批次大小 {batch_size}，并发数 {max_concurrency}")
-            
-            # 按批次处理，使用异步方式
-            for i in range(0, len(document_ids), batch_size):
-                batch = document_ids[i:i+batch_size]
-                logger.info(f"任务 {task_id}: 处理批次 {i//batch_size+1}/{(len(document_ids)+batch_size-1)//batch_size}，共 {len(batch)} 个文档")
-                
-                # 使用信号量控制并发数
-                semaphore = asyncio.Semaphore(max_concurrency)
-                
-                # 批量异步处理文档
-                async def process_with_semaphore(doc_id):
-                    async with semaphore:
-                        return doc_id, await process_single_document(doc_id)
-                
-                # 创建所有任务
-                tasks = [process_with_semaphore(doc_id) for doc_id in batch]
-                
-                # 等待所有任务完成
-                batch_results = {}
-                for completed_task in asyncio.as_completed(tasks):
+                        doc_id = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    
+                    if check_lease:
+                        check_lease()
                     try:
-                        doc_id, result = await completed_task
-                        batch_results[str(doc_id)] = result
-                        
-                        if result["status"] == "completed":
-                            success_count += 1
-                        elif result["status"] == "failed":
-                            error_count += 1
-                            
-                        # 更新结果
-                        results.update(batch_results)
-                        update_task_status()
-                        
+                        await asyncio.to_thread(batch_item_service.start_item, task_id, doc_id)
+                        result = await self._push_single_document(doc_id, dataset_id, mode, check_lease)
+                    except LeaseLostError:
+                        raise
                     except Exception as e:
-                        logger.error(f"处理文档时发生异常: {str(e)}")
-                        # 由于无法获取doc_id，这里无法更新特定文档的结果
+                        logger.error(f"处理文档 {doc_id} 时发生异常: {str(e)}")
+                        result = {"status": "failed", "error": str(e), "time": datetime.now().isoformat()}
+                    
+                    # 只写入该文档的一行结果，并累加任务计数
+                    await asyncio.to_thread(batch_item_service.finish_item, task_id, doc_id, result)
+                    if result["status"] == "completed":
+                        success_count += 1
+                    else:
+                        # 失败和跳过的文档都计为失败，进度才能到达总数
                         error_count += 1
-                
-                # 批次处理完成后强制更新一次任务状态
-                update_task_status(force=True)
-                
-                # 批次间短暂休息
-                if i + batch_size < len(document_ids):
-                    await asyncio.sleep(1)
+                    # 每完成一个文档推送一次进度（只包含该文档的结果）
+                    progress_bus.update(topic, {
+                        "status": "processing",
+                        "success_count": success_count,
+                        "error_count": error_count,
+                        "progress": int((success_count + error_count) / task.total_count * 100) if task.total_count else 0,
+                        "last_item": {"document_id": doc_id, **result}
+                    })
+            
+            await asyncio.gather(*(worker() for _ in range(max_concurrency)))
             
             # 完成任务
             task.status = "completed"
             task.completed_at = datetime.now()
-            task.task_results = json.dumps(results)
-            task.success_count = success_count
-            task.error_count = error_count
+            batch_item_service.sync_counts(db, task)
+            success_count = task.success_count
+            error_count = task.error_count
             db.commit()
+            progress_bus.update(topic, {
+                "status": "completed",
+                "success_count": success_count,
+                "error_count": error_count,
+                "progress": int((success_count + error_count) / task.total_count * 100) if task.total_count else 0
+            })
             
             logger.info(f"批量推送任务 {task_id} 完成，共 {len(document_ids)} 个文档，成功 {success_count} 个，失败 {error_count} 个")
+        except LeaseLostError:
+            # 任务已由其他工作进程接手，不修改任务状态
+            raise
         except Exception as e:
             # 如果发生异常，记录错误
             logger.error(f"批量处理任务 {task_id} 失败: {str(e)}")
@@ -390,47 +256,306 @@ class DifyBatchService:
                     task.status = "failed"
                     task.error_message = str(e)
                     db.commit()
+                progress_bus.update(task_topic(task_id), {"status": "failed", "error_message": str(e)})
             except:
                 pass
         finally:
             # 关闭数据库连接
             db.close()
     
-    def get_task_status(self, task_id: str, db: Session) -> Dict[str, Any]:
-        """获取任务状态"""
-        task = db.query(BatchTask).filter(BatchTask.id == task_id).first()
-        if not task:
-            raise HTTPException(status_code=404, detail="任务不存在")
+    def _set_push_status(self, doc_id: int, status: Optional[str]):
+        """更新文档推送状态（使用短会话，不在网络请求期间占用数据库连接）"""
+        db = get_db_session()
+        try:
+            document = db.query(Document).filter(Document.id == doc_id).first()
+            if document:
+                document.dify_push_status = status
+                db.commit()
+        finally:
+            db.close()
+    
+    def _prepare_document(self, doc_id: int) -> Dict[str, Any]:
+        """
+        校验文档并标记为推送中，同时读出推送所需的数据
+        
+        Returns:
+            失败或跳过时返回任务结果字典（含 status），否则返回 {"document": ..., "segments": ...}
+        """
+        db = get_db_session()
+        try:
+            document = db.query(Document).filter(Document.id == doc_id).first()
+            if not document:
+                return {"status": "failed", "error": "文档不存在", "time": datetime.now().isoformat()}
+            
+            # 检查文档状态
+            if document.status != "已切块":
+                return {"status": "skipped", "error": "文档尚未切块", "time": datetime.now().isoformat()}
+            
+            if document.dify_push_status == "pushing":
+                return {"status": "skipped", "error": "文档正在被其他任务推送", "time": datetime.now().isoformat()}
+            
+            # 获取文档的切块
+            chunks = db.query(Chunk).filter(Chunk.document_id == doc_id).order_by(Chunk.sequence).all()
+            if not chunks:
+                return {"status": "failed", "error": "文档没有切块", "time": datetime.now().isoformat()}
+            
+            # 处理文件路径 - 支持相对路径
+            filepath = document.filepath
+            if not os.path.isabs(filepath):
+                filepath = os.path.join(BASE_DIR, filepath)
+            
+            # 检查文件是否存在
+            if not os.path.exists(filepath):
+                return {
+                    "status": "failed", 
+                    "error": f"文件不存在: {filepath}", 
+                    "time": datetime.now().isoformat()
+                }
+            
+            # 标记文档为推送中
+            document.dify_push_status = "pushing"
+            db.commit()
+            
+            return {
+                "document": {"filename": document.filename, "filepath": filepath},
+                "sequences": [chunk.sequence for chunk in chunks],
+                "segments": build_segments(chunks)
+            }
+        finally:
+            db.close()
+    
+    async def _push_single_document(self, doc_id: int, dataset_id: str, mode: str = 'full',
+                                    check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """
+        推送单个文档到Dify（协程）
         
-        # 解析JSON字段
-        document_ids = json.loads(task.document_ids)
-        task_results = json.loads(task.task_results)
-        settings = json.loads(task.settings)
+        数据库读写通过 asyncio.to_thread 在线程中执行，不阻塞事件循环中的其他文档。
+        只有创建文档的请求会重试（重试前按文件名查找，避免重复创建）；段落上传失败时记录失败区间，
+        再次推送时只重新发送这些段落，不再重建整个Dify文档。
+        """
+        prepared = await asyncio.to_thread(self._prepare_document, doc_id)
+        if "status" in prepared:
+            return prepared
         
-        # 计算进度
-        progress = 0
-        if task.total_count > 0:
-            done_count = task.success_count + task.error_count
-            progress = int((done_count / task.total_count) * 100)
+        # 增量同步：只推送变化的切块，没有推送记录时改为完整推送
+        if mode == 'sync':
+            try:
+                sync_result = await dify_sync_service.sync_document_async(doc_id, dataset_id, check_lease)
+            except LeaseLostError:
+                raise
+            except Exception:
+                await asyncio.to_thread(self._set_push_status, doc_id, None)
+                raise
+            if sync_result.get('status') == 'success':
+                await asyncio.to_thread(self._set_push_status, doc_id, "pushed")
+                return {"status": "completed", "error": None, "sync": sync_result, "time": datetime.now().isoformat()}
+            if sync_result.get('status') != 'full_required':
+                await asyncio.to_thread(self._set_push_status, doc_id, None)
+                return {
+                    "status": "failed",
+                    "error": f"增量同步失败: {sync_result.get('message', '未知错误')}",
+                    "sync": sync_result,
+                    "time": datetime.now().isoformat()
+                }
         
-        return {
-            "task_id": task.id,
-            "name": task.name,
-            "type": task.task_type,
-            "status": task.status,
-            "created_at": task.created_at,
-            "updated_at": task.updated_at,
-            "completed_at": task.completed_at,
-            "total_count": task.total_count,
-            "success_count": task.success_count,
-            "error_count": task.error_count,
-            "progress": progress,
-            "settings": settings,
-            "documents": {
-                "ids": document_ids,
-                "results": task_results
+        filename = prepared["document"]["filename"]
+        filepath = prepared["document"]["filepath"]
+        segments = prepared["segments"]
+        
+        try:
+            # 上次推送有上传失败的段落时，只向已创建的Dify文档重新发送这些段落
+            resume_result = await dify_sync_service.resume_push_async(doc_id, dataset_id, check_lease=check_lease)
+            if resume_result.get('status') == 'success':
+                await asyncio.to_thread(self._set_push_status, doc_id, "pushed")
+                logger.info(f"文档 '{filename}' 已补传上次失败的段落")
+                return {"status": "completed", "error": None, "resumed": True, "time": datetime.now().isoformat()}
+            if resume_result.get('status') != 'full_required':
+                await asyncio.to_thread(self._set_push_status, doc_id, None)
+                return {
+                    "status": "failed",
+                    "error": f"补传段落失败: {resume_result.get('message', '未知错误')}",
+                    "dify_document_id": resume_result.get('dify_document_id'),
+                    "failed_ranges": resume_result.get('failed', []),
+                    "time": datetime.now().isoformat()
+                }
+            
+            logger.info(f"开始推送文档 '{filename}' 到Dify知识库")
+            
+            document_response = await self._create_document_async(filename, dataset_id, filepath)
+            if document_response.get("status") != "success":
+                await asyncio.to_thread(self._set_push_status, doc_id, None)
+                return {
+                    "status": "failed", 
+                    "error": f"创建文档失败: {document_response.get('message', '未知错误')}", 
+                    "time": datetime.now().isoformat()
+                }
+            
+            # 获取文档ID和批次ID
+            data = document_response.get("data", {})
+            dify_document_id = None
+            if 'document' in data and 'id' in data['document']:
+                dify_document_id = data['document']['id']
+            elif 'id' in data:
+                dify_document_id = data['id']
+            
+            batch_id = data.get('batch', dify_document_id)
+            
+            if not dify_document_id:
+                await asyncio.to_thread(self._set_push_status, doc_id, None)
+                return {"status": "failed", "error": "无法获取文档ID", "time": datetime.now().isoformat()}
+            
+            # 等待文档处理完成
+            logger.info(f"文档 '{filename}': 等待Dify文档处理...")
+            await self._wait_for_processing_async(dataset_id, batch_id, os.path.getsize(filepath))
+            
+            # 根据配置决定是否删除自动生成的段落
+            if get_config('DIFY_DELETE_EXISTING_SEGMENTS'):
+                logger.info(f"文档 '{filename}': 正在删除自动生成的段落...")
+                delete_result = await self._delete_segments_async(dataset_id, dify_document_id)
+                if delete_result.get('status') != 'success':
+                    logger.warning(f"文档 '{filename}': 删除段落失败: {delete_result.get('message', '未知错误')}")
+            else:
+                logger.info(f"文档 '{filename}': 已跳过删除段落步骤，根据配置 DIFY_DELETE_EXISTING_SEGMENTS=False")
+            
+            # 添加自定义切块
+            logger.info(f"文档 '{filename}': 正在添加 {len(segments)} 个切块...")
+            add_response = await self._add_segments_async(segments, dataset_id, dify_document_id, check_lease)
+            
+            # 记录切块与Dify段落的对应关系（供之后增量同步）和失败的段落区间（再次推送时只重新发送这些段落）
+            if 'landed' in add_response:
+                await asyncio.to_thread(dify_sync_service.record_push, doc_id, dataset_id, dify_document_id,
+                                        prepared["sequences"], segments, add_response)
+            
+            if add_response.get('status') != 'success':
+                await asyncio.to_thread(self._set_push_status, doc_id, None)
+                return {
+                    "status": "failed", 
+                    "error": f"添加段落失败: {add_response.get('message', '未知错误')}", 
+                    "dify_document_id": dify_document_id,
+                    "landed_ranges": add_response.get('landed', []),
+                    "failed_ranges": add_response.get('failed', []),
+                    "time": datetime.now().isoformat()
+                }
+            
+            # 成功处理
+            await asyncio.to_thread(self._set_push_status, doc_id, "pushed")
+            logger.info(f"文档 '{filename}' 推送完成")
+            return {"status": "completed", "error": None, "time": datetime.now().isoformat()}
+        
+        except LeaseLostError:
+            raise
+        except Exception as e:
+            logger.error(f"推送文档 {doc_id} 到Dify失败: {str(e)}")
+            # 如果出现异常，恢复文档状态后重新抛出，由任务记录为失败
+            try:
+                await asyncio.to_thread(self._set_push_status, doc_id, None)
+            except Exception:
+                pass
+            raise
+    
+    async def _find_documents_by_name(self, dataset_id: str, filename: str) -> List[Dict[str, Any]]:
+        """按文件名查找知识库中的Dify文档（名称完全相同）"""
+        client = get_async_dify_client()
+        url = f"{dify_service.api_server}/v1/datasets/{dataset_id}/documents"
+        response = await client.get(url, params={'keyword': filename, 'page': 1, 'limit': 100})
+        response.raise_for_status()
+        return [doc for doc in response.json().get('data', []) if doc.get('name') == filename]
+    
+    async def _create_document_async(self, filename: str, dataset_id: str, filepath: str) -> Dict[str, Any]:
+        """
+        使用文件创建Dify文档（异步）
+        
+        连接失败、超时或服务端错误时重试。请求可能已在Dify中创建了文档（例如响应超时），
+        因此重试前先按文件名查找，出现创建前不存在的同名文档时直接使用该文档，不再重复创建。
+        创建前无法获取已有的同名文档时只尝试一次。
+        """
+        client = get_async_dify_client()
+        url = f"{dify_service.api_server}/v1/datasets/{dataset_id}/document/create-by-file"
+        
+        # 自动分段的设置
+        json_data = {
+            "indexing_technique": "high_quality",
+            "doc_form": "text_model",  # 使用普通模式
+            "process_rule": {
+                "mode": "automatic"
             }
         }
+        
+        try:
+            known_ids = {doc.get('id') for doc in await self._find_documents_by_name(dataset_id, filename)}
+            max_attempts = CREATE_MAX_RETRIES
+        except Exception as e:
+            logger.warning(f"查找同名文档失败: {str(e)}，创建文档失败时不再重试")
+            known_ids, max_attempts = set(), 1
+        
+        error = None
+        for attempt in range(max_attempts):
+            if attempt:
+                await asyncio.sleep(CREATE_RETRY_DELAY)
+                try:
+                    created = [doc for doc in await self._find_documents_by_name(dataset_id, filename)
+                               if doc.get('id') not in known_ids]
+                except Exception as e:
+                    logger.error(f"查找同名文档失败: {str(e)}，为避免重复创建不再重试")
+                    break
+                if created:
+                    logger.info(f"文档 '{filename}' 已由上一次请求创建，使用已有的Dify文档 {created[0].get('id')}")
+                    return {'status': 'success', 'data': {'document': created[0]}}
+                logger.warning(f"创建文档 '{filename}' 失败: {error}，第{attempt}次重试...")
+            
+            try:
+                with open(filepath, 'rb') as file_obj:
+                    response = await client.post(
+                        url,
+                        files={'file': (filename, file_obj, 'application/octet-stream')},
+                        data={'data': json.dumps(json_data)}
+                    )
+            except httpx.TransportError as e:
+                error = str(e) or type(e).__name__
+                continue
+            except Exception as e:
+                error = str(e)
+                break
+            
+            if response.status_code == 200:
+                return {'status': 'success', 'data': response.json()}
+            
+            logger.error(f"文档创建API响应错误: HTTP {response.status_code}, {response.text}")
+            error = f"HTTP {response.status_code}"
+            # 请求本身有误时重试没有意义
+            if response.status_code < 500:
+                break
+        
+        logger.error(f"创建文档失败: {error}")
+        return {'status': 'error', 'message': error}
+    
+    async def _wait_for_processing_async(self, dataset_id: str, batch_id: str, size_bytes: int = 0) -> bool:
+        """等待文档处理完成（由全局索引状态监视器统一轮询，协程只等待结果）"""
+        return await asyncio.wrap_future(indexing_watcher.watch(dataset_id, batch_id, size_bytes))
+    
+    async def _delete_segments_async(self, dataset_id: str, document_id: str) -> Dict[str, Any]:
+        """删除文档的所有段落（由全局段落删除流水线执行）"""
+        try:
+            return await asyncio.wrap_future(segment_cleaner.delete_all(dataset_id, document_id))
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+    
+    async def _add_segments_async(self, segments: List[Dict[str, Any]], dataset_id: str, document_id: str,
+                                  check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """分批添加段落到Dify文档（异步）"""
+        try:
+            url = f"{dify_service.api_server}/v1/datasets/{dataset_id}/documents/{document_id}/segments"
+            return await upload_segments_async(get_async_dify_client(), url, segments, check_lease=check_lease)
+        except LeaseLostError:
+            raise
+        except Exception as e:
+            logger.error(f"添加段落失败: {str(e)}")
+            return {'status': 'error', 'message': str(e)}
+    
+    def get_task_status(self, task_id: str, db: Session, page: int = 1, page_size: int = 50,
+                        status: Optional[str] = None) -> Dict[str, Any]:
+        """获取任务状态（文档结果分页返回）"""
+        return batch_item_service.get_task_status(task_id, db, page, page_size, status)
     
     def get_folder_tasks(self, folder_id: int, db: Session) -> List[Dict[str, Any]]:
         """获取文件夹的推送任务列表"""
@@ -3,13 +3,17 @@ import json
 import logging
 import time
 import os
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any, Optional
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import random
 
 from ..config import get_config
+from ..services.dify_client import get_dify_client
+from ..services.dify_segments import build_segments, upload_segments
+from ..services.dify_indexing import indexing_watcher
+from ..services.dify_cleanup import segment_cleaner
+from ..services.dify_sync import dify_sync_service, PUSH_MODES
+from ..services.job_queue import job_queue, LeaseLostError
 from ..database import Document, Chunk, get_db, get_db_session
 
 # 配置日志
@@ -22,13 +26,13 @@ class DifySingleService:
         """初始化服务"""
         self.api_server = get_config('DIFY_API_SERVER')
         self.api_key = get_config('DIFY_API_KEY')
-        self.headers = {'Authorization': f'Bearer {self.api_key}'}
+        self.client = get_dify_client()
         self.base_dir = get_config('BASE_DIR') or os.getcwd()
         
     def _make_request(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
         """统一的请求处理方法"""
         try:
-            response = requests.request(method, url, headers=self.headers, **kwargs)
+            response = self.client.request(method, url, **kwargs)
             response.raise_for_status()
             return {'status': 'success', 'data': response.json()}
         except Exception as e:
@@ -52,7 +56,7 @@ class DifySingleService:
         """获取Dify知识库列表"""
         try:
             url = f"{self.api_server}/v1/datasets"
-            response = requests.get(url, headers=self.headers, params={'page': 1, 'limit': 100})
+            response = self.client.get(url, params={'page': 1, 'limit': 100})
             response.raise_for_status()
             return {'status': 'success', 'data': response.json()}
         except Exception as e:
@@ -64,14 +68,14 @@ class DifySingleService:
         try:
             # 尝试健康检查接口
             url = f"{self.api_server}/v1/health"
-            response = requests.get(url, headers=self.headers, timeout=5)
+            response = self.client.get(url, timeout=5)
             
             if response.status_code < 300:
                 return {'status': 'success', 'message': '连接成功'}
             
             # 尝试知识库接口
             url = f"{self.api_server}/v1/datasets"
-            response = requests.get(url, headers=self.headers, timeout=5)
+            response = self.client.get(url, timeout=5)
             if response.status_code < 300 or response.status_code == 401:
                 return {'status': 'success', 'message': '连接成功'}
             
@@ -83,9 +87,19 @@ class DifySingleService:
         except Exception as e:
             return {'status': 'error', 'message': f'连接测试失败: {str(e)}'}
     
-    def push_document_to_dify(self, document_id: int, dataset_id: str, db: Session) -> JSONResponse:
-        """启动文档推送到Dify知识库的任务"""
+    def push_document_to_dify(self, document_id: int, dataset_id: str, db: Session, mode: Optional[str] = None) -> JSONResponse:
+        """
+        启动文档推送到Dify知识库的任务
+        
+        Args:
+            mode: full=创建新的Dify文档并推送全部切块；sync=只同步上次推送后变化的切块（无推送记录时自动完整推送），
+                  为空时使用配置 DIFY_PUSH_MODE
+        """
         try:
+            mode = mode or get_config('DIFY_PUSH_MODE')
+            if mode not in PUSH_MODES:
+                return JSONResponse(status_code=400, content={'message': f'无效的推送方式: {mode}'})
+            
             # 获取文档
             document = db.query(Document).filter(Document.id == document_id).first()
             if not document:
@@ -99,11 +113,12 @@ class DifySingleService:
             document.dify_push_status = "pushing"
             db.commit()
             
-            # 启动后台任务
-            from threading import Thread
-            thread = Thread(target=self._do_push_document, args=(document_id, dataset_id))
-            thread.daemon = True
-            thread.start()
+            # 加入持久化任务队列
+            job_queue.enqueue("dify_push", {
+                "document_id": document_id,
+                "dataset_id": dataset_id,
+                "mode": mode
+            }, dedupe_key=f"dify:{document_id}")
             
             return JSONResponse(status_code=200, content={
                 'message': '推送任务已启动',
@@ -114,8 +129,14 @@ class DifySingleService:
             logger.error(f"启动推送任务失败: {str(e)}")
             return JSONResponse(status_code=500, content={'message': str(e)})
     
-    def _do_push_document(self, document_id: int, dataset_id: str):
-        """实际执行推送的后台任务"""
+    def _do_push_document(self, document_id: int, dataset_id: str, mode: str = 'full',
+                          check_lease: Optional[Callable[[], None]] = None):
+        """
+        实际执行推送的后台任务
+        
+        check_lease 在创建Dify文档前、增量同步和上传段落的每个请求前调用，租约失效时抛出 LeaseLostError，
+        文档的推送状态留给接手任务的工作进程处理。
+        """
         db = get_db_session()
         
         # 开始计时
@@ -141,11 +162,41 @@ class DifySingleService:
                 logger.error(f"文件不存在或没有切块: {filepath}")
                 return
             
+            # 增量同步：只推送变化的切块，没有推送记录时改为完整推送
+            if mode == 'sync':
+                sync_result = dify_sync_service.sync_document(document_id, dataset_id, check_lease)
+                if sync_result.get('status') == 'success':
+                    document.dify_push_status = "pushed"
+                    db.commit()
+                    logger.info(f"文档 {document_id} 增量同步完成，耗时 {time.time() - start_time:.2f}秒")
+                    return
+                if sync_result.get('status') != 'full_required':
+                    document.dify_push_status = None
+                    db.commit()
+                    logger.error(f"增量同步失败: {sync_result.get('message', '未知错误')}")
+                    return
+                logger.info(f"文档 {document_id} {sync_result.get('message')}，改为完整推送")
+            
+            # 上次推送有上传失败的段落时，只向已创建的Dify文档重新发送这些段落
+            if check_lease:
+                check_lease()
+            resume_result = dify_sync_service.resume_push(document_id, dataset_id, check_lease=check_lease)
+            if resume_result.get('status') != 'full_required':
+                document.dify_push_status = "pushed" if resume_result.get('status') == 'success' else None
+                db.commit()
+                if resume_result.get('status') == 'success':
+                    logger.info(f"文档 {document_id} 已补传上次失败的段落，耗时 {time.time() - start_time:.2f}秒")
+                else:
+                    logger.error(f"补传段落失败: {resume_result.get('message', '未知错误')}")
+                return
+            
             # 记录文件大小和切块数量
             file_size_mb = os.path.getsize(filepath) / 1024 / 1024
             logger.info(f"开始推送文档 {document_id}，共 {chunk_count} 个切块，文件大小: {file_size_mb:.2f}MB")
             
             # 创建文档并获取ID
+            if check_lease:
+                check_lease()
             logger.info("正在创建Dify文档...")
             document_response = self._create_dify_document_by_file(document, dataset_id, filepath)
             if document_response.get('status') != 'success':
@@ -166,17 +217,14 @@ class DifySingleService:
             
             # 等待文档处理完成
             logger.info("等待Dify文档处理...")
-            process_success = self._wait_for_document_processing(dataset_id, batch_id)
+            process_success = self._wait_for_document_processing(dataset_id, batch_id, os.path.getsize(filepath))
             
             # 根据配置决定是否删除自动生成的段落
             if get_config('DIFY_DELETE_EXISTING_SEGMENTS'):
                 logger.info("正在删除自动生成的段落...")
-                segments_response = self._get_document_segments(dataset_id, dify_document_id)
-                if segments_response.get('status') == 'success':
-                    segments_data = segments_response.get('data', {})
-                    delete_result = self._delete_all_segments(dataset_id, dify_document_id, segments_data)
-                    if delete_result.get('status') != 'success':
-                        logger.warning(f"删除段落失败: {delete_result.get('message', '未知错误')}")
+                delete_result = self._delete_all_segments(dataset_id, dify_document_id)
+                if delete_result.get('status') != 'success':
+                    logger.warning(f"删除段落失败: {delete_result.get('message', '未知错误')}")
             else:
                 logger.info("已跳过删除段落步骤，根据配置 DIFY_DELETE_EXISTING_SEGMENTS=False")
             
@@ -186,7 +234,16 @@ class DifySingleService:
             else:
                 logger.info(f"正在添加 {chunk_count} 个切块...")
                 
-            add_response = self._add_segments_to_document(chunks, dataset_id, dify_document_id)
+            add_response = self._add_segments_to_document(chunks, dataset_id, dify_document_id,
+                                                          check_lease=check_lease)
+            
+            # 记录切块与Dify段落的对应关系（供之后增量同步）和失败的段落区间（再次推送时只重新发送这些段落）
+            if 'landed' in add_response:
+                dify_sync_service.record_push(
+                    document_id, dataset_id, dify_document_id,
+                    [chunk.sequence for chunk in chunks], build_segments(chunks), add_response
+                )
+            
             if add_response.get('status') != 'success':
                 document.dify_push_status = None
                 db.commit()
@@ -206,6 +263,9 @@ class DifySingleService:
             else:
                 logger.info(f"文档 {document_id} 推送完成，共 {chunk_count} 个切块，耗时 {elapsed_time:.2f}秒")
             
+        except LeaseLostError:
+            logger.warning(f"文档 {document_id} 的推送任务租约已失效，停止推送")
+            raise
         except Exception as e:
             # 记录错误和耗时
             elapsed_time = time.time() - start_time
@@ -265,9 +325,8 @@ class DifySingleService:
             
             data = {'data': json.dumps(json_data)}
             
-            response = requests.post(
+            response = self.client.post(
                 url,
-                headers=self.headers,
                 files=files,
                 data=data
             )
@@ -288,181 +347,35 @@ class DifySingleService:
             if file_obj:
                 file_obj.close()
     
-    def _wait_for_document_processing(self, dataset_id: str, batch_id: str) -> bool:
-        """等待文档处理完成，支持大文件处理"""
-        start_wait = time.time()
-        max_wait_time = 600  # 最长等待10分钟
-        
-        while time.time() - start_wait < max_wait_time:
-            try:
-                url = f"{self.api_server}/v1/datasets/{dataset_id}/documents/{batch_id}/indexing-status"
-                response = requests.get(url, headers=self.headers)
-                
-                if response.status_code != 200:
-                    time.sleep(5)
-                    continue
-                
-                data = response.json()
-                
-                # 尝试从不同可能的格式获取状态
-                status = ""
-                if 'data' in data and isinstance(data['data'], list) and data['data']:
-                    status = data['data'][0].get('indexing_status', '')
-                else:
-                    status = data.get('status', data.get('indexing_status', ''))
-                
-                if status in ['completed', 'ready', 'done']:
-                    return True
-                
-                if status in ['failed', 'error']:
-                    return False
-                
-                # 根据已等待时间调整检查频率
-                elapsed = time.time() - start_wait
-                if elapsed < 60:
-                    time.sleep(2)       # 前1分钟：每2秒
-                elif elapsed < 180:
-                    time.sleep(5)       # 1-3分钟：每5秒
-                else:
-                    time.sleep(10)      # 3分钟后：每10秒
-                    
-                # 每分钟记录一次日志
-                if elapsed > 60 and int(elapsed) % 60 < 1:
-                    logger.info(f"文档处理中，已等待 {int(elapsed//60)}分{int(elapsed%60)}秒")
-                    
-            except Exception as e:
-                logger.warning(f"检查文档状态出错: {str(e)}")
-                time.sleep(10)
-        
-        # 超时但继续处理
-        logger.warning(f"等待文档处理超时(>{max_wait_time//60}分钟)，继续处理")
-        return True
-    
-    def _get_document_segments(self, dataset_id: str, document_id: str) -> Dict[str, Any]:
-        """获取文档的所有段落列表"""
-        try:
-            all_segments = []
-            page = 1
-            limit = 100
-            
-            while True:
-                url = f"{self.api_server}/v1/datasets/{dataset_id}/documents/{document_id}/segments"
-                params = {'page': page, 'limit': limit}
-                result = self._make_request('GET', url, params=params)
-                
-                if result['status'] != 'success':
-                    return result
-                
-                segments = self._extract_segments(result['data'])
-                all_segments.extend(segments)
-                
-                if len(segments) < limit:
-                    break
-                    
-                page += 1
-                logger.info(f"已获取 {len(all_segments)} 个段落...")
-            
-            return {'status': 'success', 'data': all_segments}
-        except Exception as e:
-            return {'status': 'error', 'message': str(e)}
+    def _wait_for_document_processing(self, dataset_id: str, batch_id: str, size_bytes: int = 0) -> bool:
+        """等待文档处理完成，由全局索引状态监视器统一轮询"""
+        return indexing_watcher.watch(dataset_id, batch_id, size_bytes).result()
     
-    def _delete_all_segments(self, dataset_id: str, document_id: str, segments_data: Dict[str, Any]) -> Dict[str, Any]:
-        """删除文档的所有段落"""
+    def _delete_all_segments(self, dataset_id: str, document_id: str) -> Dict[str, Any]:
+        """删除文档的所有段落（边分页获取边删除，全局限速）"""
         try:
-            segments = self._extract_segments(segments_data)
-            if not segments:
-                return {'status': 'success'}
-            
-            segment_ids = [s['id'] for s in segments if isinstance(s, dict) and 'id' in s]
-            if not segment_ids:
-                return {'status': 'success'}
-            
-            total_segments = len(segment_ids)
-            logger.info(f"开始删除 {total_segments} 个段落...")
-            
-            def delete_segment(segment_id):
-                for attempt in range(3):
-                    try:
-                        url = f"{self.api_server}/v1/datasets/{dataset_id}/documents/{document_id}/segments/{segment_id}"
-                        response = requests.delete(url, headers=self.headers)
-                        response.raise_for_status()
-                        return True
-                    except Exception as e:
-                        if attempt < 2:
-                            time.sleep(1 * (2 ** attempt) + random.uniform(0, 1))
-                        else:
-                            logger.warning(f"删除段落 {segment_id} 失败: {str(e)}")
-                            return False
-            
-            deleted_count = 0
-            failed_count = 0
-            batch_size = 100
-            
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                for i in range(0, len(segment_ids), batch_size):
-                    batch = segment_ids[i:i + batch_size]
-                    futures = {executor.submit(delete_segment, sid): sid for sid in batch}
-                    
-                    for future in as_completed(futures):
-                        if future.result():
-                            deleted_count += 1
-                        else:
-                            failed_count += 1
-                    
-                    progress = (i + len(batch)) / total_segments * 100
-                    logger.info(f"删除进度: {progress:.1f}% ({deleted_count + failed_count}/{total_segments})")
-            
-            logger.info(f"段落删除完成: 成功 {deleted_count} 个, 失败 {failed_count} 个")
-            return {'status': 'success', 'deleted': deleted_count, 'failed': failed_count}
+            return segment_cleaner.delete_all(dataset_id, document_id).result()
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
     
-    def _add_segments_to_document(self, chunks: List[Chunk], dataset_id: str, document_id: str) -> Dict[str, Any]:
-        """添加段落到Dify文档"""
+    def _add_segments_to_document(self, chunks: List[Chunk], dataset_id: str, document_id: str,
+                                  ranges: Optional[List[List[int]]] = None,
+                                  check_lease: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+        """
+        分批添加段落到Dify文档
+        
+        Args:
+            chunks: 按序号排列的切块
+            ranges: 只上传这些段落序号区间（重新发送失败区间时使用），为空时上传全部
+        
+        Returns:
+            上传结果，landed/failed 记录成功和失败的段落序号区间
+        """
         try:
             url = f"{self.api_server}/v1/datasets/{dataset_id}/documents/{document_id}/segments"
-            
-            # 一次性提交所有切块（测试用）
-            all_chunks = list(chunks)
-            total_chunks = len(all_chunks)
-            
-            # 记录开始时间
-            start_time = time.time()
-            
-            # 单批处理所有段落
-            segments = []
-            for chunk in all_chunks:
-                # 将 chunk_metadata 转换为 keywords
-                keywords = []
-                if get_config('PASS_META_TO_DIFY') and chunk.chunk_metadata:
-                    # 将 chunk_metadata 字典转换为字符串列表
-                    for key, value in chunk.chunk_metadata.items():
-                        if isinstance(value, (list, dict)):
-                            keywords.append(f"{key}:{json.dumps(value, ensure_ascii=False)}")
-                        else:
-                            keywords.append(f"{key}:{str(value)}")
-                
-                segments.append({
-                    "content": chunk.content,
-                    "answer": "",
-                    "keywords": keywords
-                })
-            
-            logger.info(f"正在一次性添加所有 {len(segments)} 个段落...")
-            response = requests.post(
-                url,
-                headers=self.headers,
-                json={"segments": segments}
-            )
-            
-            response.raise_for_status()
-            
-            # 记录耗时
-            elapsed = time.time() - start_time
-            logger.info(f"添加 {len(segments)} 个段落完成，耗时 {elapsed:.2f} 秒")
-            
-            return {'status': 'success', 'data': response.json()}
-                
+            return upload_segments(url, build_segments(chunks), ranges, check_lease)
+        except LeaseLostError:
+            raise
         except Exception as e:
             logger.error(f"添加段落失败: {str(e)}")
-            return {'status': 'error', 'message': str(e)} 
\ No newline at end of file
+            return {'status': 'error', 'message': str(e)}
@@ -5,7 +5,7 @@
  * 
  * 主要功能：
  * 1. 文档全选/取消全选功能
- * 2. 任务状态轮询处理功能（供其他模块调用）
+ * 2. 任务状态订阅处理功能（服务器推送，供其他模块调用）
  */
 
 document.addEventListener('DOMContentLoaded', function() {
@@ -22,7 +22,54 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
-    // 轮询任务状态
+    // 任务结束时显示通知，延迟刷新页面以确保通知显示
+    function notifyTaskFinished(data) {
+        const statusText = data.status === 'completed' ? '已完成' : '失败';
+        const title = `任务${statusText}：${data.name}`;
+        const message = `成功: ${data.success_count}，失败: ${data.error_count}`;
+        
+        // 使用SweetAlert2显示通知，并在用户关闭或自动关闭后刷新页面
+        Swal.fire({
+            icon: data.status === 'completed' ? 'success' : 'error',
+            title: title,
+            text: message,
+            timer: 3000,
+            showConfirmButton: false,
+            willClose: () => {
+                window.location.reload();
+            }
+        });
+    }
+    
+    // 实时更新任务卡片中的进度条和计数
+    function updateTaskItem(taskElement, data) {
+        const progressBar = taskElement.querySelector('.progress-bar');
+        if (progressBar && data.progress !== undefined) {
+            progressBar.style.width = `${data.progress}%`;
+            progressBar.textContent = `${data.progress}%`;
+            progressBar.setAttribute('aria-valuenow', data.progress);
+        }
+        const counts = taskElement.querySelector('.small.mt-2 > div:first-child');
+        if (counts && data.total_count !== undefined) {
+            counts.textContent = `总数: ${data.total_count} | 成功: ${data.success_count} | 失败: ${data.error_count}`;
+        }
+    }
+    
+    // 合并服务器推送的变化（值为null表示删除该字段）
+    function mergeDelta(state, delta) {
+        Object.entries(delta).forEach(([key, value]) => {
+            if (value === null) {
+                delete state[key];
+            } else if (typeof value === 'object' && !Array.isArray(value) && typeof state[key] === 'object' && state[key] !== null) {
+                mergeDelta(state[key], value);
+            } else {
+                state[key] = value;
+            }
+        });
+        return state;
+    }
+    
+    // 订阅任务状态：服务器推送（SSE）只发送变化的计数和新完成文档的结果，浏览器不支持时退回轮询
     window.pollTaskStatus = function(taskId) {
         const taskElement = document.querySelector(`.task-item[data-task-id="${taskId}"]`);
         
@@ -32,29 +79,36 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
+        if (window.EventSource) {
+            let state = {};
+            const source = new EventSource(`/chunkgo/tasks/${taskId}/events`);
+            const handle = () => {
+                updateTaskItem(taskElement, state);
+                if (state.status === 'completed' || state.status === 'failed') {
+                    source.close();
+                    notifyTaskFinished(state);
+                }
+            };
+            source.addEventListener('snapshot', e => {
+                state = JSON.parse(e.data);
+                handle();
+            });
+            source.addEventListener('delta', e => {
+                mergeDelta(state, JSON.parse(e.data));
+                handle();
+            });
+            return;
+        }
+        
         // 如果已经有任务，开始轮询状态
         const intervalId = setInterval(function() {
-            fetch(`/chunkgo/tasks/${taskId}`)
+            fetch(`/chunkgo/tasks/${taskId}?page_size=1`)
                 .then(response => response.json())
                 .then(data => {
+                    updateTaskItem(taskElement, data);
                     if (data.status === 'completed' || data.status === 'failed') {
                         clearInterval(intervalId);
-                        // 任务完成时显示通知，延迟刷新页面以确保通知显示
-                        const statusText = data.status === 'completed' ? '已完成' : '失败';
-                        const title = `任务${statusText}：${data.name}`;
-                        const message = `成功: ${data.success_count}，失败: ${data.error_count}`;
-                        
-                        // 使用SweetAlert2显示通知，并在用户关闭或自动关闭后刷新页面
-                        Swal.fire({
-                            icon: data.status === 'completed' ? 'success' : 'error',
-                            title: title,
-                            text: message,
-                            timer: 3000,
-                            showConfirmButton: false,
-                            willClose: () => {
-                                window.location.reload();
-                            }
-                        });
+                        notifyTaskFinished(data);
                     }
                 })
                 .catch(error => {
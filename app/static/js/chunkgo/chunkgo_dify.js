@@ -17,6 +17,14 @@ document.addEventListener('DOMContentLoaded', function() {
     const testConnectionBtn = document.getElementById('testConnectionBtn');
     const difyKnowledgeBase = document.getElementById('difyKnowledgeBase');
     const startBatchDifyBtn = document.getElementById('startBatchDifyBtn');
+    const batchDifySyncMode = document.getElementById('batchDifySyncMode');
+    
+    // 记录用户是否改动过增量同步选项
+    if (batchDifySyncMode) {
+        batchDifySyncMode.addEventListener('change', function() {
+            batchDifySyncMode.dataset.touched = '1';
+        });
+    }
     
     // 测试Dify连接
     if (testConnectionBtn) {
@@ -135,6 +143,10 @@ document.addEventListener('DOMContentLoaded', function() {
             document_ids: docIds,
             dataset_id: difyKnowledgeBase.value
         };
+        // 没有改动过增量同步选项时不传 mode，使用服务端配置的默认推送方式（DIFY_PUSH_MODE）
+        if (batchDifySyncMode && batchDifySyncMode.dataset.touched) {
+            requestData.mode = batchDifySyncMode.checked ? 'sync' : 'full';
+        }
         
         // 发送请求
         fetch(`/chunkgo/folders/${folderId}/to-dify`, {
@@ -18,6 +18,8 @@ document.addEventListener('DOMContentLoaded', function() {
     const folderInput = document.getElementById('folderInput');
     const browseButton = document.getElementById('browseButton');
     const browseFolderButton = document.getElementById('browseFolderButton');
+    const archiveInput = document.getElementById('archiveInput');
+    const browseArchiveButton = document.getElementById('browseArchiveButton');
     const progressContainer = document.getElementById('progressContainer');
     const uploadProgress = document.getElementById('uploadProgress');
     const uploadStatus = document.getElementById('uploadStatus');
@@ -37,6 +39,22 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // 压缩包上传处理 - 点击上传压缩包按钮
+    if (browseArchiveButton) {
+        browseArchiveButton.addEventListener('click', function() {
+            archiveInput.click();
+        });
+    }
+    
+    // 压缩包上传处理 - 监听压缩包选择（服务器端展开）
+    if (archiveInput) {
+        archiveInput.addEventListener('change', function() {
+            if (archiveInput.files.length > 0) {
+                uploadFiles(archiveInput.files, true);
+            }
+        });
+    }
+    
     // 文件上传处理 - 监听文件选择
     if (fileInput) {
         fileInput.addEventListener('change', function() {
@@ -185,8 +203,8 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
-    // 上传文件到服务器
-    function uploadFiles(files) {
+    // 上传文件到服务器（archive 为true时上传一个压缩包，由服务器展开）
+    function uploadFiles(files, archive = false) {
         if (files.length === 0) return;
         
         // 显示进度条
@@ -194,12 +212,16 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // 创建FormData对象
         const formData = new FormData();
-        for (let i = 0; i < files.length; i++) {
-            formData.append('files', files[i]);
+        if (archive) {
+            formData.append('file', files[0]);
+        } else {
+            for (let i = 0; i < files.length; i++) {
+                formData.append('files', files[i]);
+            }
         }
         
         // 显示上传信息
-        uploadStatus.textContent = `准备上传 ${files.length} 个文件...`;
+        uploadStatus.textContent = archive ? `准备上传压缩包 ${files[0].name}...` : `准备上传 ${files.length} 个文件...`;
         
         // 创建XHR对象
         const xhr = new XMLHttpRequest();
@@ -212,7 +234,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 uploadProgress.textContent = percentComplete + '%';
                 uploadProgress.setAttribute('aria-valuenow', percentComplete);
                 
-                uploadStatus.textContent = `正在上传... ${percentComplete}%`;
+                uploadStatus.textContent = (archive && percentComplete === 100) ? '上传完成，正在展开压缩包...' : `正在上传... ${percentComplete}%`;
             }
         });
         
@@ -222,7 +244,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 try {
                     const response = JSON.parse(xhr.responseText);
                     
-                    uploadStatus.textContent = `上传完成！成功: ${response.success.length}, 失败: ${response.failed.length}`;
+                    const skippedText = response.skipped && response.skipped.length > 0 ? `, 跳过: ${response.skipped.length}` : '';
+                    uploadStatus.textContent = `上传完成！成功: ${response.success.length}, 失败: ${response.failed.length}${skippedText}`;
                     
                     // 显示成功消息
                     showToast('success', `上传成功：${response.success.length} 个文件，失败：${response.failed.length} 个文件`);
@@ -246,8 +269,12 @@ document.addEventListener('DOMContentLoaded', function() {
                     showToast('error', '处理上传响应时发生错误');
                 }
             } else {
-                uploadStatus.textContent = `上传失败: ${xhr.status} ${xhr.statusText}`;
-                showToast('error', `上传失败: ${xhr.status} ${xhr.statusText}`);
+                let reason = `${xhr.status} ${xhr.statusText}`;
+                try {
+                    reason = JSON.parse(xhr.responseText).detail || reason;
+                } catch (e) {}
+                uploadStatus.textContent = `上传失败: ${reason}`;
+                showToast('error', `上传失败: ${reason}`);
             }
         });
         
@@ -258,7 +285,7 @@ document.addEventListener('DOMContentLoaded', function() {
         });
         
         // 开始上传
-        xhr.open('POST', `/chunkgo/folders/${folderId}/upload`, true);
+        xhr.open('POST', archive ? `/chunkgo/folders/${folderId}/upload-archive` : `/chunkgo/folders/${folderId}/upload`, true);
         xhr.send(formData);
     }
     
@@ -28,6 +28,9 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 添加表单验证和提交处理
     initFormHandlers();
+    
+    // 分页加载切块列表
+    initChunkList();
 });
 
 // 缓存常用DOM元素，减少反复查询
@@ -113,8 +116,23 @@ async function fetchWithTimeout(url, options = {}, timeout = 8000) {
     }
 }
 
-// 轮询任务状态
+// 合并服务器推送的变化（值为null表示删除该字段）
+function mergeDelta(state, delta) {
+    Object.entries(delta).forEach(([key, value]) => {
+        if (value === null) {
+            delete state[key];
+        } else if (typeof value === 'object' && !Array.isArray(value) && typeof state[key] === 'object' && state[key] !== null) {
+            mergeDelta(state[key], value);
+        } else {
+            state[key] = value;
+        }
+    });
+    return state;
+}
+
+// 订阅任务状态：优先使用服务器推送（SSE），浏览器不支持时退回轮询
 let pollingTimer = null;
+let statusSource = null;
 let lastProgress = 0;
 function startPollingStatus() {
     if (els.progressContainer) els.progressContainer.style.display = 'block';
@@ -123,88 +141,45 @@ function startPollingStatus() {
     // 立即显示初始状态
     if (els.progressStatus) els.progressStatus.textContent = '正在初始化...';
     
-    if (pollingTimer) clearInterval(pollingTimer);
+    stopStatusUpdates();
+    if (window.EventSource) {
+        let state = {};
+        statusSource = new EventSource(`/chunklab/documents/${els.idInput.value}/chunk/events`);
+        statusSource.addEventListener('snapshot', e => {
+            state = JSON.parse(e.data);
+            handleTaskStatus(state);
+        });
+        statusSource.addEventListener('delta', e => {
+            handleTaskStatus(mergeDelta(state, JSON.parse(e.data)));
+        });
+        // 连接中断时浏览器会自动重连，重连后先收到完整状态
+        return;
+    }
+    
     // 立即检查一次状态
     checkTaskStatus();
     pollingTimer = setInterval(checkTaskStatus, 1000);
 }
 
-// 检查任务状态
+// 停止接收任务状态
+function stopStatusUpdates() {
+    if (statusSource) {
+        statusSource.close();
+        statusSource = null;
+    }
+    if (pollingTimer) {
+        clearInterval(pollingTimer);
+        pollingTimer = null;
+    }
+}
+
+// 检查任务状态（轮询方式）
 async function checkTaskStatus() {
     if (!els.idInput?.value) return;
     
     try {
         const response = await fetchWithTimeout(`/chunklab/documents/${els.idInput.value}/chunk/status`);
-        const result = await response.json();
-        
-        const status = result.status;
-        
-        if (status === 'processing') {
-            const progress = result.progress || 0;
-            // 只有进度有变化时才更新UI
-            if (Math.abs(progress - lastProgress) >= 1) {
-                lastProgress = progress;
-                
-                if (els.progressBar) {
-                    els.progressBar.style.width = `${progress}%`;
-                    els.progressBar.textContent = `${progress}%`;
-                    els.progressBar.setAttribute('aria-valuenow', progress);
-                }
-                
-                // 根据进度更新状态文本
-                if (els.progressStatus) {
-                    if (progress < 10) els.progressStatus.textContent = '正在初始化...';
-                    else if (progress < 50) els.progressStatus.textContent = '正在分析文档...';
-                    else if (progress < 80) els.progressStatus.textContent = '正在保存切块结果...';
-                    else els.progressStatus.textContent = '即将完成...';
-                }
-            }
-        } else if (status === 'success') {
-            // 处理完成
-            if (els.progressBar) {
-                els.progressBar.style.width = '100%';
-                els.progressBar.textContent = '100%';
-                els.progressBar.setAttribute('aria-valuenow', 100);
-                els.progressBar.classList.remove('progress-bar-animated');
-            }
-            if (els.progressStatus) {
-                els.progressStatus.textContent = '处理完成！';
-            }
-            
-            clearInterval(pollingTimer);
-            
-            // 显示成功消息并刷新页面
-            Swal.fire({
-                icon: 'success',
-                title: '切块成功',
-                text: '文档切块已完成',
-                confirmButtonColor: '#2c3e50',
-                showConfirmButton: false,
-                timer: 1500
-            }).then(() => window.location.reload());
-            
-        } else if (status === 'error') {
-            // 处理出错
-            if (els.progressBar) {
-                els.progressBar.classList.replace('bg-primary', 'bg-danger');
-                els.progressBar.classList.remove('progress-bar-animated');
-            }
-            if (els.progressStatus) {
-                els.progressStatus.textContent = `处理错误: ${result.message || '未知错误'}`;
-            }
-            
-            clearInterval(pollingTimer);
-            
-            // 显示错误信息
-            Swal.fire({
-                icon: 'error',
-                title: '切块失败',
-                text: result.message || '处理过程中发生错误',
-                confirmButtonColor: '#2c3e50'
-            });
-            
-            if (els.submitButton) els.submitButton.disabled = false;
-        }
+        handleTaskStatus(await response.json());
     } catch (error) {
         let errorMessage = '检查任务状态出错';
         if (error.message === '请求超时') {
@@ -220,6 +195,82 @@ async function checkTaskStatus() {
     }
 }
 
+// 根据任务状态更新界面
+function handleTaskStatus(result) {
+    const status = result.status;
+    
+    if (status === 'processing') {
+        const progress = result.progress || 0;
+        // 流式切块时显示已保存的切块数量
+        if (result.chunk_count && els.progressStatus) {
+            els.progressStatus.textContent = `正在切块并保存，已保存 ${result.chunk_count} 个切块...`;
+        }
+        // 只有进度有变化时才更新UI
+        if (Math.abs(progress - lastProgress) >= 1) {
+            lastProgress = progress;
+            
+            if (els.progressBar) {
+                els.progressBar.style.width = `${progress}%`;
+                els.progressBar.textContent = `${progress}%`;
+                els.progressBar.setAttribute('aria-valuenow', progress);
+            }
+            
+            // 根据进度更新状态文本
+            if (els.progressStatus && !result.chunk_count) {
+                if (progress < 10) els.progressStatus.textContent = '正在初始化...';
+                else if (progress < 50) els.progressStatus.textContent = '正在分析文档...';
+                else if (progress < 80) els.progressStatus.textContent = '正在保存切块结果...';
+                else els.progressStatus.textContent = '即将完成...';
+            }
+        }
+    } else if (status === 'success') {
+        // 处理完成
+        if (els.progressBar) {
+            els.progressBar.style.width = '100%';
+            els.progressBar.textContent = '100%';
+            els.progressBar.setAttribute('aria-valuenow', 100);
+            els.progressBar.classList.remove('progress-bar-animated');
+        }
+        if (els.progressStatus) {
+            els.progressStatus.textContent = '处理完成！';
+        }
+        
+        stopStatusUpdates();
+        
+        // 显示成功消息并刷新页面
+        Swal.fire({
+            icon: 'success',
+            title: '切块成功',
+            text: '文档切块已完成',
+            confirmButtonColor: '#2c3e50',
+            showConfirmButton: false,
+            timer: 1500
+        }).then(() => window.location.reload());
+        
+    } else if (status === 'error') {
+        // 处理出错
+        if (els.progressBar) {
+            els.progressBar.classList.replace('bg-primary', 'bg-danger');
+            els.progressBar.classList.remove('progress-bar-animated');
+        }
+        if (els.progressStatus) {
+            els.progressStatus.textContent = `处理错误: ${result.message || '未知错误'}`;
+        }
+        
+        stopStatusUpdates();
+        
+        // 显示错误信息
+        Swal.fire({
+            icon: 'error',
+            title: '切块失败',
+            text: result.message || '处理过程中发生错误',
+            confirmButtonColor: '#2c3e50'
+        });
+        
+        if (els.submitButton) els.submitButton.disabled = false;
+    }
+}
+
 // 初始化表单处理
 function initFormHandlers() {
     if (!els.chunkForm) return;
@@ -371,4 +422,190 @@ function debounce(func, wait) {
         clearTimeout(timeout);
         timeout = setTimeout(() => func.apply(context, args), wait);
     };
-}
\ No newline at end of file
+}
+
+// ==================== 切块列表分页加载 ====================
+
+const chunkList = {
+    after: 0,
+    keyword: '',
+    loading: false,
+    hasMore: true,
+    observer: null
+};
+
+// 初始化切块列表：滚动到底部时加载下一页，支持服务端搜索
+function initChunkList() {
+    const container = document.getElementById('chunksContainer');
+    const sentinel = document.getElementById('chunksSentinel');
+    if (!container || !sentinel) return;
+    
+    chunkList.observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) loadChunkPage();
+    }, { rootMargin: '400px 0px' });
+    chunkList.observer.observe(sentinel);
+    
+    const searchInput = document.getElementById('chunkSearch');
+    if (searchInput) {
+        searchInput.addEventListener('input', debounce(function() {
+            chunkList.keyword = searchInput.value.trim();
+            resetChunkList();
+        }, 300));
+    }
+    
+    // 展开被截断的切块内容
+    container.addEventListener('click', async function(e) {
+        const button = e.target.closest('.chunk-expand');
+        if (!button) return;
+        
+        button.disabled = true;
+        try {
+            const response = await fetchWithTimeout(`/chunklab/documents/${els.idInput.value}/chunks/${button.dataset.sequence}`);
+            if (!response.ok) throw new Error('加载失败');
+            const chunk = await response.json();
+            const contentEl = button.closest('.chunk-item').querySelector('.chunk-content');
+            contentEl.textContent = chunk.content;
+            button.remove();
+        } catch (error) {
+            button.disabled = false;
+            console.error('加载完整切块出错:', error.message);
+        }
+    });
+}
+
+// 重置列表（搜索条件变化时）
+function resetChunkList() {
+    const container = document.getElementById('chunksContainer');
+    container.innerHTML = '';
+    chunkList.after = 0;
+    chunkList.hasMore = true;
+    updateChunkSentinel();
+    loadChunkPage();
+}
+
+// 加载下一页切块
+async function loadChunkPage() {
+    if (chunkList.loading || !chunkList.hasMore) return;
+    
+    const container = document.getElementById('chunksContainer');
+    const keyword = chunkList.keyword;
+    const params = new URLSearchParams({
+        after: chunkList.after,
+        limit: container.dataset.pageSize || 50,
+        truncate: container.dataset.previewLength || 0
+    });
+    if (keyword) params.set('q', keyword);
+    
+    chunkList.loading = true;
+    try {
+        const response = await fetchWithTimeout(`/chunklab/documents/${els.idInput.value}/chunks/page?${params}`);
+        if (!response.ok) throw new Error('加载切块失败');
+        const result = await response.json();
+        
+        // 搜索条件已变化，丢弃过期结果（finally 中按新条件重新加载）
+        if (keyword !== chunkList.keyword) return;
+        
+        const fragment = document.createDocumentFragment();
+        result.items.forEach(item => fragment.appendChild(renderChunkItem(item)));
+        container.appendChild(fragment);
+        
+        chunkList.hasMore = result.has_more;
+        if (result.next_after !== null) chunkList.after = result.next_after;
+    } catch (error) {
+        if (keyword === chunkList.keyword) chunkList.hasMore = false;
+        console.error('加载切块出错:', error.message);
+    } finally {
+        chunkList.loading = false;
+        updateChunkSentinel();
+        if (keyword !== chunkList.keyword) {
+            // 加载期间输入了新的搜索条件，resetChunkList 的加载被跳过，这里补上
+            loadChunkPage();
+        } else if (chunkList.hasMore) {
+            observeChunkSentinel();
+        }
+    }
+}
+
+// 重新观察底部提示：页面较短时提示一直可见，观察器不会再次触发，重新观察会按当前位置立即回调一次
+function observeChunkSentinel() {
+    const sentinel = document.getElementById('chunksSentinel');
+    if (!chunkList.observer || !sentinel) return;
+    chunkList.observer.unobserve(sentinel);
+    chunkList.observer.observe(sentinel);
+}
+
+// 更新列表底部的加载提示
+function updateChunkSentinel() {
+    const sentinel = document.getElementById('chunksSentinel');
+    const container = document.getElementById('chunksContainer');
+    if (!sentinel) return;
+    
+    if (chunkList.hasMore) {
+        sentinel.innerHTML = '<span class="spinner-border spinner-border-sm me-2" role="status" aria-hidden="true"></span>正在加载切块...';
+    } else if (!container.children.length) {
+        sentinel.textContent = chunkList.keyword ? '没有匹配的切块' : '暂无切块';
+    } else {
+        sentinel.textContent = '已加载全部切块';
+    }
+}
+
+// HTML转义
+function escapeHtml(value) {
+    return String(value)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+// 渲染单个切块
+function renderChunkItem(item) {
+    const meta = item.meta || {};
+    const metaKeys = Object.keys(meta).filter(key => key !== 'heading');
+    const hasMeta = Object.keys(meta).length > 0;
+    
+    const metaRows = metaKeys.map(key => {
+        const value = meta[key];
+        const valueHtml = (value !== null && typeof value === 'object')
+            ? `<pre class="mb-0" style="font-size: 0.85rem; white-space: pre-wrap; word-wrap: break-word; overflow-wrap: break-word;">${escapeHtml(JSON.stringify(value, null, 2))}</pre>`
+            : `<span style="word-break: break-word;">${escapeHtml(value)}</span>`;
+        return `<tr>
+            <td style="width: 35%; color: var(--primary-color); vertical-align: top;">${escapeHtml(key)}</td>
+            <td style="word-break: break-word; max-width: 300px;">${valueHtml}</td>
+        </tr>`;
+    }).join('');
+    
+    const el = document.createElement('div');
+    el.className = 'chunk-item';
+    el.innerHTML = `
+        <div class="d-flex">
+            <span class="chunk-sequence">#${item.sequence}</span>
+            <div class="flex-grow-1">
+                ${meta.heading ? `<div class="chunk-heading"><i class="fas fa-heading me-1"></i><span>所属标题: ${escapeHtml(meta.heading)}</span></div>` : ''}
+                <div class="row">
+                    <div class="${hasMeta ? 'col-md-7 col-lg-6' : 'col-12'}">
+                        <div class="chunk-content">${escapeHtml(item.content || '')}</div>
+                    </div>
+                    ${hasMeta ? `
+                    <div class="col-md-5 col-lg-6">
+                        <div class="card h-100 bg-light">
+                            <div class="card-header py-2 bg-light">
+                                <h6 class="mb-0 fs-6"><i class="fas fa-info-circle me-1"></i>元数据信息</h6>
+                            </div>
+                            <div class="card-body py-2">
+                                <div class="meta-content" style="font-family: monospace; font-size: 0.85rem; max-height: 300px; overflow-y: auto;">
+                                    <table class="table table-sm table-borderless mb-0"><tbody>${metaRows}</tbody></table>
+                                </div>
+                            </div>
+                        </div>
+                    </div>` : ''}
+                </div>
+                <div class="chunk-metadata mt-1">
+                    <span>字符数: ${item.char_count}</span>
+                    ${item.truncated ? `<button type="button" class="btn btn-link chunk-expand ms-2" data-sequence="${item.sequence}">展开全文</button>` : ''}
+                </div>
+            </div>
+        </div>`;
+    return el;
+}
@@ -0,0 +1,34 @@
+"""
+测试配置
+
+在导入 app 之前把数据库指向临时目录中的SQLite文件，测试不会读写 data/db/chunklab.db。
+"""
+import os
+import tempfile
+
+import pytest
+
+_TEST_DIR = tempfile.mkdtemp(prefix="chunklab-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TEST_DIR, 'test.db')}"
+
+from app.database import Job, create_tables, get_db_session  # noqa: E402
+
+create_tables()
+
+
+@pytest.fixture
+def tmp_dir():
+    """测试用的临时目录"""
+    return _TEST_DIR
+
+
+@pytest.fixture(autouse=True)
+def clean_jobs():
+    """每个测试开始前清空任务队列，避免领取到其他测试留下的任务"""
+    db = get_db_session()
+    try:
+        db.query(Job).delete()
+        db.commit()
+    finally:
+        db.close()
+    yield
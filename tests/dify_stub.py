@@ -0,0 +1,154 @@
+"""
+本地Dify接口桩服务
+
+在测试进程中的线程里运行，实现推送用到的接口：知识库列表、文档列表和创建、索引状态、段落的查询、添加、更新和删除。
+通过属性注入故障：
+    fail_create_after_commit: 接下来多少次创建文档请求在创建成功后仍返回500（模拟响应丢失）
+    reject_contents: 包含这些内容的段落上传请求返回500
+"""
+import itertools
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DATASET_ID = "ds-test"
+
+
+class DifyStub:
+    """保存文档和段落数据的桩服务"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.documents = {}      # 文档ID -> {"id", "name", "dataset_id"}
+        self.segments = {}       # 文档ID -> [{"id", "content", ...}]
+        self.requests = []       # (方法, 路径)
+        self.segment_posts = []  # 每次添加段落请求中的段落内容
+        self.fail_create_after_commit = 0
+        self.reject_contents = set()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.documents.clear()
+            self.segments.clear()
+            self.requests.clear()
+            self.segment_posts.clear()
+            self.fail_create_after_commit = 0
+            self.reject_contents = set()
+
+    def next_id(self, prefix: str) -> str:
+        return f"{prefix}-{next(self._ids)}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None):
+                data = json.dumps(body if body is not None else {}).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def _route(self, method):
+                parsed = urlparse(self.path)
+                parts = [p for p in parsed.path.split("/") if p]
+                query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                body = self._body() if method == "POST" else b""
+                with stub.lock:
+                    stub.requests.append((method, parsed.path))
+                    status, result = stub.dispatch(method, parts[1:], query, body)
+                self._send(status, result)
+
+            def do_GET(self):
+                self._route("GET")
+
+            def do_POST(self):
+                self._route("POST")
+
+            def do_DELETE(self):
+                self._route("DELETE")
+
+        return Handler
+
+    def dispatch(self, method, parts, query, body):
+        """parts 为去掉 /v1 后的路径段"""
+        if parts == ["health"]:
+            return 200, {"status": "ok"}
+        if parts == ["datasets"]:
+            return 200, {"data": [{"id": DATASET_ID, "name": "测试知识库"}]}
+        if len(parts) < 3 or parts[0] != "datasets":
+            return 404, {"message": "not found"}
+        dataset_id = parts[1]
+
+        if parts[2:] == ["document", "create-by-file"] and method == "POST":
+            match = re.search(rb'filename="([^"]*)"', body)
+            name = match.group(1).decode("utf-8") if match else "unnamed"
+            document = {"id": self.next_id("doc"), "name": name, "dataset_id": dataset_id,
+                        "indexing_status": "completed"}
+            self.documents[document["id"]] = document
+            self.segments[document["id"]] = []
+            if self.fail_create_after_commit:
+                self.fail_create_after_commit -= 1
+                return 500, {"message": "internal error"}
+            return 200, {"document": document, "batch": f"batch-{document['id']}"}
+
+        if parts[2:] == ["documents"] and method == "GET":
+            keyword = query.get("keyword", "")
+            docs = [d for d in self.documents.values() if d["dataset_id"] == dataset_id and keyword in d["name"]]
+            return 200, {"data": docs}
+
+        if len(parts) == 5 and parts[2] == "documents" and parts[4] == "indexing-status":
+            return 200, {"data": [{"indexing_status": "completed"}]}
+
+        if len(parts) >= 5 and parts[2] == "documents" and parts[4] == "segments":
+            segments = self.segments.get(parts[3])
+            if segments is None:
+                return 404, {"message": "document not found"}
+            return self._segments(method, segments, parts[5:], query, body)
+
+        return 404, {"message": "not found"}
+
+    def _segments(self, method, segments, rest, query, body):
+        if not rest and method == "GET":
+            page, limit = int(query.get("page", 1)), int(query.get("limit", 20))
+            return 200, {"data": segments[(page - 1) * limit:page * limit]}
+        if not rest and method == "POST":
+            items = json.loads(body)["segments"]
+            contents = [item["content"] for item in items]
+            self.segment_posts.append(contents)
+            if self.reject_contents.intersection(contents):
+                return 500, {"message": "rejected"}
+            created = [{"id": self.next_id("seg"), **item} for item in items]
+            segments.extend(created)
+            return 200, {"data": created}
+        if len(rest) == 1:
+            index = next((i for i, s in enumerate(segments) if s["id"] == rest[0]), None)
+            if index is None:
+                return 404, {"message": "segment not found"}
+            if method == "DELETE":
+                segments.pop(index)
+                return 200, {"result": "success"}
+            if method == "POST":
+                segments[index].update(json.loads(body)["segment"])
+                return 200, {"data": segments[index]}
+        return 404, {"message": "not found"}
@@ -0,0 +1,89 @@
+"""批量切块：工作队列处理文档并记录每个文档的结果"""
+import asyncio
+import json
+import os
+import uuid
+
+import pytest
+
+from app.database import BatchTask, BatchTaskItem, Chunk, Document, Folder, get_db_session
+from app.services import batch_chunking
+from app.services.batch_chunking import BatchChunkingService
+from app.services.batch_items import batch_item_service
+from app.services.chunk_cache import chunk_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """切块缓存写入临时目录"""
+    monkeypatch.setattr(chunk_cache, "cache_dir", str(tmp_path / "chunk_cache"))
+
+
+def _make_task(tmp_dir, statuses):
+    """创建文件夹、文档（按给定状态）和批量切块任务，返回 (任务ID, 文档ID列表)"""
+    db = get_db_session()
+    try:
+        folder = Folder(name="批量", folder_path="批量")
+        db.add(folder)
+        db.flush()
+        doc_ids = []
+        for status in statuses:
+            filepath = os.path.join(tmp_dir, f"batch-{uuid.uuid4().hex[:8]}.txt")
+            with open(filepath, "w", encoding="utf-8") as f:
+                f.write("第一段内容。" * 20)
+            document = Document(filename=os.path.basename(filepath), filepath=filepath, filetype=".txt",
+                                filesize=os.path.getsize(filepath), status=status, folder_id=folder.id)
+            db.add(document)
+            db.flush()
+            doc_ids.append(document.id)
+        task_id = str(uuid.uuid4())
+        db.add(BatchTask(id=task_id, task_type="chunk", name="测试切块", folder_id=folder.id, status="waiting",
+                         total_count=len(doc_ids), success_count=0, error_count=0,
+                         document_ids=json.dumps(doc_ids), settings=json.dumps({})))
+        db.flush()
+        batch_item_service.create_items(db, task_id, doc_ids)
+        db.commit()
+        return task_id, doc_ids
+    finally:
+        db.close()
+
+
+def _run(task_id, doc_ids):
+    asyncio.run(BatchChunkingService()._process_batch_chunking(task_id, doc_ids, "text", 50, 5))
+    db = get_db_session()
+    try:
+        task = db.query(BatchTask).filter(BatchTask.id == task_id).one()
+        items = {item.document_id: item.status
+                 for item in db.query(BatchTaskItem).filter(BatchTaskItem.task_id == task_id)}
+        return task, items
+    finally:
+        db.close()
+
+
+def test_batch_chunking_processes_all_documents(tmp_dir):
+    task_id, doc_ids = _make_task(tmp_dir, ["未切块", "未切块"])
+
+    task, items = _run(task_id, doc_ids)
+
+    assert task.status == "completed"
+    assert task.success_count == 2
+    assert set(items.values()) == {"completed"}
+    db = get_db_session()
+    try:
+        assert db.query(Chunk).filter(Chunk.document_id.in_(doc_ids)).count() > 0
+        assert {d.status for d in db.query(Document).filter(Document.id.in_(doc_ids))} == {"已切块"}
+    finally:
+        db.close()
+
+
+def test_skipped_documents_count_towards_progress(tmp_dir, monkeypatch):
+    task_id, doc_ids = _make_task(tmp_dir, ["未切块", "处理中"])
+    updates = []
+    monkeypatch.setattr(batch_chunking.progress_bus, "update",
+                        lambda topic, data: updates.append(data))
+
+    task, items = _run(task_id, doc_ids)
+
+    assert items == {doc_ids[0]: "completed", doc_ids[1]: "skipped"}
+    assert (task.success_count, task.error_count) == (1, 1)
+    assert max(u["progress"] for u in updates if "progress" in u) == 100
@@ -0,0 +1,58 @@
+"""切块缓存：按文件删除、按保留天数和大小清理"""
+import os
+import time
+
+import pytest
+
+from app.config import APP_CONFIG
+from app.services.chunk_cache import ChunkCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setitem(APP_CONFIG, "CHUNK_CACHE_ENABLED", True)
+    monkeypatch.setitem(APP_CONFIG, "CHUNK_CACHE_MAX_AGE_DAYS", 30)
+    monkeypatch.setitem(APP_CONFIG, "CHUNK_CACHE_MAX_SIZE_MB", 0)
+    return ChunkCache(str(tmp_path / "chunk_cache"))
+
+
+def _put(cache, file_hash, chunk_size=100, content="x", mtime=None):
+    key = cache.make_key(file_hash, "text", "v1", chunk_size, 0)
+    writer = cache.writer(key)
+    writer.write({"content": content})
+    writer.commit()
+    if mtime is not None:
+        os.utime(cache._path(key), (mtime, mtime))
+    return key
+
+
+def test_remove_file_deletes_all_entries_of_that_file(cache):
+    a1 = _put(cache, "a" * 64, 100)
+    a2 = _put(cache, "a" * 64, 200)
+    b = _put(cache, "b" * 64)
+
+    cache.remove_file("a" * 64)
+
+    assert not cache.has(a1) and not cache.has(a2)
+    assert cache.has(b)
+
+
+def test_evict_removes_entries_older_than_max_age(cache):
+    old = _put(cache, "a" * 64, mtime=time.time() - 31 * 86400)
+    fresh = _put(cache, "b" * 64)
+
+    assert cache.evict() == 1
+    assert not cache.has(old)
+    assert cache.has(fresh)
+
+
+def test_evict_removes_least_recently_used_over_size_limit(cache, monkeypatch):
+    monkeypatch.setitem(APP_CONFIG, "CHUNK_CACHE_MAX_SIZE_MB", 1)
+    now = time.time()
+    big = "x" * (600 * 1024)
+    older = _put(cache, "a" * 64, content=big, mtime=now - 100)
+    newer = _put(cache, "b" * 64, content=big, mtime=now - 50)
+
+    assert cache.evict() == 1
+    assert not cache.has(older)
+    assert cache.has(newer)
@@ -0,0 +1,46 @@
+"""切块进程池：子进程异常退出后重建进程池"""
+import asyncio
+import os
+
+import pytest
+
+from app.config import APP_CONFIG
+from app.services import chunking
+
+
+def _crash_once(marker: str) -> str:
+    """第一次调用时直接退出子进程（模拟被系统杀死），之后正常返回"""
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(1)
+    return "ok"
+
+
+def _always_crash(marker: str) -> str:
+    os._exit(1)
+
+
+@pytest.fixture
+def small_pool(monkeypatch):
+    monkeypatch.setitem(APP_CONFIG, "CHUNK_PROCESS_WORKERS", 1)
+    yield
+    if chunking._process_pool is not None:
+        chunking.discard_process_pool(chunking._process_pool)
+
+
+def test_broken_pool_is_rebuilt_and_task_retried(small_pool, tmp_dir):
+    marker = os.path.join(tmp_dir, "crash-once")
+    first_pool = chunking.get_process_pool()
+
+    result = asyncio.run(chunking.run_in_process_pool(_crash_once, marker))
+
+    assert result == "ok"
+    assert chunking._process_pool is not None
+    assert chunking._process_pool is not first_pool
+
+
+def test_pool_broken_twice_raises_and_is_discarded(small_pool, tmp_dir):
+    with pytest.raises(chunking.BrokenProcessPool):
+        asyncio.run(chunking.run_in_process_pool(_always_crash, os.path.join(tmp_dir, "unused")))
+
+    assert chunking._process_pool is None
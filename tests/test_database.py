@@ -0,0 +1,68 @@
+"""数据库：SQLite调优参数校验和迁移"""
+import hashlib
+import json
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from app import database
+from app.database import Base
+from app.migrations import backfill_document_sha256, create_document_hash_index
+
+
+def test_pragmas_accept_known_values_case_insensitively(monkeypatch):
+    monkeypatch.setitem(database.DATABASE_CONFIG, "JOURNAL_MODE", "wal")
+    monkeypatch.setitem(database.DATABASE_CONFIG, "SYNCHRONOUS", "normal")
+
+    statements = database._sqlite_pragmas()
+
+    assert statements[:2] == ["PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL"]
+
+
+@pytest.mark.parametrize("key, value", [
+    ("JOURNAL_MODE", "WAL; DROP TABLE documents"),
+    ("SYNCHRONOUS", "NORMAL; PRAGMA foreign_keys=OFF"),
+])
+def test_pragmas_reject_unknown_values(monkeypatch, key, value):
+    monkeypatch.setitem(database.DATABASE_CONFIG, key, value)
+
+    with pytest.raises(ValueError):
+        database._sqlite_pragmas()
+
+
+def test_hash_index_migration_creates_only_its_own_index(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for index in inspect(conn).get_indexes("documents"):
+            conn.execute(text(f"DROP INDEX {index['name']}"))
+
+    with engine.begin() as conn:
+        create_document_hash_index(conn)
+
+    assert [index["name"] for index in inspect(engine).get_indexes("documents")] == ["ix_documents_hash"]
+
+
+def test_md5_document_hash_is_recomputed_as_sha256(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    Base.metadata.create_all(bind=engine)
+    content = b"legacy upload"
+    filepath = tmp_path / "legacy.txt"
+    filepath.write_bytes(content)
+    md5 = hashlib.md5(content).hexdigest()
+    params = {"strategy": "text", "size": 300, "overlap": 30, "strategy_version": "v1", "file_hash": md5}
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO documents (id, filename, filepath, hash, last_chunk_params) "
+                          "VALUES (1, 'legacy.txt', :path, :hash, :params), "
+                          "(2, 'gone.txt', :gone, :hash, NULL)"),
+                     {"path": str(filepath), "gone": str(tmp_path / "gone.txt"), "hash": md5,
+                      "params": json.dumps(params)})
+
+    with engine.begin() as conn:
+        backfill_document_sha256(conn)
+
+    with engine.begin() as conn:
+        rows = dict(conn.execute(text("SELECT id, hash FROM documents")).fetchall())
+        saved = json.loads(conn.execute(text("SELECT last_chunk_params FROM documents WHERE id = 1")).scalar())
+    assert rows == {1: hashlib.sha256(content).hexdigest(), 2: None}
+    assert saved == {**params, "file_hash": rows[1]}
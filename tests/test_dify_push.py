@@ -0,0 +1,173 @@
+"""批量推送：通过异步客户端与本地Dify桩服务交互"""
+import asyncio
+import json
+import os
+import uuid
+
+import pytest
+
+from app.config import DIFY_CONFIG
+from app.database import BatchTask, BatchTaskItem, Chunk, DifySegment, Document, Folder, get_db_session
+from app.services import dify_segments, to_dify_batch
+from app.services.batch_items import batch_item_service
+from app.services.dify_client import close_async_dify_client
+from app.services.dify_indexing import IndexingWatcher
+from app.services.dify_sync import dify_sync_service
+from app.services.job_queue import LeaseLostError
+from app.services.to_dify_batch import DifyBatchService
+
+from .dify_stub import DATASET_ID, DifyStub
+
+
+@pytest.fixture(scope="module")
+def stub_server():
+    server = DifyStub().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def stub(stub_server, monkeypatch):
+    """指向桩服务，并去掉重试等待"""
+    stub_server.reset()
+    monkeypatch.setitem(DIFY_CONFIG, "API_SERVER", stub_server.url)
+    monkeypatch.setitem(DIFY_CONFIG, "SEGMENT_BATCH_SIZE", 2)
+    monkeypatch.setitem(DIFY_CONFIG, "SEGMENT_MAX_RETRIES", 1)
+    monkeypatch.setattr(to_dify_batch.dify_service, "api_server", stub_server.url)
+    monkeypatch.setattr(to_dify_batch, "CREATE_RETRY_DELAY", 0)
+    monkeypatch.setattr(dify_segments, "RESEND_DELAY", 0)
+    monkeypatch.setattr(IndexingWatcher, "_first_delay", lambda self, pending: 0)
+    return stub_server
+
+
+def _make_document(tmp_dir, contents):
+    """创建已切块的文档，返回文档ID"""
+    filename = f"doc-{uuid.uuid4().hex[:8]}.txt"
+    filepath = os.path.join(tmp_dir, filename)
+    with open(filepath, "w", encoding="utf-8") as f:
+        f.write("\n".join(contents))
+
+    db = get_db_session()
+    try:
+        folder = Folder(name="测试", folder_path=tmp_dir)
+        db.add(folder)
+        db.flush()
+        document = Document(filename=filename, filepath=filepath, status="已切块", folder_id=folder.id,
+                            last_chunk_params=json.dumps({"chunk_size": 100}))
+        db.add(document)
+        db.flush()
+        db.add_all([Chunk(document_id=document.id, sequence=i, content=content, chunk_metadata={})
+                    for i, content in enumerate(contents)])
+        db.commit()
+        return document.id, folder.id
+    finally:
+        db.close()
+
+
+def _push(doc_id, folder_id):
+    """执行一次批量推送任务，返回该文档的结果"""
+    task_id = str(uuid.uuid4())
+    db = get_db_session()
+    try:
+        db.add(BatchTask(id=task_id, task_type="to_dify", name="测试推送", folder_id=folder_id,
+                         dataset_id=DATASET_ID, status="waiting", total_count=1, success_count=0,
+                         error_count=0, document_ids=json.dumps([doc_id]), settings=json.dumps({})))
+        db.flush()
+        batch_item_service.create_items(db, task_id, [doc_id])
+        db.commit()
+    finally:
+        db.close()
+
+    async def run():
+        try:
+            await DifyBatchService()._process_batch_to_dify(task_id, [doc_id], DATASET_ID)
+        finally:
+            await close_async_dify_client()
+
+    asyncio.run(run())
+
+    db = get_db_session()
+    try:
+        item = db.query(BatchTaskItem).filter(BatchTaskItem.task_id == task_id).one()
+        document = db.query(Document).filter(Document.id == doc_id).one()
+        mappings = db.query(DifySegment).filter(DifySegment.document_id == doc_id).count()
+        return item.status, item.details, document, mappings
+    finally:
+        db.close()
+
+
+def test_batch_push_creates_document_and_segments(stub, tmp_dir):
+    doc_id, folder_id = _make_document(tmp_dir, ["一", "二", "三"])
+
+    status, _, document, mappings = _push(doc_id, folder_id)
+
+    assert status == "completed"
+    assert document.dify_push_status == "pushed"
+    assert len(stub.documents) == 1
+    dify_id = next(iter(stub.documents))
+    assert [s["content"] for s in stub.segments[dify_id]] == ["一", "二", "三"]
+    assert mappings == 3
+
+
+def test_create_retry_reuses_document_created_by_lost_response(stub, tmp_dir):
+    doc_id, folder_id = _make_document(tmp_dir, ["一", "二"])
+    stub.fail_create_after_commit = 1
+
+    status, _, _, _ = _push(doc_id, folder_id)
+
+    assert status == "completed"
+    assert len(stub.documents) == 1
+    assert sum(1 for method, path in stub.requests if path.endswith("/create-by-file")) == 1
+
+
+def test_failed_ranges_are_resent_into_same_document(stub, tmp_dir):
+    contents = ["一", "二", "三", "四", "五"]
+    doc_id, folder_id = _make_document(tmp_dir, contents)
+    stub.reject_contents = {"四"}
+
+    status, details, document, _ = _push(doc_id, folder_id)
+
+    assert status == "failed"
+    assert details["failed_ranges"] == [[2, 4]]
+    assert document.dify_push_state["failed_ranges"] == [[2, 4]]
+
+    stub.reject_contents = set()
+    stub.segment_posts.clear()
+    status, details, document, mappings = _push(doc_id, folder_id)
+
+    assert status == "completed"
+    assert details["resumed"] is True
+    assert stub.segment_posts == [["三", "四"]]
+    assert len(stub.documents) == 1
+    dify_id = next(iter(stub.documents))
+    assert sorted(s["content"] for s in stub.segments[dify_id]) == sorted(contents)
+    assert document.dify_push_state is None
+    assert document.dify_push_status == "pushed"
+    assert mappings == 5
+
+
+def test_sync_stops_when_lease_is_lost(stub, tmp_dir):
+    doc_id, folder_id = _make_document(tmp_dir, ["一", "二"])
+    _push(doc_id, folder_id)
+    db = get_db_session()
+    try:
+        db.query(Chunk).filter(Chunk.document_id == doc_id, Chunk.sequence == 0).update({Chunk.content: "改"})
+        db.add(Chunk(document_id=doc_id, sequence=2, content="三", chunk_metadata={}))
+        db.commit()
+    finally:
+        db.close()
+    stub.requests.clear()
+
+    def check_lease():
+        raise LeaseLostError("租约已失效")
+
+    async def run():
+        try:
+            await dify_sync_service.sync_document_async(doc_id, DATASET_ID, check_lease)
+        finally:
+            await close_async_dify_client()
+
+    with pytest.raises(LeaseLostError):
+        asyncio.run(run())
+    # 只确认了Dify文档存在，没有更新或追加段落
+    assert [method for method, _ in stub.requests] == ["GET"]
@@ -0,0 +1,44 @@
+"""文件夹上传：并发写入内容存储，分批登记文档"""
+import asyncio
+import io
+
+import pytest
+from fastapi import UploadFile
+
+from app.config import APP_CONFIG
+from app.database import Blob, Document, Folder, get_db_session
+from app.services.batch_chunking import BatchChunkingService
+from app.services.blob_store import blob_store
+
+
+@pytest.fixture
+def blob_root(tmp_path, monkeypatch):
+    """内容存储指向临时目录"""
+    root = str(tmp_path / "blobs")
+    monkeypatch.setattr(blob_store, "root", root)
+    monkeypatch.setattr(blob_store, "tmp_dir", str(tmp_path / "blobs" / "tmp"))
+    monkeypatch.setitem(APP_CONFIG, "UPLOAD_COMMIT_BATCH_SIZE", 2)
+    return root
+
+
+def test_folder_upload_registers_documents_in_batches(blob_root):
+    db = get_db_session()
+    try:
+        folder = Folder(name="上传", folder_path="上传")
+        db.add(folder)
+        db.commit()
+        contents = [b"alpha", b"beta", b"alpha", b"gamma", b"delta"]
+        files = [UploadFile(io.BytesIO(data), filename=f"sub/f{i}.txt") for i, data in enumerate(contents)]
+        files.append(UploadFile(io.BytesIO(b"x"), filename="bad.exe"))
+
+        result = asyncio.run(BatchChunkingService().upload_documents_to_folder(folder.id, files, db))
+
+        assert [item["filename"] for item in result["success"]] == [f"sub/f{i}.txt" for i in range(5)]
+        assert [item["filename"] for item in result["failed"]] == ["bad.exe"]
+        documents = db.query(Document).filter(Document.folder_id == folder.id).all()
+        assert len(documents) == 5
+        alpha = next(d for d in documents if d.filename == "sub/f0.txt")
+        assert db.get(Blob, alpha.hash).ref_count == 2
+        assert sum(1 for item in result["success"] if item["duplicate"]) == 1
+    finally:
+        db.close()
@@ -0,0 +1,167 @@
+"""任务队列：最终失败时调用恢复函数，租约失效时停止执行"""
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Query
+
+from app.database import BatchTask, Document, Job, get_db_session
+from app.services import job_handlers
+from app.services.job_queue import JobContext, JobError, JobQueue, JobWorker, job_queue
+
+
+def _run_once(queue: JobQueue, worker: JobWorker):
+    """领取一个任务并在当前线程中执行"""
+    jobs = queue.claim(worker.worker_id, 1)
+    assert len(jobs) == 1
+    job = jobs[0]
+    ctx = JobContext(job["id"], job["attempts"])
+    worker._execute(job, ctx)
+    return job["id"]
+
+
+def _make_queue(handler):
+    queue = JobQueue()
+    recovered = []
+    queue.register("test", handler, recovered.append)
+    return queue, JobWorker(queue, 1, worker_id="test-worker"), recovered
+
+
+def test_job_error_fails_and_recovers():
+    def handler(payload, ctx):
+        raise JobError("文档不存在")
+
+    queue, worker, recovered = _make_queue(handler)
+    queue.enqueue("test", {"document_id": 1})
+    job_id = _run_once(queue, worker)
+
+    job = queue.get_job(job_id)
+    assert job["status"] == "failed"
+    assert job["error_message"] == "文档不存在"
+    assert recovered == [{"document_id": 1}]
+
+
+def test_exhausted_attempts_fail_and_recover():
+    def handler(payload, ctx):
+        raise RuntimeError("连接中断")
+
+    queue, worker, recovered = _make_queue(handler)
+    job_id, _ = queue.enqueue("test", {"document_id": 2})
+    max_attempts = queue.get_job(job_id)["max_attempts"]
+
+    for attempt in range(1, max_attempts + 1):
+        _run_once(queue, worker)
+        job = queue.get_job(job_id)
+        if attempt < max_attempts:
+            assert job["status"] == "waiting"
+            assert recovered == []
+
+    assert job["status"] == "failed"
+    assert recovered == [{"document_id": 2}]
+
+
+def test_lease_lost_stops_without_recording_result():
+    def handler(payload, ctx):
+        ctx.lease_lost = True
+        ctx.check_lease()
+        raise AssertionError("租约失效后不应继续执行")
+
+    queue, worker, recovered = _make_queue(handler)
+    job_id, _ = queue.enqueue("test", {})
+    _run_once(queue, worker)
+
+    # 任务保持执行中，租约到期后由其他工作进程重新领取
+    assert queue.get_job(job_id)["status"] == "processing"
+    assert recovered == []
+
+
+def test_chunk_job_for_missing_file_restores_document(tmp_dir):
+    db = get_db_session()
+    try:
+        document = Document(filename="missing.txt", filepath=f"{tmp_dir}/missing.txt", status="处理中")
+        db.add(document)
+        db.commit()
+        document_id = document.id
+    finally:
+        db.close()
+
+    job_queue.enqueue("chunk", {"document_id": document_id, "chunk_strategy": "text",
+                                "chunk_size": 300, "overlap": 30})
+    job_id = _run_once(job_queue, JobWorker(job_queue, 1, worker_id="test-worker"))
+
+    db = get_db_session()
+    try:
+        assert db.get(Job, job_id).status == "failed"
+        assert db.get(Document, document_id).status == "未切块"
+    finally:
+        db.close()
+
+
+def test_failed_batch_task_keeps_reason():
+    db = get_db_session()
+    try:
+        db.add(BatchTask(id="batch-failed", task_type="chunk", name="test", status="processing"))
+        db.commit()
+    finally:
+        db.close()
+
+    job_handlers._fail_batch_task("batch-failed", "任务多次中断，已停止")
+
+    db = get_db_session()
+    try:
+        task = db.get(BatchTask, "batch-failed")
+        assert task.status == "failed"
+        assert task.error_message == "任务多次中断，已停止"
+    finally:
+        db.close()
+
+
+def test_active_dedupe_key_is_unique():
+    db = get_db_session()
+    try:
+        db.add(Job(id="dup-done", job_type="test", dedupe_key="dup", status="completed"))
+        db.add(Job(id="dup-1", job_type="test", dedupe_key="dup", status="waiting"))
+        db.commit()
+        db.add(Job(id="dup-2", job_type="test", dedupe_key="dup", status="processing"))
+        with pytest.raises(IntegrityError):
+            db.commit()
+    finally:
+        db.close()
+
+
+def test_enqueue_returns_existing_job_when_insert_races(monkeypatch):
+    queue, _, _ = _make_queue(lambda payload, ctx: None)
+    job_id, _ = queue.enqueue("test", {}, dedupe_key="race")
+
+    # 模拟另一个请求在检查之后、插入之前加入了同一键的任务：第一次检查看不到已有的任务
+    first = Query.first
+    calls = []
+
+    def first_misses_once(self):
+        calls.append(1)
+        return None if len(calls) == 1 else first(self)
+
+    monkeypatch.setattr(Query, "first", first_misses_once)
+    assert queue.enqueue("test", {}, dedupe_key="race") == (job_id, False)
+    monkeypatch.undo()
+
+    db = get_db_session()
+    try:
+        assert db.query(Job).filter(Job.dedupe_key == "race").count() == 1
+    finally:
+        db.close()
+
+
+def test_stop_requeues_active_jobs_without_counting_attempt():
+    queue, worker, _ = _make_queue(lambda payload, ctx: None)
+    job_id, _ = queue.enqueue("test", {})
+    max_attempts = queue.get_job(job_id)["max_attempts"]
+
+    # 多次在执行中正常停止，任务仍然可以领取，不会因次数用完而失败
+    for _ in range(max_attempts + 1):
+        job = queue.claim(worker.worker_id, 1)[0]
+        worker._active[job_id] = JobContext(job_id, job["attempts"])
+        worker._threads = [object()]
+        worker.stop()
+        worker._active.clear()
+        job = queue.get_job(job_id)
+        assert job["status"] == "waiting"
+        assert job["attempts"] == 0
@@ -0,0 +1,37 @@
+"""进度推送：连接时的完整状态"""
+import asyncio
+
+from app.services.progress_bus import ProgressBus
+
+
+def _first_snapshot(bus, topic, snapshot):
+    async def run():
+        stream = bus.stream(topic, snapshot)
+        try:
+            return await stream.__anext__()
+        finally:
+            await stream.aclose()
+    return asyncio.run(run())
+
+
+def test_local_topic_is_completed_from_database_snapshot():
+    bus = ProgressBus()
+    bus.update("task:1", {"status": "processing", "success_count": 3, "error_count": 0})
+
+    event, state = _first_snapshot(bus, "task:1", lambda: {
+        "name": "批量推送", "status": "processing", "total_count": 10, "success_count": 2, "error_count": 0
+    })
+
+    assert event == "snapshot"
+    assert state["name"] == "批量推送"
+    assert state["total_count"] == 10
+    # 本进程发布的计数比数据库中的新，保持不变
+    assert state["success_count"] == 3
+
+
+def test_remote_topic_uses_database_snapshot():
+    bus = ProgressBus()
+
+    event, state = _first_snapshot(bus, "task:2", lambda: {"name": "批量切块", "status": "completed"})
+
+    assert (event, state) == ("snapshot", {"name": "批量切块", "status": "completed"})
@@ -0,0 +1,90 @@
+"""切块策略注册表：策略类的识别和扫描缓存"""
+import sys
+import textwrap
+
+import pytest
+
+from app.chunk_func import registry as registry_module
+from app.chunk_func.registry import StrategyRegistry
+
+STRATEGY = '''
+from app.chunk_func.base import BaseChunkStrategy
+
+class {cls}(BaseChunkStrategy):
+    def chunk_no_meta(self, file_path, chunk_size, overlap):
+        return []
+    def get_metadata(self):
+        return {{"name": "{name}"}}
+'''
+
+
+@pytest.fixture
+def strategy_dir(tmp_path, monkeypatch):
+    package = tmp_path / "teststrategies"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield package
+    for name in [m for m in sys.modules if m == "teststrategies" or m.startswith("teststrategies.")]:
+        del sys.modules[name]
+
+
+def _write(package, filename, source):
+    (package / filename).write_text(textwrap.dedent(source))
+
+
+def test_reexported_strategy_is_registered_once_under_defining_file(strategy_dir):
+    _write(strategy_dir, "b_strategy.py", STRATEGY.format(cls="BStrategy", name="b"))
+    # 只重新导出 b 中的策略，另外定义一个自己的策略
+    _write(strategy_dir, "a_strategy.py", "from .b_strategy import BStrategy\n"
+           + STRATEGY.format(cls="AStrategy", name="a"))
+    _write(strategy_dir, "c_strategy.py", "from .b_strategy import BStrategy as CStrategy\n")
+    registry = StrategyRegistry(str(strategy_dir), "teststrategies")
+
+    names = [m["name"] for m in registry.list_metadata()]
+
+    assert sorted(names) == ["a", "b"]
+    b_entry = registry._entries["b_strategy.py"]
+    assert registry.get_strategy_version("b") == b_entry["version"]
+
+
+def test_reexport_only_module_still_provides_strategy(strategy_dir, tmp_path, monkeypatch):
+    other = tmp_path / "teststrategies_lib.py"
+    other.write_text(textwrap.dedent(STRATEGY.format(cls="LibStrategy", name="lib")))
+    _write(strategy_dir, "lib_strategy.py", "from teststrategies_lib import LibStrategy\n")
+    registry = StrategyRegistry(str(strategy_dir), "teststrategies")
+
+    assert registry.get_strategy_class("lib").__name__ == "LibStrategy"
+    sys.modules.pop("teststrategies_lib", None)
+
+
+def test_lookups_reuse_scan_until_interval_or_directory_change(strategy_dir, monkeypatch):
+    _write(strategy_dir, "a_strategy.py", STRATEGY.format(cls="AStrategy", name="a"))
+    registry = StrategyRegistry(str(strategy_dir), "teststrategies")
+    registry.get_strategy_class("a")
+
+    scans = []
+    original = registry._scan
+    monkeypatch.setattr(registry, "_scan", lambda: (scans.append(1), original()))
+    monkeypatch.setattr(registry_module, "SCAN_INTERVAL", 3600)
+    for _ in range(5):
+        registry.get_strategy_version("a")
+        registry.get_instance("a")
+    assert scans == []
+
+    # 新增文件改变目录的修改时间，下一次查询立即重新扫描
+    registry._dir_mtime = -1
+    _write(strategy_dir, "n_strategy.py", STRATEGY.format(cls="NStrategy", name="n"))
+    assert registry.get_strategy_class("n").__name__ == "NStrategy"
+    assert scans == [1]
+
+
+def test_invalidate_file_rescans_on_next_lookup(strategy_dir, monkeypatch):
+    _write(strategy_dir, "a_strategy.py", STRATEGY.format(cls="AStrategy", name="a"))
+    registry = StrategyRegistry(str(strategy_dir), "teststrategies")
+    assert registry.get_strategy_class("a").__name__ == "AStrategy"
+    monkeypatch.setattr(registry_module, "SCAN_INTERVAL", 3600)
+
+    registry.invalidate("a_strategy.py")
+
+    assert registry.get_strategy_class("a").__name__ == "AStrategy"
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+ChunkSpace任务工作进程
+
+从共享数据库的任务队列中领取切块和Dify推送任务执行，与Web服务分开运行。
+配合 JOB_WORKER_MODE=external 使用时，Web进程只负责页面和接口，不再执行任务；
+可以在多个终端或多台机器上（使用同一个 DATABASE_URL）同时运行多个工作进程。
+
+用法:
+    python worker.py                      # 启动一个工作进程
+    python worker.py --processes 4        # 启动4个工作进程
+    python worker.py --concurrency 8      # 每个工作进程同时执行8个任务
+"""
+import sys
+import signal
+import argparse
+import logging
+import threading
+import multiprocessing
+
+from app.config import APP_CONFIG
+
+
+def run_worker(concurrency: int):
+    """在当前进程中运行任务工作进程，收到 Ctrl+C 或 SIGTERM 后退出"""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(name)s: %(message)s")
+
+    from app.database import create_tables
+    from app.chunk_func.registry import strategy_registry
+    from app.services.job_queue import start_worker, stop_worker
+
+    # 与Web服务相同：确保数据库表存在，并加载切块策略
+    create_tables()
+    strategy_registry.refresh()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    start_worker(concurrency)
+    while not stop_event.wait(1):
+        pass
+    # 执行中的任务重新排队，由其他工作进程或下次启动时继续
+    stop_worker()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChunkSpace任务工作进程")
+    parser.add_argument("--processes", type=int, default=1, help="启动的工作进程数（默认1）")
+    parser.add_argument("--concurrency", type=int, default=APP_CONFIG['JOB_WORKER_CONCURRENCY'],
+                        help="每个工作进程同时执行的任务数（默认为配置 JOB_WORKER_CONCURRENCY）")
+    args = parser.parse_args()
+
+    print(f"""
+    ┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┓
+    ┃  ChunkSpace - 任务工作进程          ┃
+    ┣━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┫
+    ┃  进程数: {args.processes:<4} 每进程并发: {args.concurrency:<4}    ┃
+    ┃  按 Ctrl+C 退出                        ┃
+    ┗━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┛
+    """)
+
+    if APP_CONFIG['JOB_WORKER_MODE'] != 'external':
+        print("提示: 当前 JOB_WORKER_MODE 不是 external，Web服务也会执行任务")
+
+    if args.processes <= 1:
+        run_worker(args.concurrency)
+        return
+
+    # 多个工作进程：使用spawn启动，每个进程各自连接数据库
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(args.concurrency,), name=f"worker-{i + 1}")
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    def terminate(*_):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Ctrl+C 会同时发给子进程，等待它们释放任务后退出
+        for process in processes:
+            process.join()
+    print("\n已停止任务工作进程")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()